@@ -0,0 +1,129 @@
+"""Нагрузочный тест обработки команд: синхронный TeleBot против асинхронного режима.
+
+Одновременно приходит N команд (/next5, /next5all, /vacations, /vacationsall, /birthdays)
+от админа из разных чатов; Telegram и БД заменены локальными заглушками с задержкой.
+Задержка команды — время от передачи обновлений боту до получения ответа поддельным Telegram.
+
+Запуск из корня репозитория: python -m benchmarks.bench_async [команд] [сотрудников]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import telebot
+import telebot.apihelper
+import telebot.asyncio_helper
+from telebot.types import Update
+
+import remindbot2
+from benchmarks.fakes import (
+    FakeAsyncSnapshotCache,
+    FakeSnapshotCache,
+    FakeTelegram,
+    command_update,
+    synthetic_snapshot,
+    write_config,
+)
+
+ADMIN_ID = 1
+COMMANDS = ['next5', 'next5all', 'vacations', 'vacationsall', 'birthdays']
+TELEGRAM_LATENCY = 0.05
+DB_LATENCY = 0.005
+OUTBOX_GLOBAL_RATE = 10000
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def make_updates(count, first_chat_id=1000):
+    return [
+        Update.de_json(command_update(i + 1, first_chat_id + i, ADMIN_ID, COMMANDS[i % len(COMMANDS)]))
+        for i in range(count)
+    ]
+
+
+def wait_for_replies(fake, count, timeout=300):
+    deadline = time.monotonic() + timeout
+    while fake.count() < count:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'получено {fake.count()} ответов из {count}')
+        time.sleep(0.005)
+
+
+def latencies(fake, started):
+    first_reply = {}
+    for _, chat_id, received in fake.requests:
+        first_reply.setdefault(chat_id, received)
+    return [received - started for received in first_reply.values()]
+
+
+def configure(runtime, fake, snapshot, config_dir):
+    # Общий лимит Bot API (30 сообщ./с) здесь не нужен: меряем обработку команд, а не очередь отправки
+    config_path = write_config(os.path.join(config_dir, f'{runtime}.cfg'), admin_chat_id=ADMIN_ID, runtime=runtime,
+                               outbox_global_rate=OUTBOX_GLOBAL_RATE)
+    remindbot2.init(config_path=config_path, greet=False)
+    remindbot2.snapshot_cache = FakeSnapshotCache(snapshot, DB_LATENCY)
+    remindbot2.birthday_image_cache.clear()
+    telebot.apihelper.API_URL = fake.api_url
+    telebot.asyncio_helper.API_URL = fake.api_url
+    if runtime == 'async':
+        remindbot2.async_snapshot_cache = FakeAsyncSnapshotCache(snapshot, DB_LATENCY)
+
+
+def run_sync(count, snapshot, config_dir):
+    fake = FakeTelegram(TELEGRAM_LATENCY).start()
+    try:
+        configure('sync', fake, snapshot, config_dir)
+        updates = make_updates(count)
+        started = time.perf_counter()
+        remindbot2.bot.process_new_updates(updates)
+        wait_for_replies(fake, count)
+        return latencies(fake, started)
+    finally:
+        fake.stop()
+
+
+def run_async(count, snapshot, config_dir):
+    fake = FakeTelegram(TELEGRAM_LATENCY).start()
+
+    async def dispatch():
+        updates = make_updates(count)
+        started = time.perf_counter()
+        try:
+            await remindbot2.async_bot.process_new_updates(updates)
+        finally:
+            await remindbot2.async_bot.close_session()
+        return started
+
+    try:
+        configure('async', fake, snapshot, config_dir)
+        started = asyncio.run(dispatch())
+        wait_for_replies(fake, count)
+        return latencies(fake, started)
+    finally:
+        fake.stop()
+        remindbot2.render_executor.shutdown(wait=True)
+
+
+def main(count=100, employees=5000):
+    # Свой обработчик до init(): setup_logging() тогда не создает bot.log
+    logging.basicConfig(level=logging.WARNING)
+    snapshot = synthetic_snapshot(employees)
+    print(f'команд: {count}, сотрудников: {employees}, '
+          f'задержка Telegram {TELEGRAM_LATENCY * 1000:.0f} мс, БД {DB_LATENCY * 1000:.0f} мс')
+    with tempfile.TemporaryDirectory() as config_dir:
+        for name, run in (('sync', run_sync), ('async', run_async)):
+            values = run(count, snapshot, config_dir)
+            print(f'{name:>6}: p50 {percentile(values, 0.5) * 1000:8.1f} мс, '
+                  f'p99 {percentile(values, 0.99) * 1000:8.1f} мс, '
+                  f'все {max(values) * 1000:8.1f} мс')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
@@ -0,0 +1,85 @@
+"""Сравнение прежнего расчета "следующих 5 дней рождения" с BirthdayIndex.
+
+Запуск из корня репозитория: python -m benchmarks.bench_birthdays [кол-во сотрудников]
+"""
+import random
+import sys
+import time
+from datetime import date, datetime
+
+from roster import BirthdayIndex
+
+
+def synthetic_birthdays(count, seed=42):
+    """Синтетические (ФИО, 'DD.MM'), включая 29.02 и битые даты"""
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(count):
+        roll = rnd.random()
+        if roll < 0.001:
+            birthday = '29.02'
+        elif roll < 0.002:
+            birthday = rnd.choice(['31.02', '00.13', 'abc', ''])
+        else:
+            day = date.fromordinal(date(2001, 1, 1).toordinal() + rnd.randrange(365))
+            birthday = day.strftime('%d.%m')
+        rows.append((f'Сотрудник{i} Имя{i % 97}', birthday))
+    return rows
+
+
+def legacy_next_5(rows, today):
+    """Алгоритм get_next_5_birthdays до появления индекса"""
+    birthday_data = []
+    for fullname, birthday in rows:
+        try:
+            day, month = map(int, birthday.split('.'))
+            bday_this_year = datetime(today.year, month, day).date()
+            if bday_this_year < today:
+                days_until = (datetime(today.year + 1, month, day).date() - today).days
+            else:
+                days_until = (bday_this_year - today).days
+            birthday_data.append((fullname, birthday, days_until))
+        except Exception:
+            continue
+    birthday_data.sort(key=lambda x: x[2])
+    result = []
+    unique_days = set()
+    for fullname, birthday, days_until in birthday_data:
+        if len(unique_days) < 5 or days_until in unique_days:
+            result.append((fullname, birthday, days_until))
+            unique_days.add(days_until)
+        else:
+            break
+    return result
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(count=100_000, repeat=5):
+    import logging
+    logging.disable(logging.INFO)  # индекс пишет в лог каждую битую дату
+
+    rows = synthetic_birthdays(count)
+    today = date(2026, 2, 27)
+
+    legacy = timed(lambda: legacy_next_5(rows, today), repeat)
+    build = timed(lambda: BirthdayIndex(rows), repeat)
+    index = BirthdayIndex(rows)
+    query = timed(lambda: index.next_dates(today, 5), repeat * 100)
+
+    print(f'сотрудников: {count}')
+    print(f'прежний алгоритм, на каждый запрос: {legacy * 1000:9.2f} мс')
+    print(f'построение индекса, раз на выгрузку: {build * 1000:9.2f} мс')
+    print(f'запрос к индексу next_dates(5):     {query * 1000:9.4f} мс')
+    print(f'ускорение запроса: x{legacy / query:,.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
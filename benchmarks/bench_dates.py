@@ -0,0 +1,139 @@
+"""Пакетный разбор дат (datebatch) против построчных циклов на большой выгрузке.
+
+Сравниваются: сборка BirthdayIndex и VacationIndex (построчная ветка включается через
+roster.BATCH_ROWS), ближайшие дни рождения и категории /birthdays по потоку строк,
+отбор отпусков по окну. Результаты обеих версий сверяются перед замером.
+
+Запуск из корня репозитория: python -m benchmarks.bench_dates [кол-во сотрудников]
+"""
+import heapq
+import logging
+import sys
+import time
+from datetime import date, timedelta
+
+import roster
+from benchmarks.fakes import synthetic_roster
+from datebatch import birthday_bucket_bounds
+from roster import (
+    BirthdayIndex,
+    RosterView,
+    VacationIndex,
+    birthday_in_year,
+    birthdays_by_bucket,
+    next_birthdays,
+    parse_birthdays,
+    parse_vacation_date,
+    vacations_overlapping,
+)
+
+
+def row_by_row(build):
+    """build() с построчным разбором дат, как до datebatch"""
+    batch_rows = roster.BATCH_ROWS
+    roster.BATCH_ROWS = float('inf')
+    try:
+        return build()
+    finally:
+        roster.BATCH_ROWS = batch_rows
+
+
+def legacy_next_birthdays(rows, today, count=5):
+    """next_birthdays до datebatch: разбор и куча по одной строке"""
+    dates = {}
+    farthest = []
+    for key, fullname, birthday in parse_birthdays(rows):
+        when = birthday_in_year(*key, today.year)
+        if when < today:
+            when = birthday_in_year(*key, today.year + 1)
+        days = (when - today).days
+        people = dates.get(days)
+        if people is None:
+            if len(dates) < count:
+                heapq.heappush(farthest, -days)
+            elif count and days < -farthest[0]:
+                del dates[-heapq.heappushpop(farthest, -days)]
+            else:
+                continue
+            people = dates[days] = []
+        people.append((key, fullname, birthday))
+    return [
+        (fullname, birthday, days)
+        for days in sorted(dates)
+        for _, fullname, birthday in sorted(dates[days])
+    ]
+
+
+def legacy_buckets(rows, today):
+    """Категории /birthdays через индекс по всем строкам, как format_birthday_dataframe"""
+    index = row_by_row(lambda: BirthdayIndex(rows))
+    result = []
+    seen = set()
+    for sort, (start, end) in enumerate(birthday_bucket_bounds(today)):
+        for _, fullname, birthday in index.between(start, end):
+            if fullname not in seen:
+                seen.add(fullname)
+                result.append((sort, fullname, birthday))
+    return result
+
+
+def legacy_overlapping(rows, first, last):
+    for row in rows:
+        try:
+            start_date = parse_vacation_date(row[1])
+            end_date = parse_vacation_date(row[2])
+        except (ValueError, TypeError, AttributeError):
+            continue
+        if end_date >= first and start_date <= last:
+            yield row[0], start_date, end_date
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(count=100_000, repeat=3):
+    logging.disable(logging.INFO)  # битые даты синтетической выгрузки не нужны в выводе
+
+    today = date(2026, 2, 27)
+    view = RosterView(roster.Employee(*row) for row in synthetic_roster(count, today=today))
+    birthdays, vacations = view.birthdays, view.vacations
+    last = today + timedelta(days=30)
+
+    def same_birthday_index(a, b):
+        return a._keys == b._keys and a._people == b._people and a.malformed == b.malformed
+
+    def same_vacation_index(a, b):
+        return a._entries == b._entries and a._long == b._long and a.malformed == b.malformed
+
+    cases = [
+        ('BirthdayIndex', lambda: row_by_row(lambda: BirthdayIndex(birthdays)),
+         lambda: BirthdayIndex(birthdays), same_birthday_index),
+        ('VacationIndex', lambda: row_by_row(lambda: VacationIndex(vacations)),
+         lambda: VacationIndex(vacations), same_vacation_index),
+        ('next_birthdays (поток)', lambda: legacy_next_birthdays(iter(birthdays), today),
+         lambda: next_birthdays(iter(birthdays), today), None),
+        ('категории /birthdays', lambda: legacy_buckets(birthdays, today),
+         lambda: birthdays_by_bucket(iter(birthdays), today), None),
+        ('отпуска в окне (поток)', lambda: list(legacy_overlapping(iter(vacations), today, last)),
+         lambda: list(vacations_overlapping(iter(vacations), today, last)), None),
+    ]
+
+    print(f'сотрудников: {count}, дней рождения: {len(birthdays)}, отпусков: {len(vacations)}')
+    print(f'{"":>24} {"построчно":>12} {"datebatch":>12}')
+    for name, legacy, batch, same in cases:
+        expected, actual = legacy(), batch()
+        if not (same(expected, actual) if same else expected == actual):
+            raise AssertionError(f'{name}: результаты построчной и пакетной версий различаются')
+        legacy_time = timed(legacy, repeat)
+        batch_time = timed(batch, repeat)
+        print(f'{name:>24} {legacy_time * 1000:9.1f} мс {batch_time * 1000:9.1f} мс  x{legacy_time / batch_time:.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,88 @@
+"""Сравнение стоимости вызова логирования: прежняя схема против log_pipeline.
+
+Прежняя: FileHandler и StreamHandler прямо на корневом логгере, сообщение собирается
+f-строкой, а log_info() достает имя функции и строку через inspect. Новая: запись уходит
+в очередь, форматирование (JSON) и запись на диск делает фоновый поток.
+Консоль в обоих случаях направлена в /dev/null.
+
+Запуск из корня репозитория: python -m benchmarks.bench_logging [кол-во вызовов]
+"""
+import inspect
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import log_pipeline
+
+
+def log_info(msg):
+    frame = inspect.currentframe().f_back
+    logging.info(f"[{frame.f_code.co_name}:{frame.f_lineno}] {msg}")
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def setup_old(path, console):
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[logging.FileHandler(path, encoding='utf-8'), logging.StreamHandler(console)],
+    )
+
+
+def old_call(chat_id, rows):
+    log_info(f'Напоминание поставлено в очередь для чата {chat_id} ({len(rows)} строк).')
+
+
+def new_call(chat_id, rows):
+    logging.info('Напоминание поставлено в очередь для чата %s (%d строк).', chat_id, len(rows))
+
+
+def debug_call(chat_id, rows):
+    logging.debug('Данные для отправки: %s', rows)
+
+
+def measure(call, count):
+    rows = list(range(20))
+    started = time.perf_counter()
+    for i in range(count):
+        call(i, rows)
+    return (time.perf_counter() - started) / count
+
+
+def main(count=20000):
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, 'w') as devnull:
+        stderr = sys.stderr
+        try:
+            setup_old(os.path.join(tmp, 'old.log'), devnull)
+            old = measure(old_call, count)
+            old_debug = measure(debug_call, count)
+            reset_root()
+
+            sys.stderr = devnull  # консольный обработчик пишет в sys.stderr
+            listener = log_pipeline.setup_logging(os.path.join(tmp, 'new.log'), log_format='json')
+            new = measure(new_call, count)
+            new_debug = measure(debug_call, count)
+            started = time.perf_counter()
+            listener.stop()
+            drain = time.perf_counter() - started
+            reset_root()
+        finally:
+            sys.stderr = stderr
+
+    print(f'вызовов: {count}')
+    print(f'{"прежняя схема":>22}: {old * 1e6:8.1f} мкс на вызов')
+    print(f'{"очередь + JSON":>22}: {new * 1e6:8.1f} мкс на вызов в вызывающем потоке '
+          f'(фоновый поток дописал очередь за {drain:.2f} с)')
+    print(f'{"debug при уровне INFO":>22}: {old_debug * 1e6:8.2f} / {new_debug * 1e6:.2f} мкс')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
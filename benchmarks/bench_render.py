@@ -0,0 +1,67 @@
+"""Сравнение отрисовки таблицы /birthdays: Pillow против прежнего пути через matplotlib,
+в процессе бота и в пуле процессов (render_pool).
+
+Для пула, кроме времени, печатается RSS этого процесса: отрисовка в пуле не должна
+его увеличивать. Пул меряется первым, пока процесс не загрузил модули отрисовки сам.
+
+Запуск из корня репозитория: python -m benchmarks.bench_render [кол-во строк]
+"""
+import sys
+import time
+
+from render import render_table_matplotlib, render_table_pillow
+from render_pool import RenderPool, _rss
+
+COLUMNS = ["Категория", "ФИО", "Дата рождения"]
+CATEGORIES = ["Сегодня", "Завтра", "На след. неделе", "В след. месяце"]
+
+
+def synthetic_rows(count):
+    return [
+        [CATEGORIES[min(i // 3, 3)], f"Константинопольская{i} Александра", f"{(i % 28) + 1:02d}.11"]
+        for i in range(count)
+    ]
+
+
+def measure(render, rows, repeat):
+    render(COLUMNS, rows)  # прогрев: шрифты, импорт модулей
+    best = float('inf')
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = len(render(COLUMNS, rows))
+        best = min(best, time.perf_counter() - started)
+    return best, size
+
+
+def rss_mb():
+    rss = _rss()
+    return f'{rss / 1024 / 1024:.0f} МБ' if rss is not None else '?'
+
+
+def main(count=12, repeat=3):
+    rows = synthetic_rows(count)
+    print(f'строк в таблице: {count}')
+    for name in ('pillow', 'matplotlib'):
+        before = rss_mb()
+        pool = RenderPool(name, timeout=300).start()
+        try:
+            seconds, size = measure(pool.render, rows, repeat)
+            print(f'{name + " (пул)":>18}: {seconds * 1000:8.1f} мс, {size / 1024:8.1f} КБ, '
+                  f'RSS бота {before} -> {rss_mb()}, процесса пула {pool.stats()["rss_mb"]} МБ')
+        except Exception as e:
+            print(f'{name + " (пул)":>18}: ошибка {e!r}')
+        finally:
+            pool.stop()
+    for name, render in (('pillow', render_table_pillow), ('matplotlib', render_table_matplotlib)):
+        before = rss_mb()
+        try:
+            seconds, size = measure(render, rows, repeat)
+        except Exception as e:  # например, нехватка памяти на 300 dpi
+            print(f'{name:>18}: ошибка {e!r}')
+            continue
+        print(f'{name:>18}: {seconds * 1000:8.1f} мс, {size / 1024:8.1f} КБ, RSS бота {before} -> {rss_mb()}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 12)
@@ -0,0 +1,387 @@
+"""Набор бенчмарков бота с базовыми результатами для поиска регрессий.
+
+Для каждого размера выгрузки (по умолчанию 1k, 10k и 100k сотрудников, 1M — через --sizes)
+генерируется синтетическая выгрузка (с 29.02, битыми датами и отпусками), и бот работает
+против поддельного Bot API (FakeTelegram) и одной из двух БД:
+
+    fake      выгрузка в памяти процесса (FakeSnapshotCache), PostgreSQL не нужен;
+    postgres  локальный PostgreSQL из --dsn: строки пишутся в nsi_data.dict_portal_ac_employees_tb_form
+              с отдельной меткой BENCH_TIMESTAMP и удаляются после прогона (берите отдельную БД).
+
+Меряются загрузка и подготовка выгрузки, каждая команда (--commands одновременных запросов
+из разных чатов через bot.process_new_updates: p50/p99 до ответа в Telegram и ответов в секунду)
+и ночная рассылка по --chats чатам (задача планировщика run_nightly_digest). Результаты
+сравниваются с базовыми из benchmarks/baselines/<db>-<режим>.json; --save-baseline их перезаписывает.
+Код возврата 1 — есть регрессии больше --tolerance.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --sizes 1000,100000,1000000 --save-baseline
+    python -m benchmarks.bench_suite --db postgres --dsn "host=/tmp/pgdata user=postgres dbname=bench"
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import telebot.apihelper
+from telebot.types import Update
+
+import remindbot2
+from benchmarks.fakes import DEPARTMENTS, FakeSnapshotCache, FakeTelegram, command_update, synthetic_roster, write_config
+from queries import EMPLOYEES_TABLE
+from roster import RosterSnapshot
+
+ADMIN_ID = 1
+COMMANDS = ['next5', 'next5all', 'vacations', 'vacationsall', 'birthdays']
+DEFAULT_SIZES = [1000, 10000, 100000]
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+# Метка синтетической выгрузки в PostgreSQL: позже любой настоящей, поэтому бот читает именно ее
+BENCH_TIMESTAMP = datetime(2099, 1, 1, 3, 0)
+EMPLOYEE_COLUMNS = ['fullname', 'birthday', 'department', 'status', 'vac_date_start', 'vac_date_end',
+                    '"current_timestamp"']
+# Изменения меньше этого (мс) не считаются регрессией, сколько бы процентов они ни составляли
+MIN_REGRESSION_MS = 1.0
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class PostgresRoster:
+    """Синтетическая выгрузка в локальном PostgreSQL"""
+
+    def __init__(self, dsn):
+        import psycopg2
+        import psycopg2.extensions
+
+        self._psycopg2 = psycopg2
+        self.params = psycopg2.extensions.parse_dsn(dsn)
+
+    def _execute(self, *statements, copy=None):
+        conn = self._psycopg2.connect(**self.params)
+        try:
+            with conn, conn.cursor() as cur:
+                for sql in statements:
+                    cur.execute(sql, {'timestamp': BENCH_TIMESTAMP})
+                if copy is not None:
+                    cur.copy_expert(f"COPY {EMPLOYEES_TABLE} ({', '.join(EMPLOYEE_COLUMNS)}) FROM STDIN "
+                                    f"WITH (FORMAT csv)", copy)
+        finally:
+            conn.close()
+
+    def load(self, rows):
+        buffer = io.StringIO()
+        # Строки в кавычках, None без них: так COPY отличает NULL от пустой строки
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for row in rows:
+            writer.writerow([*row, BENCH_TIMESTAMP.isoformat(' ')])
+        buffer.seek(0)
+        schema = EMPLOYEES_TABLE.split('.', 1)[0]
+        self._execute(
+            f'CREATE SCHEMA IF NOT EXISTS {schema}',
+            f'CREATE TABLE IF NOT EXISTS {EMPLOYEES_TABLE} (fullname text, birthday text, department text, '
+            f'status boolean, vac_date_start text, vac_date_end text, "current_timestamp" timestamp)',
+            f'DELETE FROM {EMPLOYEES_TABLE} WHERE "current_timestamp" = %(timestamp)s',
+            copy=buffer,
+        )
+
+    def cleanup(self):
+        self._execute(f'DELETE FROM {EMPLOYEES_TABLE} WHERE "current_timestamp" = %(timestamp)s')
+
+
+def group_sections(chats, first_chat_id):
+    """Группы по подразделениям + "все"; каждый чат подписан на одну-две группы"""
+    names = [f'dep{i}' for i in range(len(DEPARTMENTS))]
+    subscribers = {name: [] for name in names + ['all']}
+    for i in range(chats):
+        chat_id = first_chat_id + i
+        subscribers[names[i % len(names)]].append(chat_id)
+        if i % 3 == 0:
+            subscribers['all'].append(chat_id)
+    sections = {
+        # Первая группа — группа /next5, как PROгруппа по умолчанию
+        'GROUP pro': {'departments': ', '.join(remindbot2.GROUP_DEPARTMENT_PATTERNS),
+                      'title': 'PROгруппа'},
+    }
+    for name, department in zip(names, DEPARTMENTS):
+        sections[f'GROUP {name}'] = {
+            'departments': f'%{department}%',
+            'chats': ', '.join(map(str, subscribers[name])),
+        }
+    sections['GROUP all'] = {'title': 'Все', 'chats': ', '.join(map(str, subscribers['all']))}
+    return sections
+
+
+def configure(args, config_dir, fake, size):
+    options = {
+        'roster_query_mode': args.query_mode,
+        'snapshot_store_path': '',
+        'command_debounce': 0,
+        # Лимит Bot API (30 сообщ./с) здесь не нужен: меряем бота, а не ожидание лимита
+        'outbox_global_rate': 10000,
+        **dict(option.split('=', 1) for option in args.option),
+    }
+    db = PostgresRoster(args.dsn).params if args.db == 'postgres' else None
+    config_path = write_config(
+        os.path.join(config_dir, f'suite-{size}.cfg'), admin_chat_id=ADMIN_ID, db=db,
+        sections=group_sections(args.chats, first_chat_id=100000), **options,
+    )
+    remindbot2.init(config_path=config_path, greet=False)
+    # Как в run_bot(): картинки рисуются в пуле процессов (render_processes=0 — в процессе бота)
+    remindbot2.start_render_pool()
+    remindbot2.reply_cache.clear()
+    remindbot2.birthday_image_cache.clear()
+    telebot.apihelper.API_URL = fake.api_url
+
+
+def measure_load(args, rows):
+    """Загрузка выгрузки в кэш бота и подготовка индексов, ответов и картинки всех групп"""
+    results = {}
+    started = time.perf_counter()
+    if args.db == 'fake':
+        snapshot = RosterSnapshot(BENCH_TIMESTAMP, rows)
+        remindbot2.snapshot_cache = FakeSnapshotCache(snapshot, args.db_latency)
+    elif args.query_mode == 'snapshot':
+        snapshot = remindbot2.snapshot_cache.refresh()
+    else:
+        remindbot2.db_pool.warmup()
+        return results
+    results['load'] = {'seconds': time.perf_counter() - started}
+
+    started = time.perf_counter()
+    remindbot2.prepare_snapshot(snapshot)
+    results['prepare'] = {'seconds': time.perf_counter() - started}
+    # Команды ниже меряются с холодными кэшами ответов
+    remindbot2.reply_cache.clear()
+    remindbot2.birthday_image_cache.clear()
+    return results
+
+
+def wait_until(done, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not done():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'не дождались: {what}')
+        time.sleep(0.002)
+
+
+def measure_command(fake, command, count, first_chat_id, timeout):
+    """count одновременных команд из разных чатов: задержка до первого ответа в каждый чат.
+
+    Ответ, который Bot API отверг (например, слишком длинный текст), считается в failed, а не в задержках.
+    """
+    chat_ids = set(range(first_chat_id, first_chat_id + count))
+    updates = [
+        Update.de_json(command_update(first_chat_id + i, first_chat_id + i, ADMIN_ID, command))
+        for i in range(count)
+    ]
+    first_request = len(fake.requests)
+    failed_before = remindbot2.outbox.stats()['failed']
+    started = time.perf_counter()
+    remindbot2.bot.process_new_updates(updates)
+
+    first_reply = {}
+    seen = first_request
+
+    def replied():
+        nonlocal seen
+        requests = fake.requests[seen:]
+        seen += len(requests)
+        for _, chat_id, received in requests:
+            if chat_id in chat_ids:
+                first_reply.setdefault(chat_id, received)
+        return len(first_reply) + remindbot2.outbox.stats()['failed'] - failed_before >= count
+
+    wait_until(replied, timeout, f'ответы на /{command}')
+    elapsed = time.perf_counter() - started
+    values = [received - started for received in first_reply.values()]
+    result = {'failed': count - len(values)}
+    if values:
+        result.update(
+            p50_ms=percentile(values, 0.5) * 1000,
+            p99_ms=percentile(values, 0.99) * 1000,
+            throughput=len(values) / max(values),
+        )
+    else:
+        result['total_ms'] = elapsed * 1000
+    return result
+
+
+def measure_digest(timeout):
+    """Ночная рассылка: подготовка и постановка в очередь, затем доставка всех сообщений"""
+    outbox = remindbot2.outbox
+    before = outbox.stats()['enqueued']
+    failed_before = outbox.stats()['failed']
+    started = time.perf_counter()
+    remindbot2.run_nightly_digest(None)
+    queued = time.perf_counter() - started
+
+    def delivered():
+        stats = outbox.stats()
+        return stats['sent'] + stats['coalesced'] + stats['failed'] >= stats['enqueued']
+
+    wait_until(delivered, timeout, 'доставка ночной рассылки')
+    elapsed = time.perf_counter() - started
+    stats = outbox.stats()
+    return {
+        'queued_ms': queued * 1000,
+        'total_ms': elapsed * 1000,
+        'throughput': (stats['enqueued'] - before) / elapsed,
+        'failed': stats['failed'] - failed_before,
+    }
+
+
+def run_size(args, size, config_dir):
+    rows = synthetic_roster(size)
+    postgres = PostgresRoster(args.dsn) if args.db == 'postgres' else None
+    fake = FakeTelegram(args.telegram_latency).start()
+    try:
+        if postgres is not None:
+            started = time.perf_counter()
+            postgres.load(rows)
+            print(f'  выгрузка записана в PostgreSQL за {time.perf_counter() - started:.1f} с')
+        configure(args, config_dir, fake, size)
+        results = measure_load(args, rows)
+        for i, command in enumerate(args.command):
+            results[f'/{command}'] = measure_command(fake, command, args.commands, 1000 + i * args.commands,
+                                                     args.timeout)
+        if args.chats:
+            results['digest'] = measure_digest(args.timeout)
+        return results
+    finally:
+        remindbot2.outbox.stop(timeout=5)
+        remindbot2.stop_render_pool()
+        remindbot2.db_pool.closeall()
+        fake.stop()
+        if postgres is not None:
+            postgres.cleanup()
+
+
+def format_value(metric, value):
+    if metric == 'failed':
+        return f'{value:10d} шт.'
+    if metric == 'throughput':
+        return f'{value:10.1f}/с'
+    if metric == 'seconds':
+        return f'{value:10.3f} с'
+    return f'{value:10.1f} мс'
+
+
+def is_regression(metric, current, baseline, tolerance):
+    if metric == 'failed':
+        return current > baseline
+    if metric == 'throughput':
+        return current < baseline / (1 + tolerance)
+    if metric == 'seconds':
+        current, baseline = current * 1000, baseline * 1000
+    return current > baseline * (1 + tolerance) and current - baseline > MIN_REGRESSION_MS
+
+
+def report(results, baseline, tolerance):
+    """Печатает результаты рядом с базовыми; возвращает число регрессий"""
+    regressions = 0
+    base_results = (baseline or {}).get('results', {})
+    for size, measurements in results.items():
+        print(f'\nсотрудников: {size}')
+        for name, metrics in measurements.items():
+            for metric, value in metrics.items():
+                line = f'  {name:<14} {metric:<10} {format_value(metric, value)}'
+                base = base_results.get(size, {}).get(name, {}).get(metric)
+                if base is not None:
+                    change = f' ({(value - base) / base * 100:+.0f}%)' if base else ''
+                    line += f'   база {format_value(metric, base).strip():>12}{change}'
+                    if is_regression(metric, value, base, tolerance):
+                        line += '  РЕГРЕССИЯ'
+                        regressions += 1
+                print(line)
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_suite', description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='размеры выгрузки через запятую')
+    parser.add_argument('--db', choices=['fake', 'postgres'], default='fake')
+    parser.add_argument('--dsn', help='строка подключения psycopg2 для --db postgres')
+    parser.add_argument('--query-mode', choices=remindbot2.ROSTER_QUERY_MODES, default='snapshot',
+                        help='roster_query_mode бота (server и stream — только с --db postgres)')
+    parser.add_argument('--command', action='append', choices=COMMANDS,
+                        help='команда для замера (можно несколько; по умолчанию все)')
+    parser.add_argument('--commands', type=int, default=50, help='одновременных запросов каждой команды')
+    parser.add_argument('--chats', type=int, default=200, help='чатов в ночной рассылке (0 — без рассылки)')
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help='задержка поддельного Bot API, с')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='задержка поддельной БД (--db fake), с')
+    parser.add_argument('--option', action='append', default=[], metavar='КЛЮЧ=ЗНАЧЕНИЕ',
+                        help='дополнительная настройка секции REMINDBOT2, например outbox_senders=16')
+    parser.add_argument('--timeout', type=float, default=600, help='сколько ждать ответов одного замера, с')
+    parser.add_argument('--baseline', help='файл базовых результатов (по умолчанию baselines/<db>-<режим>.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='записать результаты как базовые')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое ухудшение (0.25 — на 25%%)')
+    args = parser.parse_args(argv)
+    args.command = args.command or COMMANDS
+    if args.db == 'postgres' and not args.dsn:
+        parser.error('--db postgres требует --dsn')
+    if args.db == 'fake' and args.query_mode != 'snapshot':
+        parser.error(f'--query-mode {args.query_mode} требует --db postgres')
+    if args.baseline is None:
+        args.baseline = os.path.join(BASELINE_DIR, f'{args.db}-{args.query_mode}.json')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Свой обработчик до init(): setup_logging() тогда не создает bot.log
+    logging.basicConfig(level=logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    meta = {
+        'db': args.db, 'query_mode': args.query_mode, 'commands': args.commands, 'chats': args.chats,
+        'telegram_latency': args.telegram_latency, 'db_latency': args.db_latency, 'options': args.option,
+    }
+    print(f'БД: {args.db}, режим: {args.query_mode}, запросов на команду: {args.commands}, '
+          f'чатов рассылки: {args.chats}, задержка Telegram {args.telegram_latency * 1000:.0f} мс')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as config_dir:
+        for size in sizes:
+            print(f'прогон на {size} сотрудниках...')
+            results[str(size)] = run_size(args, size, config_dir)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('params') != meta:
+            print(f'\nВнимание: базовые результаты {args.baseline} сняты с другими параметрами.')
+    regressions = report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        saved = {
+            'meta': {
+                'params': meta,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+            },
+            # Размеры из прошлой базы, которые сейчас не прогонялись, сохраняются
+            'results': {**(baseline or {}).get('results', {}), **results},
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(saved, f, ensure_ascii=False, indent=2)
+        print(f'\nБазовые результаты записаны в {args.baseline}')
+    elif baseline is not None:
+        print(f'\nРегрессий больше {args.tolerance:.0%}: {regressions}')
+    return 1 if regressions and not args.save_baseline else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Нагрузочная проверка режима webhook.
+
+Поддельный Telegram доставляет N команд на встроенный webhook-сервер бота (по одному
+POST на обновление, с повтором при 503), ответы бота уходят в тот же поддельный Bot API.
+Второй прогон — с маленькой очередью, чтобы увидеть отказы 503 и повторную доставку.
+После отправки сервер останавливается, и проверяется, что все принятые обновления обработаны.
+
+Запуск из корня репозитория: python -m benchmarks.bench_webhook [команд] [сотрудников]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import telebot.apihelper
+
+import remindbot2
+from benchmarks.bench_async import (
+    ADMIN_ID,
+    COMMANDS,
+    DB_LATENCY,
+    OUTBOX_GLOBAL_RATE,
+    TELEGRAM_LATENCY,
+    wait_for_replies,
+)
+from benchmarks.fakes import FakeSnapshotCache, FakeTelegram, command_update, deliver_updates, synthetic_snapshot, write_config
+from webhook import WebhookServer
+
+SECRET = 'bench-secret'
+
+
+def run(count, snapshot, config_dir, queue_size, workers):
+    fake = FakeTelegram(TELEGRAM_LATENCY).start()
+    try:
+        config_path = write_config(
+            os.path.join(config_dir, 'webhook.cfg'), admin_chat_id=ADMIN_ID, update_mode='webhook',
+            outbox_global_rate=OUTBOX_GLOBAL_RATE,
+        )
+        remindbot2.init(config_path=config_path, greet=False)
+        remindbot2.snapshot_cache = FakeSnapshotCache(snapshot, DB_LATENCY)
+        remindbot2.birthday_image_cache.clear()
+        telebot.apihelper.API_URL = fake.api_url
+
+        server = WebhookServer(remindbot2.dispatch_updates, port=0, secret=SECRET,
+                               queue_size=queue_size, workers=workers, retry_after=0).start()
+        url = f'http://127.0.0.1:{server.address[1]}{server.path}'
+        updates = [command_update(i + 1, 1000 + i, ADMIN_ID, COMMANDS[i % len(COMMANDS)]) for i in range(count)]
+        started = time.perf_counter()
+        statuses = deliver_updates(url, updates, secret=SECRET, connections=16)
+        server.stop()
+        elapsed = time.perf_counter() - started
+        wait_for_replies(fake, count, timeout=30)
+        stats = server.stats()
+        assert stats['processed'] == stats['accepted'] == count, stats
+        return elapsed, statuses, stats
+    finally:
+        fake.stop()
+
+
+def main(count=200, employees=5000):
+    logging.basicConfig(level=logging.ERROR)
+    snapshot = synthetic_snapshot(employees)
+    print(f'команд: {count}, сотрудников: {employees}, задержка Telegram {TELEGRAM_LATENCY * 1000:.0f} мс')
+    with tempfile.TemporaryDirectory() as config_dir:
+        for queue_size, workers in ((100, 8), (4, 2)):
+            elapsed, statuses, stats = run(count, snapshot, config_dir, queue_size, workers)
+            print(f'очередь {queue_size:>3}, потоков {workers}: {count / elapsed:7.1f} команд/с, '
+                  f'ответы webhook {statuses}, обработано {stats["processed"]}')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
@@ -0,0 +1,335 @@
+"""Локальные заменители Telegram и PostgreSQL для бенчмарков и нагрузочных тестов."""
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from roster import RosterSnapshot
+
+DEPARTMENTS = [
+    'Операционная служба', 'Проектный офис', 'Мультимедийный отдел', 'Руководство',
+    'Бухгалтерия', 'Склад', 'Юридический отдел',
+]
+
+
+def synthetic_roster(count, seed=42, today=None):
+    """Строки выгрузки (ФИО, 'DD.MM', подразделение, status, начало отпуска, конец отпуска).
+
+    Примерно 0.1% дней рождения — 29.02, ещё 0.1% — битые даты; у трети сотрудников
+    есть отпуск в окне ±2 месяца от today, часть из них с битой датой начала.
+    """
+    rnd = random.Random(seed)
+    today = today or date.today()
+    rows = []
+    for i in range(count):
+        roll = rnd.random()
+        if roll < 0.001:
+            birthday = '29.02'
+        elif roll < 0.002:
+            birthday = rnd.choice(['31.02', '00.13', 'abc', ''])
+        else:
+            birthday = (date(2001, 1, 1) + timedelta(days=rnd.randrange(365))).strftime('%d.%m')
+        vac_start = vac_end = None
+        if rnd.random() < 0.33:
+            start = today + timedelta(days=rnd.randrange(-60, 60))
+            end = start + timedelta(days=rnd.choice([0, 2, 6, 13, 27]))
+            vac_start, vac_end = start.strftime('%d.%m.%Y'), end.strftime('%d.%m.%Y')
+            if rnd.random() < 0.001:
+                vac_start = '31.02.' + vac_start[-4:]
+        rows.append((
+            f'Фамилия{i} Имя{i % 211}',
+            birthday,
+            rnd.choice(DEPARTMENTS),
+            rnd.random() < 0.95,
+            vac_start,
+            vac_end,
+        ))
+    return rows
+
+
+def synthetic_snapshot(count, seed=42, today=None):
+    return RosterSnapshot(datetime(2026, 1, 1, 3, 0), synthetic_roster(count, seed, today))
+
+
+class FakeSnapshotCache:
+    """Заменитель SnapshotCache: отдает готовую выгрузку с имитацией задержки БД"""
+
+    def __init__(self, snapshot, latency=0.0):
+        self.snapshot = snapshot
+        self.latency = latency
+        self.check_interval = 60
+
+    def get(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.snapshot
+
+    def refresh(self):
+        return self.snapshot
+
+    def invalidate(self):
+        pass
+
+
+class _FakeListenConnection:
+    """Соединение psycopg2 в объеме, нужном SyncWatcher: LISTEN, select() по fileno, poll() и notifies"""
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        self._pending = []
+        self._lock = threading.Lock()
+        self.autocommit = False
+        self.channels = set()
+        self.notifies = []
+        self.closed = False
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        command, channel = sql.split(None, 1)
+        if command.upper() == 'LISTEN':
+            self.channels.add(channel.strip('"'))
+
+    def notify(self, channel, payload=''):
+        if channel not in self.channels or self.closed:
+            return
+        with self._lock:
+            self._pending.append((channel, payload))
+        self._writer.send(b'!')
+
+    def poll(self):
+        self._reader.recv(4096)
+        with self._lock:
+            self.notifies.extend(self._pending)
+            self._pending.clear()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._reader.close()
+            self._writer.close()
+
+
+class FakeSyncSource:
+    """Заменитель PostgreSQL для SyncWatcher: max("current_timestamp") и каналы NOTIFY"""
+
+    def __init__(self, timestamp=None, latency=0.0):
+        self.timestamp = timestamp
+        self.latency = latency
+        self.queries = 0
+        self.connections = []
+
+    def latest(self):
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.timestamp
+
+    def connect(self):
+        conn = _FakeListenConnection()
+        self.connections.append(conn)
+        return conn
+
+    def publish(self, timestamp, channel=None):
+        """Новая выгрузка; с channel — еще и NOTIFY, как от триггера в БД"""
+        self.timestamp = timestamp
+        if channel:
+            for conn in self.connections:
+                conn.notify(channel)
+
+
+class FakeAsyncSnapshotCache(FakeSnapshotCache):
+    """Заменитель AsyncSnapshotCache"""
+
+    async def get(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.snapshot
+
+    async def close(self):
+        pass
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeTelegram:
+    """Поддельный Bot API на локальном HTTP-сервере.
+
+    Отвечает на sendMessage/sendPhoto с заданной задержкой и запоминает время
+    получения каждого запроса, чтобы считать задержку ответа бота.
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.requests = []  # (метод, chat_id, время по perf_counter)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}/bot{{0}}/{{1}}'
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                fake._handle(self, body)
+
+            def do_GET(self):
+                fake._handle(self, b'')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _FakeHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def count(self, method=None):
+        with self._lock:
+            return sum(1 for m, _, _ in self.requests if method is None or m == method)
+
+    @staticmethod
+    def _chat_id(url, body):
+        params = parse_qs(urlparse(url).query)
+        if 'chat_id' not in params and body:
+            match = re.search(rb'name="chat_id"\r\n(?:[^\r\n]*\r\n)*\r\n(-?\d+)', body)
+            if match:
+                return int(match.group(1))
+            try:
+                params = parse_qs(body.decode('utf-8'))
+            except UnicodeDecodeError:
+                params = {}
+        value = params.get('chat_id', [0])[0]
+        return int(value)
+
+    def _handle(self, handler, body):
+        received = time.perf_counter()
+        method = handler.path.rsplit('/', 1)[-1].split('?', 1)[0]
+        chat_id = self._chat_id(handler.path, body)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+            self.requests.append((method, chat_id, received))
+        result = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if method == 'sendPhoto':
+            result['photo'] = [{'file_id': f'photo-{message_id}', 'file_unique_id': f'u{message_id}',
+                                'width': 100, 'height': 100}]
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'remindbot', 'username': 'remindbot'}
+        payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+def command_update(update_id, chat_id, user_id, command):
+    """JSON-обновление Telegram с командой от пользователя user_id в чате chat_id"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'},
+            'text': f'/{command}',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command) + 1}],
+        },
+    }
+
+
+def deliver_updates(url, updates, secret=None, connections=8, retry_delay=0.05, give_up_after=60):
+    """Доставка обновлений на webhook так, как это делает Telegram: по одному POST на
+    обновление в несколько соединений, с повтором при ответе не 2xx в течение give_up_after секунд.
+
+    Возвращает словарь {HTTP-код: количество ответов} по всем попыткам.
+    """
+    statuses = {}
+    lock = threading.Lock()
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+    def post(update):
+        body = json.dumps(update).encode('utf-8')
+        deadline = time.monotonic() + give_up_after
+        while time.monotonic() < deadline:
+            request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+            if 200 <= status < 300:
+                return
+            time.sleep(retry_delay)
+
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        list(executor.map(post, updates))
+    return statuses
+
+
+def write_config(path, admin_chat_id=1, chat_id=2, db=None, sections=None, **options):
+    """Минимальный конфиг для remindbot2.init(); options попадают в секцию REMINDBOT2.
+
+    db — параметры подключения psycopg2 (по умолчанию несуществующая БД),
+    sections — дополнительные секции {имя: {ключ: значение}}, например [GROUP ...].
+    """
+    db_lines = [f'{key} = {value}' for key, value in (db or {'host': '127.0.0.1', 'dbname': 'fake'}).items()]
+    lines = [
+        '[HOSTER_KC_DB]', *db_lines, '',
+        '[HOSTER_KC_DB_LOCAL]', *db_lines, '',
+        '[REMINDBOT2]',
+        'remindbot_token = 123456:FAKE',
+        f'admin_chat_id = {admin_chat_id}',
+        f'birthday_chat_with_nika = {chat_id}',
+    ]
+    lines += [f'{key} = {value}' for key, value in options.items()]
+    for name, section in (sections or {}).items():
+        lines += ['', f'[{name}]']
+        lines += [f'{key} = {value}' for key, value in section.items()]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
@@ -0,0 +1,95 @@
+"""Объединение одинаковых одновременных запросов и защита от повторов команд.
+
+SingleFlight: пока для ключа (команда, группа, день) идет вычисление, следующие
+такие же запросы не запускают свое, а ждут его результата (или исключения).
+Debouncer: одна и та же команда из одного чата принимается не чаще раза в window секунд.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Одно вычисление на ключ среди одновременных запросов (потоки и asyncio)"""
+
+    def __init__(self):
+        self._inflight = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Результат func(); если такое же вычисление уже идет в другом потоке — ждет его"""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.started += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            logging.info('Запрос %s ждет уже идущего вычисления (всего объединено %d).', key, self.coalesced)
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def do_async(self, key, factory):
+        """Асинхронный вариант: factory() создает корутину или future, общую для всех ждущих"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.started += 1
+        else:
+            self.coalesced += 1
+            logging.info('Запрос %s ждет уже идущего вычисления (всего объединено %d).', key, self.coalesced)
+        # shield: отмена одного ждущего не отменяет общее вычисление для остальных
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {'inflight': len(self._inflight) + len(self._tasks), 'started': self.started, 'coalesced': self.coalesced}
+
+
+class Debouncer:
+    """Пропускает ключ не чаще раза в window секунд (window <= 0 — пропускает все)"""
+
+    def __init__(self, window, max_keys=10000):
+        self.window = window
+        self.max_keys = max_keys
+        self._last = {}
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.debounced = 0
+
+    def allow(self, key):
+        if self.window <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.window:
+                self.debounced += 1
+                return False
+            self._last[key] = now
+            self.accepted += 1
+            if len(self._last) > self.max_keys:
+                # Давно молчащие чаты больше не нужны
+                self._last = {k: t for k, t in self._last.items() if now - t < self.window}
+        return True
+
+    def stats(self):
+        return {'accepted': self.accepted, 'debounced': self.debounced}
@@ -0,0 +1,138 @@
+"""Пакетный разбор дат выгрузки: целая колонка строк за один проход NumPy.
+
+Строки вида 'DD.MM' и 'DD.MM.YYYY' разбираются арифметикой над кодами символов,
+без split/int/date на каждую строку. Все, что не в точности такого вида (другая
+длина, пробелы, date из БД, None), функции помечают нулем — такие строки вызывающий
+код разбирает прежними построчными функциями, поэтому результат совпадает с ними
+на любых данных. Модуль не знает ни про ФИО, ни про индексы: на входе колонка,
+на выходе массивы той же длины.
+
+numpy (он приходит вместе с pandas) импортируется при первом вызове, как и pandas в боте.
+"""
+import logging
+from datetime import date, timedelta
+
+# Дней до начала месяца в невисокосном году; индекс — номер месяца минус 1
+_MONTH_STARTS = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+# Длина месяца в високосном году (29.02 — корректный день рождения); индекс 0 не используется
+_LEAP_MONTH_DAYS = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# Категории таблицы /birthdays: сотрудник попадает в самую раннюю из подходящих
+BIRTHDAY_BUCKETS = ("Сегодня", "Завтра", "На след. неделе", "В след. месяце")
+
+# Сколько битых строк показывать в сводке
+MALFORMED_EXAMPLES = 5
+
+
+def _codes(values, width):
+    """Колонка -> матрица кодов символов (строка на значение); длиннее width-1 не бывает канонической"""
+    import numpy as np
+
+    column = np.array(values, dtype=f'U{width}')
+    return column.view(np.uint32).reshape(-1, width)
+
+
+def _digits(codes, positions):
+    """Число из цифр в позициях positions и маска "во всех позициях ASCII-цифры" """
+    value = 0
+    ok = True
+    for position in positions:
+        digit = codes[:, position].astype('int64') - 48
+        ok = ok & (digit >= 0) & (digit <= 9)
+        value = value * 10 + digit
+    return value, ok
+
+
+def parse_day_month(values):
+    """Колонка 'DD.MM' -> массивы (месяц, день); 0 там, где строка не 'DD.MM' или такой даты нет"""
+    import numpy as np
+
+    codes = _codes(values, 6)
+    day, day_ok = _digits(codes, (0, 1))
+    month, month_ok = _digits(codes, (3, 4))
+    valid = day_ok & month_ok & (codes[:, 2] == 46) & (codes[:, 5] == 0) & (month >= 1) & (month <= 12)
+    month = np.where(valid, month, 0)
+    valid &= (day >= 1) & (day <= np.asarray(_LEAP_MONTH_DAYS)[month])
+    return np.where(valid, month, 0), np.where(valid, day, 0)
+
+
+def parse_dates(values):
+    """Колонка 'DD.MM.YYYY' -> порядковые номера дат (date.toordinal()); 0 там, где разобрать не удалось"""
+    import numpy as np
+
+    codes = _codes(values, 11)
+    day, day_ok = _digits(codes, (0, 1))
+    month, month_ok = _digits(codes, (3, 4))
+    year, year_ok = _digits(codes, (6, 7, 8, 9))
+    valid = (
+        day_ok & month_ok & year_ok
+        & (codes[:, 2] == 46) & (codes[:, 5] == 46) & (codes[:, 10] == 0)
+        & (month >= 1) & (month <= 12) & (year >= 1) & (day >= 1)
+    )
+    month = np.where(valid, month, 1)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = np.asarray(_LEAP_MONTH_DAYS)[month] - ((month == 2) & ~leap)
+    valid &= day <= month_days
+    before = year - 1
+    ordinals = (
+        before * 365 + before // 4 - before // 100 + before // 400
+        + np.asarray(_MONTH_STARTS)[month - 1] + ((month > 2) & leap) + day
+    )
+    return np.where(valid, ordinals, 0)
+
+
+def _birthday_ordinals(months, days, year):
+    """Порядковые номера дней рождения в году year; 29.02 в невисокосный год — 28.02"""
+    import numpy as np
+
+    leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    day_of_year = np.asarray(_MONTH_STARTS)[np.maximum(months, 1) - 1] + days
+    if leap:
+        day_of_year = day_of_year + (months > 2)
+    else:
+        day_of_year = day_of_year - ((months == 2) & (days == 29))
+    return date(year, 1, 1).toordinal() - 1 + day_of_year
+
+
+def days_until(months, days, today):
+    """Дней от today до ближайшего (сегодня или позже) дня рождения; для нулевых месяцев значение не определено"""
+    import numpy as np
+
+    now = today.toordinal()
+    this_year = _birthday_ordinals(months, days, today.year)
+    next_year = _birthday_ordinals(months, days, today.year + 1)
+    return np.where(this_year >= now, this_year, next_year) - now
+
+
+def birthday_bucket_bounds(today):
+    """Границы категорий BIRTHDAY_BUCKETS: список (первый день, последний день)"""
+    next_monday = today + timedelta(days=(7 - today.weekday()) % 7 or 7)
+    next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+    month_after_next = (next_month + timedelta(days=32)).replace(day=1)
+    return [
+        (today, today),
+        (today + timedelta(days=1), today + timedelta(days=1)),
+        (next_monday, next_monday + timedelta(days=6)),
+        (next_month, month_after_next - timedelta(days=1)),
+    ]
+
+
+def birthday_buckets(days, today):
+    """Номер самой ранней категории BIRTHDAY_BUCKETS по массиву "дней до"; -1 — ни в одну не попадает"""
+    import numpy as np
+
+    when = today.toordinal() + np.asarray(days)
+    result = np.full(when.shape, -1, dtype=np.int8)
+    # Категории пересекаются (завтра бывает и на следующей неделе): ранние записываются последними
+    for bucket, (first, last) in reversed(list(enumerate(birthday_bucket_bounds(today)))):
+        result[(when >= first.toordinal()) & (when <= last.toordinal())] = bucket
+    return result
+
+
+def report_malformed(what, malformed):
+    """Одна строка в лог на всю пачку битых записей: сколько их и первые MALFORMED_EXAMPLES"""
+    if not malformed:
+        return
+    examples = '; '.join(f'{name}: {value} ({error})' for name, value, error in malformed[:MALFORMED_EXAMPLES])
+    more = f' и еще {len(malformed) - MALFORMED_EXAMPLES}' if len(malformed) > MALFORMED_EXAMPLES else ''
+    logging.info('Ошибка преобразования %s (битых строк: %d): %s%s', what, len(malformed), examples, more)
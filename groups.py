@@ -0,0 +1,116 @@
+"""Реестр групп сотрудников и подписок чатов на ночную рассылку.
+
+Группа — именованная аудитория: шаблоны подразделений (как в department ILIKE ANY(...)),
+заголовки сообщений и чаты, которые получают по ней рассылку. Шаблоны компилируются
+один раз; группы с одинаковыми шаблонами делят одно представление выгрузки, поэтому
+одна загрузка выгрузки обслуживает любое число групп и чатов без запросов к БД.
+"""
+from roster import compile_ilike
+
+# Разделы ночной рассылки в порядке отправки
+DIGEST_PARTS = ('next5', 'vacations')
+
+GROUP_SECTION_PREFIX = 'GROUP '
+
+
+def _split(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+class Group:
+    """Аудитория рассылки: departments=None — все сотрудники"""
+
+    def __init__(self, name, departments=None, icon='', title=None, vacations_title=None,
+                 chats=(), digest=DIGEST_PARTS):
+        unknown = set(digest) - set(DIGEST_PARTS)
+        if unknown:
+            raise ValueError(f'Неизвестные разделы рассылки группы {name}: {", ".join(sorted(unknown))}')
+        self.name = name
+        self.departments = list(departments) if departments else None
+        self.matcher = compile_ilike(self.departments) if self.departments else None
+        # Ключ представления в RosterSnapshot: одинаковые фильтры — одно представление
+        self.view_key = ('departments', *sorted(self.departments)) if self.departments else 'all'
+        self.icon = icon
+        self.title = title or name
+        self.vacations_title = vacations_title or f'ОТПУСКА {self.title}'
+        self.chats = tuple(chats)
+        self.digest = tuple(digest)
+
+    def __repr__(self):
+        return f'Group({self.name!r}, chats={len(self.chats)})'
+
+    @property
+    def header(self):
+        return f'{self.icon} {self.title}:'.strip()
+
+    @property
+    def vacations_header(self):
+        return f'{self.icon} {self.vacations_title}:'.strip()
+
+    def view(self, snapshot):
+        return snapshot.view(self.view_key, self.matcher)
+
+    @classmethod
+    def from_section(cls, name, section):
+        """Группа из секции конфига; значения читаются как есть (raw), чтобы '%' в шаблонах
+        ILIKE не разбирался ConfigParser как подстановка"""
+        return cls(
+            name,
+            departments=_split(section.get('departments', raw=True)),
+            icon=section.get('icon', '', raw=True),
+            title=section.get('title', raw=True),
+            vacations_title=section.get('vacations_title', raw=True),
+            chats=[int(chat_id) for chat_id in _split(section.get('chats', raw=True))],
+            digest=_split(section.get('digest', ', '.join(DIGEST_PARTS), raw=True)),
+        )
+
+
+class GroupRegistry:
+    """Группы по имени (в порядке объявления) и группы для команд /next5 и /next5all"""
+
+    def __init__(self, groups, default=None, everyone=None):
+        if not groups:
+            raise ValueError('Не задано ни одной группы')
+        self._groups = {}
+        for group in groups:
+            if group.name in self._groups:
+                raise ValueError(f'Группа {group.name} объявлена дважды')
+            self._groups[group.name] = group
+        self.default = self[default] if default else groups[0]
+        if everyone:
+            self.everyone = self[everyone]
+        else:
+            self.everyone = next((group for group in groups if group.departments is None), self.default)
+
+    def __getitem__(self, name):
+        try:
+            return self._groups[name]
+        except KeyError:
+            raise ValueError(f'Неизвестная группа: {name}') from None
+
+    def __iter__(self):
+        return iter(self._groups.values())
+
+    def __len__(self):
+        return len(self._groups)
+
+    def subscriptions(self):
+        """{chat_id: [(группа, раздел), ...]} — что получает каждый чат, в порядке отправки"""
+        result = {}
+        for part in DIGEST_PARTS:
+            for group in self:
+                if part not in group.digest:
+                    continue
+                for chat_id in group.chats:
+                    result.setdefault(chat_id, []).append((group, part))
+        return result
+
+    @classmethod
+    def from_config(cls, config, defaults, default=None, everyone=None):
+        """Группы из секций [GROUP <имя>]; если таких секций нет — группы defaults"""
+        groups = [
+            Group.from_section(section[len(GROUP_SECTION_PREFIX):].strip(), config[section])
+            for section in config.sections()
+            if section.startswith(GROUP_SECTION_PREFIX)
+        ]
+        return cls(groups or defaults, default=default, everyone=everyone)
@@ -0,0 +1,287 @@
+"""Планировщик периодических задач бота.
+
+Расписания задаются как в cron ('30 3 * * *') или списком времени суток ('03:30, 18:00')
+в заданном часовом поясе (zoneinfo) либо в локальном времени сервера. Ближайшие запуски
+лежат в куче; поток планировщика спит на Condition.wait не дольше max_sleep секунд и
+каждый раз сверяется с настенными часами, поэтому сон компьютера и переход на летнее
+время не сдвигают запуски. Сами задачи выполняются в пуле потоков.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import metrics
+
+CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),  # 0 и 7 — воскресенье, как в cron
+]
+
+# Как поступать с запуском, опоздавшим больше чем на grace секунд
+MISSED_RUN_RULES = ('catch_up', 'skip')
+
+
+def get_timezone(name):
+    """ZoneInfo по имени ('Europe/Moscow') или None — локальное время сервера"""
+    return ZoneInfo(name) if name else None
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-', 1))
+        else:
+            start = end = int(part)
+            if step != 1:
+                end = high
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f'Некорректное поле cron: {text!r}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronEntry:
+    """Одно выражение cron из пяти полей: минута, час, день месяца, месяц, день недели"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Ожидалось 5 полей cron: {expression!r}')
+        parsed = [_parse_field(text, low, high) for text, (_, low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = (sorted(values) for values in parsed)
+        self.weekdays = {day % 7 for day in weekdays}
+        # Как в cron: если заданы и день месяца, и день недели, достаточно совпадения любого
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+        self.expression = expression
+
+    def matches_day(self, day):
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = (day.isoweekday() % 7) in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return in_month or in_week
+        return in_month and in_week
+
+    def next_local(self, after):
+        """Ближайшее время (наивное, по стенным часам) строго после after"""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 5):
+            if self.matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f'Выражение cron никогда не срабатывает: {self.expression!r}')
+
+
+class Schedule:
+    """Расписание из одного или нескольких выражений cron в часовом поясе tz"""
+
+    def __init__(self, entries, tz=None, text=''):
+        self.entries = entries
+        self.tz = tz
+        self.text = text
+
+    @classmethod
+    def parse(cls, text, tz=None):
+        """'30 3 * * *', '30 3 * * 1-5; 0 12 * * 6' или '03:30, 18:00' (ежедневно)"""
+        entries = []
+        for part in text.replace(';', ',').split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if ':' in part and len(part.split()) == 1:
+                hour, minute = part.split(':')
+                part = f'{int(minute)} {int(hour)} * * *'
+            entries.append(CronEntry(part))
+        if not entries:
+            raise ValueError(f'Пустое расписание: {text!r}')
+        return cls(entries, tz, text)
+
+    def _to_timestamp(self, local):
+        if self.tz is None:
+            return local.timestamp()  # наивное время считается локальным временем сервера
+        return local.replace(tzinfo=self.tz).timestamp()
+
+    def next_after(self, timestamp):
+        """Ближайший запуск (unix time) строго после timestamp"""
+        after = datetime.fromtimestamp(timestamp, self.tz)
+        if self.tz is not None:
+            after = after.replace(tzinfo=None)
+        candidates = []
+        for entry in self.entries:
+            local = entry.next_local(after)
+            while self._to_timestamp(local) <= timestamp:
+                # Осенний переход: то же время по стенным часам наступает второй раз
+                local = entry.next_local(local)
+            candidates.append(self._to_timestamp(local))
+        return min(candidates)
+
+    def shifted(self, seconds):
+        """То же расписание, сдвинутое на seconds (отрицательный сдвиг — раньше)"""
+        return ShiftedSchedule(self, seconds)
+
+    def __str__(self):
+        return self.text or '; '.join(entry.expression for entry in self.entries)
+
+
+class ShiftedSchedule:
+    def __init__(self, schedule, offset):
+        self.schedule = schedule
+        self.offset = offset
+
+    def next_after(self, timestamp):
+        return self.schedule.next_after(timestamp - self.offset) + self.offset
+
+    def __str__(self):
+        return f'{self.schedule} {self.offset:+.0f} с'
+
+
+class Job:
+    """Периодическая задача планировщика"""
+
+    def __init__(self, name, func, schedule, missed='catch_up', grace=60):
+        if missed not in MISSED_RUN_RULES:
+            raise ValueError(f'Неизвестное правило пропущенного запуска: {missed}')
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.missed = missed
+        self.grace = grace
+        self.next_run = None
+        self.running = False
+        self.cancelled = False
+
+    def __repr__(self):
+        return f'Job({self.name!r}, {self.schedule})'
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y %H:%M:%S')
+
+
+class Scheduler:
+    """Куча ближайших запусков + поток ожидания + пул потоков для самих задач"""
+
+    def __init__(self, workers=4, max_sleep=30):
+        self.workers = workers
+        self.max_sleep = max_sleep
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._executor = None
+
+    def add(self, name, func, schedule, missed='catch_up', grace=60):
+        job = Job(name, func, schedule, missed, grace)
+        with self._cond:
+            self._push(job, schedule.next_after(time.time()))
+            self._cond.notify()
+        logging.info('Задача %s (%s): первый запуск %s.', name, schedule, _format_time(job.next_run))
+        return job
+
+    def cancel(self, job):
+        with self._cond:
+            job.cancelled = True
+            self._cond.notify()
+
+    def jobs(self):
+        with self._cond:
+            return sorted((job for _, _, job in self._heap if not job.cancelled), key=lambda job: job.next_run)
+
+    def _push(self, job, when):
+        job.next_run = when
+        heapq.heappush(self._heap, (when, next(self._seq), job))
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def _loop(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait(self.max_sleep)
+                    continue
+                due, _, job = self._heap[0]
+                if job.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.time()
+                if due > now:
+                    # Короткий сон с перепроверкой по настенным часам: не копим дрейф после сна машины
+                    self._cond.wait(min(due - now, self.max_sleep))
+                    continue
+
+                heapq.heappop(self._heap)
+                # Следующий запуск — после текущего момента: несколько пропущенных схлопываются в один
+                self._push(job, job.schedule.next_after(max(due, now)))
+                lateness = now - due
+                if lateness > job.grace and job.missed == 'skip':
+                    logging.warning(
+                        'Задача %s: запуск на %s пропущен '
+                        '(опоздание %.0f с), следующий %s.',
+                        job.name, _format_time(due), lateness, _format_time(job.next_run),
+                    )
+                    continue
+                if job.running:
+                    logging.warning(
+                        'Задача %s: предыдущий запуск еще выполняется, запуск на %s пропущен.',
+                        job.name, _format_time(due),
+                    )
+                    continue
+                job.running = True
+                self._executor.submit(self._run, job, due)
+
+    def _run(self, job, due):
+        started = time.time()
+        perf_started = time.perf_counter()
+        status = 'выполнена'
+        try:
+            job.func()
+        except Exception as e:
+            status = f'завершилась с ошибкой ({e})'
+            logging.error('Ошибка в задаче %s: %s', job.name, e)
+            metrics.registry.inc('job_errors_total', job=job.name)
+        finally:
+            job.running = False
+            metrics.registry.observe('job_lateness_seconds', max(0.0, started - due), job=job.name)
+            metrics.registry.observe('job_duration_seconds', time.perf_counter() - perf_started, job=job.name)
+            logging.info(
+                'Задача %s %s: запуск на %s, опоздание %.1f с, '
+                'длительность %.2f с, следующий %s.',
+                job.name, status, _format_time(due), started - due, time.perf_counter() - perf_started,
+                _format_time(job.next_run),
+            )
@@ -0,0 +1,85 @@
+"""Логирование бота через очередь: вызов logging.* только кладет запись в очередь.
+
+Запись в файл и в консоль делает фоновый поток QueueListener, поэтому поток polling,
+планировщик и отправители не ждут диска. Сообщение собирается из msg % args уже в
+фоновом потоке (логируйте в стиле logging.info('... %s', value)), а отключенный
+уровень не стоит ничего. По умолчанию файл в прежнем текстовом формате; с log_format='json'
+пишется JSON по строке на запись, имя функции и номер строки берутся из самой записи
+(record.funcName, record.lineno). Файл ротируется по размеру.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+LOG_FORMATS = ('json', 'text')
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'module': record.module,
+            'func': record.funcName,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке: очередь не покидает процесс,
+    поэтому запись можно передать как есть, а msg % args выполнит фоновый поток"""
+
+    def prepare(self, record):
+        return record
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """QueueListener, который можно останавливать повторно (вручную и из atexit)"""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(path, level=logging.INFO, log_format='text', max_bytes=10 * 1024 * 1024, backups=5,
+                  console=True):
+    """Вешает на корневой логгер обработчик-очередь и запускает фоновый поток записи.
+
+    Возвращает QueueListener; при выходе из процесса он останавливается сам и дописывает очередь.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f'Неизвестный log_format: {log_format}')
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True,
+    )
+    file_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    handlers = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(stream_handler)
+
+    records = queue.SimpleQueue()
+    listener = _QueueListener(records, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_QueueHandler(records))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,308 @@
+"""Метрики бота: счетчики и гистограммы времени для команды /stats и для Prometheus.
+
+Код бота вызывает registry.inc()/observe() или оборачивает участок в registry.timer()
+(функцию — в registry.timed()). Пока метрики выключены (metrics_enabled = false), каждый
+такой вызов — одна проверка флага: ни замеров времени, ни блокировок. Ряды одной метрики
+различаются метками (command="next5"). Кроме собственных метрик, registry отдает
+текущие stats() компонентов (пул соединений, очередь отправки и т.д.), добавленные
+через add_collector(). render() — текст в формате Prometheus, summary() — сводка для админа.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = 'remindbot_'
+
+# Границы корзин гистограмм времени, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Известные метрики: имя -> (тип, описание)
+METRICS = {
+    'db_query_seconds': ('histogram', 'Запросы к БД через пул соединений'),
+    'db_errors_total': ('counter', 'Запросы к БД, завершившиеся ошибкой'),
+    'snapshot_load_seconds': ('histogram', 'Загрузка выгрузки сотрудников (kind: full или diff)'),
+    'commands_total': ('counter', 'Команды из чатов (result: accepted или debounced)'),
+    'command_seconds': ('histogram', 'Подготовка ответа на команду до постановки в очередь отправки'),
+    'reply_cache_total': ('counter', 'Обращения к кэшу готовых ответов (result: hit или miss)'),
+    'reply_build_seconds': ('histogram', 'Сборка текста ответа по выгрузке'),
+    'render_seconds': ('histogram', 'Отрисовка таблицы /birthdays'),
+    'telegram_send_seconds': ('histogram', 'Запрос к Bot API на отправку'),
+    'outbox_delay_seconds': ('histogram', 'От постановки в очередь отправки до ответа Telegram'),
+    'outbox_retries_total': ('counter', 'Повторные попытки отправки'),
+    'outbox_failed_total': ('counter', 'Сообщения, так и не отправленные'),
+    'job_lateness_seconds': ('histogram', 'Опоздание запуска задачи планировщика'),
+    'job_duration_seconds': ('histogram', 'Длительность задачи планировщика'),
+    'job_errors_total': ('counter', 'Задачи планировщика, завершившиеся ошибкой'),
+}
+
+
+class _Histogram:
+    """Кумулятивные корзины как в Prometheus: counts[i] — значения в (buckets[i-1], buckets[i]]"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (линейно внутри корзины, не больше максимума); None — наблюдений не было"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):
+                    return self.max  # дальше последней границы известен только максимум
+                return min(self.max, low + (self.buckets[i] - low) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'labels', 'started')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _series_name(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """Счетчики и гистограммы в памяти процесса"""
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._series = {}  # (имя, ((метка, значение), ...)) -> число или _Histogram
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._series.get(key)
+            if histogram is None:
+                histogram = self._series[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """with registry.timer('db_query_seconds'): ... — длительность блока в гистограмму name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """Декоратор: длительность каждого вызова функции в гистограмму name"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started, **labels)
+            return wrapper
+        return decorate
+
+    def add_collector(self, name, collect):
+        """collect() -> dict: числовые значения отдаются как gauge <name>_<ключ> (то же имя заменяет прежний)"""
+        self._collectors[name] = collect
+
+    def reset(self):
+        """Забывает накопленные значения и компоненты (повторный init())"""
+        with self._lock:
+            self._series.clear()
+        self._collectors = {}
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(
+                (key, value if not isinstance(value, _Histogram) else _copy(value))
+                for key, value in self._series.items()
+            )
+
+    def _collected(self):
+        """[(имя, {ключ: число})] по всем компонентам; сбой одного не мешает остальным"""
+        result = []
+        for name, collect in list(self._collectors.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                logging.error('Не удалось получить статистику %s: %s', name, e)
+                continue
+            result.append((name, {
+                key: float(value) for key, value in values.items()
+                if isinstance(value, (int, float))
+            }))
+        return result
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        described = set()
+        for (name, labels), value in self._snapshot():
+            metric = PREFIX + name
+            if name not in described:
+                described.add(name)
+                kind, description = METRICS.get(name, ('untyped', ''))
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} {kind}')
+            labels = [(key, _escape(label)) for key, label in labels]
+            if not isinstance(value, _Histogram):
+                lines.append(f'{_series_name(metric, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(value.buckets + ('+Inf',), value.counts):
+                cumulative += count
+                lines.append(f'{_series_name(metric + "_bucket", labels + [("le", bound)])} {cumulative}')
+            lines.append(f'{_series_name(metric + "_sum", labels)} {value.sum}')
+            lines.append(f'{_series_name(metric + "_count", labels)} {value.count}')
+        for component, values in self._collected():
+            for key, value in sorted(values.items()):
+                metric = f'{PREFIX}{component}_{key}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Короткая сводка для /stats: времена (число, среднее, p50, p99), счетчики и статистика компонентов"""
+        timings, counters = [], []
+        for (name, labels), value in self._snapshot():
+            series = _series_name(name, [(key, label) for key, label in labels]).replace('"', '')
+            if isinstance(value, _Histogram):
+                timings.append(
+                    f'{series}: {value.count} шт., ср. {value.sum / value.count * 1000:.1f} мс, '
+                    f'p50 {value.quantile(0.5) * 1000:.1f} мс, p99 {value.quantile(0.99) * 1000:.1f} мс, '
+                    f'макс. {value.max * 1000:.1f} мс'
+                )
+            else:
+                counters.append(f'{series}: {value:g}')
+        parts = [f'Метрики {"включены" if self.enabled else "выключены (metrics_enabled = false)"}.']
+        if timings:
+            parts.append('Время:\n' + '\n'.join(timings))
+        if counters:
+            parts.append('Счетчики:\n' + '\n'.join(counters))
+        collected = self._collected()
+        if collected:
+            parts.append('Компоненты:\n' + '\n'.join(
+                f'{name}: ' + ', '.join(f'{key}={value:g}' for key, value in values.items())
+                for name, values in collected
+            ))
+        return '\n\n'.join(parts)
+
+
+def _copy(histogram):
+    copy = _Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.count = histogram.count
+    copy.sum = histogram.sum
+    copy.max = histogram.max
+    return copy
+
+
+# Общий реестр процесса; включается в remindbot2.init()
+registry = MetricsRegistry()
+
+
+class MetricsServer:
+    """HTTP-эндпоинт для Prometheus: GET <path> отдает registry.render()"""
+
+    def __init__(self, registry, host='127.0.0.1', port=9108, path='/metrics'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != server.path:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('metrics: ' + format, *args)
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        logging.info('Метрики доступны на http://%s:%s%s', self.address[0], self.address[1], self.path)
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
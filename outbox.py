@@ -0,0 +1,406 @@
+"""Очередь исходящих сообщений в Telegram.
+
+Обработчики и планировщик не вызывают bot.send_* сами, а ставят сообщение в очередь
+и сразу возвращаются. Отдельный поток-диспетчер выдерживает лимиты Bot API (общий и
+для каждого чата, token bucket), склеивает стоящие подряд текстовые сообщения в один
+чат и передает отправку небольшому пулу потоков. Ошибки сети и 5xx повторяются с
+экспоненциальной задержкой, на 429 чат ставится на паузу на retry_after секунд.
+
+AsyncSender — те же правила для асинхронного бота (runtime = async): отправка идет прямо
+из корутины команды, без очереди и потоков.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+
+# Максимальная длина текста одного сообщения в Telegram
+MESSAGE_LIMIT = 4096
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _fill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд появится токен (0 — уже есть)"""
+        self._fill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._fill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._fill(now)
+        return self.tokens >= self.burst
+
+
+class _Outgoing:
+    """Сообщение (или несколько склеенных) в очереди одного чата"""
+
+    __slots__ = ('method', 'chat_id', 'payload', 'kwargs', 'coalesce', 'futures', 'enqueued_at', 'attempts')
+
+    def __init__(self, method, chat_id, payload, kwargs, coalesce):
+        self.method = method
+        self.chat_id = chat_id
+        self.payload = payload
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.futures = [Future()]
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def can_merge(self, other, limit):
+        return (
+            self.method == other.method == 'message'
+            and self.coalesce and other.coalesce
+            and self.kwargs == other.kwargs
+            and len(self.payload) + 2 + len(other.payload) <= limit
+        )
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 3)
+
+
+class Outbox:
+    """Очередь отправки поверх синхронного TeleBot.
+
+    send_message/send_photo возвращают concurrent.futures.Future с ответом Telegram
+    (telebot.types.Message) или с исключением, если отправить так и не удалось.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_attempts=5,
+                 backoff=1.0, max_backoff=60, senders=4, coalesce_limit=MESSAGE_LIMIT):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.senders = senders
+        self.coalesce_limit = coalesce_limit
+        self._global = TokenBucket(global_rate, max(1, global_rate))
+        self._chat_buckets = {}
+        self._cond = threading.Condition()
+        self._pending = {}       # chat_id -> deque(_Outgoing)
+        self._schedule = []      # куча (когда можно отправлять, порядковый номер, chat_id)
+        self._scheduled = set()
+        self._inflight = set()   # чаты, по которым сейчас идет отправка: порядок внутри чата сохраняется
+        self._seq = itertools.count()
+        self._closed = False
+        self._thread = None
+        self._executor = None
+        self.enqueued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+        self._latencies = deque(maxlen=1000)       # от постановки в очередь до ответа Telegram
+        self._send_latencies = deque(maxlen=1000)  # длительность самого запроса к Bot API
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.senders, thread_name_prefix='outbox-send')
+        self._thread = threading.Thread(target=self._dispatch, name='outbox', daemon=True)
+        self._thread.start()
+        return self
+
+    def send_message(self, chat_id, text, parse_mode=None, coalesce=True, **kwargs):
+        if parse_mode is not None:
+            kwargs['parse_mode'] = parse_mode
+        return self._enqueue(_Outgoing('message', chat_id, text, kwargs, coalesce))
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        """photo — file_id, bytes или файлоподобный объект"""
+        return self._enqueue(_Outgoing('photo', chat_id, photo, kwargs, False))
+
+    def _enqueue(self, item):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Очередь отправки остановлена')
+            self._pending.setdefault(item.chat_id, deque()).append(item)
+            self.enqueued += 1
+            self._schedule_chat(item.chat_id, time.monotonic())
+            self._cond.notify()
+        return item.futures[0]
+
+    def _schedule_chat(self, chat_id, at):
+        if chat_id in self._scheduled or chat_id in self._inflight or not self._pending.get(chat_id):
+            return
+        heapq.heappush(self._schedule, (at, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 1000:
+                # Полный bucket ничем не отличается от нового, такие можно забыть
+                now = time.monotonic()
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items()
+                    if key in self._pending or not value.is_full(now)
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _dispatch(self):
+        with self._cond:
+            while True:
+                if not self._schedule:
+                    if self._closed and not self._inflight:
+                        return
+                    self._cond.wait()
+                    continue
+                ready_at, seq, chat_id = self._schedule[0]
+                now = time.monotonic()
+                chat_wait = max(ready_at - now, self._bucket(chat_id).delay(now))
+                if chat_wait > 0:
+                    # Чат еще на паузе — пропускаем вперед остальные чаты
+                    heapq.heapreplace(self._schedule, (now + chat_wait, seq, chat_id))
+                    if self._schedule[0][2] == chat_id:
+                        self._cond.wait(chat_wait)
+                    continue
+                global_wait = self._global.delay(now)
+                if global_wait > 0:
+                    self._cond.wait(global_wait)
+                    continue
+
+                heapq.heappop(self._schedule)
+                self._scheduled.discard(chat_id)
+                self._global.take(now)
+                self._bucket(chat_id).take(now)
+                item = self._take_batch(chat_id)
+                self._inflight.add(chat_id)
+                self._executor.submit(self._deliver, item)
+
+    def _take_batch(self, chat_id):
+        """Первое сообщение чата, к которому приклеены следующие за ним текстовые"""
+        queue = self._pending[chat_id]
+        item = queue.popleft()
+        while queue and item.can_merge(queue[0], self.coalesce_limit):
+            following = queue.popleft()
+            item.payload = f'{item.payload}\n\n{following.payload}'
+            item.futures.extend(following.futures)
+            self.coalesced += 1
+        if not queue:
+            del self._pending[chat_id]
+        return item
+
+    def _retry_delay(self, item, error):
+        """Через сколько секунд повторить отправку или None, если повторять не нужно"""
+        if item.attempts + 1 >= self.max_attempts:
+            return None
+        if isinstance(error, ApiTelegramException):
+            if error.error_code == 429:
+                parameters = (error.result_json or {}).get('parameters') or {}
+                return float(parameters.get('retry_after', self.backoff))
+            if error.error_code < 500:
+                return None
+        elif not isinstance(error, requests.exceptions.RequestException):
+            return None
+        delay = min(self.max_backoff, self.backoff * 2 ** item.attempts)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _call(self, item):
+        if hasattr(item.payload, 'seek'):
+            item.payload.seek(0)
+        if item.method == 'message':
+            return self.bot.send_message(item.chat_id, item.payload, **item.kwargs)
+        return self.bot.send_photo(item.chat_id, item.payload, **item.kwargs)
+
+    def _release(self, chat_id, at):
+        with self._cond:
+            self._inflight.discard(chat_id)
+            self._schedule_chat(chat_id, at)
+            self._cond.notify()
+
+    def _deliver(self, item):
+        started = time.monotonic()
+        try:
+            result = self._call(item)
+        except Exception as e:
+            delay = self._retry_delay(item, e)
+            if delay is not None:
+                with self._cond:
+                    item.attempts += 1
+                    self.retries += 1
+                    self._pending.setdefault(item.chat_id, deque()).appendleft(item)
+                metrics.registry.inc('outbox_retries_total', method=item.method)
+                logging.warning(
+                    'Не удалось отправить сообщение в чат %s: %s. '
+                    'Повтор через %.1f с (попытка %s из %s).',
+                    item.chat_id, e, delay, item.attempts + 1, self.max_attempts,
+                )
+                self._release(item.chat_id, time.monotonic() + delay)
+                return
+            with self._cond:
+                self.failed += len(item.futures)
+            metrics.registry.inc('outbox_failed_total', len(item.futures), method=item.method)
+            logging.error('Сообщение в чат %s не отправлено после %s попыток: %s', item.chat_id, item.attempts + 1, e)
+            self._release(item.chat_id, time.monotonic())
+            for future in item.futures:
+                future.set_exception(e)
+            return
+
+        finished = time.monotonic()
+        with self._cond:
+            self.sent += 1
+            self._send_latencies.append(finished - started)
+            self._latencies.append(finished - item.enqueued_at)
+        metrics.registry.observe('telegram_send_seconds', finished - started, method=item.method)
+        metrics.registry.observe('outbox_delay_seconds', finished - item.enqueued_at, method=item.method)
+        self._release(item.chat_id, finished)
+        for future in item.futures:
+            future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': sum(len(queue) for queue in self._pending.values()),
+                'inflight': len(self._inflight),
+                'enqueued': self.enqueued,
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'retries': self.retries,
+                'failed': self.failed,
+                'latency_p50': _percentile(self._latencies, 0.5),
+                'latency_p99': _percentile(self._latencies, 0.99),
+                'send_p50': _percentile(self._send_latencies, 0.5),
+            }
+
+    def stop(self, timeout=30):
+        """Прекращает прием и ждет отправки уже поставленных сообщений (не дольше timeout)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=not self._thread.is_alive())
+        logging.info('Очередь отправки остановлена: %s', self.stats())
+
+
+class AsyncSender:
+    """Отправка из корутин AsyncTeleBot по правилам Outbox.
+
+    Outbox построен на потоках вокруг синхронного TeleBot, и в цикл событий его не встроить.
+    Здесь те же лимиты (общий и на чат, token bucket) выдерживаются через asyncio.sleep,
+    на 429 отправка ждет retry_after, ошибки сети и 5xx повторяются с экспоненциальной
+    задержкой. Склеивания сообщений нет: каждая команда отвечает одним сообщением.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_attempts=5,
+                 backoff=1.0, max_backoff=60):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._global = TokenBucket(global_rate, max(1, global_rate))
+        self._chat_buckets = {}
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 1000:
+                now = time.monotonic()
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if not value.is_full(now)}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _wait_turn(self, chat_id):
+        """Ждет токена чата и общего токена; между проверкой и take() цикл событий не переключается"""
+        bucket = self._bucket(chat_id)
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.delay(now), self._global.delay(now))
+            if wait <= 0:
+                bucket.take(now)
+                self._global.take(now)
+                return
+            await asyncio.sleep(wait)
+
+    def _retry_delay(self, attempt, error):
+        """Через сколько секунд повторить отправку или None, если повторять не нужно"""
+        from telebot import asyncio_helper
+
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if isinstance(error, (ApiTelegramException, asyncio_helper.ApiTelegramException)):
+            if error.error_code == 429:
+                parameters = (error.result_json or {}).get('parameters') or {}
+                return float(parameters.get('retry_after', self.backoff))
+            if error.error_code < 500:
+                return None
+        elif not isinstance(error, (asyncio_helper.RequestTimeout, asyncio_helper.ApiHTTPException)):
+            return None
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _send(self, method, chat_id, payload, kwargs):
+        for attempt in itertools.count():
+            await self._wait_turn(chat_id)
+            if hasattr(payload, 'seek'):
+                payload.seek(0)
+            started = time.monotonic()
+            try:
+                if method == 'message':
+                    result = await self.bot.send_message(chat_id, payload, **kwargs)
+                else:
+                    result = await self.bot.send_photo(chat_id, payload, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    self.failed += 1
+                    metrics.registry.inc('outbox_failed_total', method=method)
+                    raise
+                self.retries += 1
+                metrics.registry.inc('outbox_retries_total', method=method)
+                logging.warning(
+                    'Не удалось отправить сообщение в чат %s: %s. Повтор через %.1f с (попытка %s из %s).',
+                    chat_id, e, delay, attempt + 2, self.max_attempts,
+                )
+                await asyncio.sleep(delay)
+                continue
+            self.sent += 1
+            metrics.registry.observe('telegram_send_seconds', time.monotonic() - started, method=method)
+            return result
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        if parse_mode is not None:
+            kwargs['parse_mode'] = parse_mode
+        return await self._send('message', chat_id, text, kwargs)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        """photo — file_id, bytes или файлоподобный объект"""
+        return await self._send('photo', chat_id, photo, kwargs)
+
+    def stats(self):
+        return {'sent': self.sent, 'retries': self.retries, 'failed': self.failed}
@@ -0,0 +1,219 @@
+"""Построители SQL-запросов к выгрузке сотрудников с портала.
+
+Все запросы к nsi_data.dict_portal_ac_employees_tb_form собираются здесь:
+фильтр по последнему "current_timestamp", status, ILIKE по подразделениям и
+DISTINCT ON (fullname) больше не дублируются по коду. Функции возвращают пару
+(sql, params) для cursor.execute.
+"""
+import re
+
+EMPLOYEES_TABLE = 'nsi_data.dict_portal_ac_employees_tb_form'
+
+# Фамилия и имя без отчества
+SHORT_FULLNAME = "substring(fullname from '^[^ ]+ [^ ]+') AS fullname"
+
+LATEST_TIMESTAMP_SQL = f"""
+    SELECT max("current_timestamp")
+    FROM {EMPLOYEES_TABLE}
+"""
+
+# 'DD.MM' и 'DD.MM.YYYY'; год с ведущим нулем make_date не примет
+BIRTHDAY_RE = r'^(\d{1,2})\.(\d{1,2})$'
+VACATION_DATE_RE = r'^(\d{1,2})\.(\d{1,2})\.([1-9]\d{3})$'
+
+
+def build_roster_query(columns, departments=None, active_only=True, conditions=(),
+                       distinct_on=None, order_by='fullname', timestamp=None):
+    """Запрос к одной выгрузке (по умолчанию — последней).
+
+    departments — шаблоны ILIKE для подразделений (None — все сотрудники),
+    timestamp — конкретный "current_timestamp" вместо подзапроса max().
+    """
+    params = {}
+    if timestamp is None:
+        where = [f'"current_timestamp" = (SELECT max("current_timestamp") FROM {EMPLOYEES_TABLE})']
+    else:
+        where = ['"current_timestamp" = %(timestamp)s']
+        params['timestamp'] = timestamp
+    if active_only:
+        where.append('status IS TRUE')
+    if departments is not None:
+        where.append('department ILIKE ANY(%(departments)s)')
+        params['departments'] = list(departments)
+    where.extend(conditions)
+
+    distinct = f"DISTINCT ON ({', '.join(distinct_on)}) " if distinct_on else ''
+    sql = (
+        f"SELECT {distinct}{', '.join(columns)}\n"
+        f"FROM {EMPLOYEES_TABLE}\n"
+        f"WHERE {' AND '.join(where)}"
+    )
+    if order_by:
+        sql += f"\nORDER BY {order_by}"
+    return sql, params
+
+
+def build_birthdays_query(departments=None):
+    """(ФИО, 'DD.MM') активных сотрудников, по одному на ФИО"""
+    return build_roster_query([SHORT_FULLNAME, 'birthday'], departments=departments, distinct_on=['fullname'])
+
+
+def build_vacations_query(departments=None):
+    """(ФИО, начало, конец) всех отпусков активных сотрудников"""
+    return build_roster_query(
+        [SHORT_FULLNAME, 'vac_date_start', 'vac_date_end'],
+        departments=departments,
+        conditions=['vac_date_start IS NOT NULL', 'vac_date_end IS NOT NULL'],
+        distinct_on=['fullname', 'vac_date_start'],
+    )
+
+
+def _safe_date(year, month, day):
+    """Дата из чисел, которая не падает на некорректных значениях (31.02 превращается в 03.03)"""
+    return f"(make_date({year}, 1, 1) + make_interval(months => {month} - 1, days => {day} - 1))::date"
+
+
+def _is_valid_date(year, month, day):
+    """Числа действительно образуют дату: при нормализации _safe_date ничего не "съехало" """
+    expr = _safe_date(year, month, day)
+    return f"(extract(month FROM {expr}) = {month} AND extract(day FROM {expr}) = {day})"
+
+
+def _birthday_in_year(year):
+    """День рождения (bd, bm) в году year; 29.02 в невисокосный год — 28.02 (как в roster.birthday_in_year)"""
+    month_end = f"({_safe_date(year, 'bm + 1', 1)} - 1)"
+    return f"LEAST({_safe_date(year, 'bm', 'bd')}, {month_end})"
+
+
+def build_next_birthdays_query(departments, today, count):
+    """Ближайшие count различных дат дней рождения, посчитанные на стороне БД.
+
+    Возвращает строки (ФИО, 'DD.MM', дней до дня рождения), отсортированные по дням;
+    по сети передаются только строки, попавшие в эти count дат.
+    """
+    roster_sql, params = build_birthdays_query(departments)
+    this_year = _birthday_in_year('%(year)s')
+    next_year = _birthday_in_year('%(year)s + 1')
+    sql = f"""
+        WITH roster AS (
+            {roster_sql}
+        ),
+        parsed AS (
+            SELECT fullname, birthday, parts[1]::int AS bd, parts[2]::int AS bm
+            FROM (SELECT fullname, birthday, regexp_match(birthday, '{BIRTHDAY_RE}') AS parts FROM roster) r
+            WHERE parts IS NOT NULL
+        ),
+        upcoming AS (
+            SELECT fullname, birthday,
+                   CASE WHEN {this_year} >= %(today)s::date THEN {this_year} ELSE {next_year} END
+                       - %(today)s::date AS days_until
+            FROM parsed
+            WHERE {_is_valid_date(2000, 'bm', 'bd')}
+        )
+        SELECT fullname, birthday, days_until
+        FROM upcoming
+        WHERE days_until IN (SELECT DISTINCT days_until FROM upcoming ORDER BY days_until LIMIT %(count)s)
+        ORDER BY days_until, fullname
+    """
+    params.update(today=today, year=today.year, count=count)
+    return sql, params
+
+
+def _normalized_vacation_date(column):
+    """Текст даты отпуска в виде 'DD.MM.YYYY' (колонка может оказаться и типа date)"""
+    return rf"regexp_replace({column}::text, '^(\d{{4}})-(\d{{2}})-(\d{{2}}).*$', '\3.\2.\1')"
+
+
+def build_vacation_window_query(departments, first, last):
+    """Отпуска, пересекающиеся с окном [first, last], с датами, разобранными на стороне БД.
+
+    Возвращает строки (ФИО, начало, конец) в порядке даты начала; строки с битыми
+    датами отбрасываются, а не роняют весь запрос.
+    """
+    roster_sql, params = build_vacations_query(departments)
+    start_date = _safe_date('sy', 'sm', 'sd')
+    end_date = _safe_date('ey', 'em', 'ed')
+    sql = f"""
+        WITH roster AS (
+            {roster_sql}
+        ),
+        parsed AS (
+            SELECT fullname,
+                   s[1]::int AS sd, s[2]::int AS sm, s[3]::int AS sy,
+                   e[1]::int AS ed, e[2]::int AS em, e[3]::int AS ey
+            FROM (
+                SELECT fullname,
+                       regexp_match({_normalized_vacation_date('vac_date_start')}, '{VACATION_DATE_RE}') AS s,
+                       regexp_match({_normalized_vacation_date('vac_date_end')}, '{VACATION_DATE_RE}') AS e
+                FROM roster
+            ) r
+            WHERE s IS NOT NULL AND e IS NOT NULL
+        ),
+        dated AS (
+            SELECT fullname, {start_date} AS start_date, {end_date} AS end_date
+            FROM parsed
+            WHERE {_is_valid_date('sy', 'sm', 'sd')} AND {_is_valid_date('ey', 'em', 'ed')}
+        )
+        SELECT fullname, start_date, end_date
+        FROM dated
+        WHERE end_date >= %(first)s::date AND start_date <= %(last)s::date
+        ORDER BY start_date, end_date, fullname
+    """
+    params.update(first=first, last=last)
+    return sql, params
+
+
+# Колонки строки выгрузки в порядке полей roster.Employee
+SNAPSHOT_COLUMNS = [SHORT_FULLNAME, 'birthday', 'department', 'status', 'vac_date_start', 'vac_date_end']
+
+
+def build_snapshot_query(timestamp):
+    """Все строки выгрузки за timestamp для RosterSnapshot, включая неактивных сотрудников"""
+    return build_roster_query(
+        SNAPSHOT_COLUMNS,
+        active_only=False,
+        order_by=None,
+        timestamp=timestamp,
+    )
+
+
+def build_snapshot_count_query(timestamp):
+    """Число строк выгрузки за timestamp (есть ли она еще в БД и та ли это выгрузка)"""
+    return build_roster_query(['count(*)'], active_only=False, order_by=None, timestamp=timestamp)
+
+
+def build_snapshot_diff_query(old_timestamp, new_timestamp):
+    """Строки, которыми выгрузка new_timestamp отличается от old_timestamp (EXCEPT ALL в обе стороны).
+
+    Возвращает ('+' или '-', затем колонки build_snapshot_query): по сети и в Python
+    идут только изменившиеся строки, а не вся выгрузка.
+    """
+    columns = ', '.join(SNAPSHOT_COLUMNS)
+
+    def batch(change, timestamp):
+        return f'''SELECT '{change}' AS change, {columns} FROM {EMPLOYEES_TABLE} WHERE "current_timestamp" = %({timestamp})s'''
+
+    sql = f"""
+        ({batch('+', 'new')}
+         EXCEPT ALL
+         {batch('+', 'old')})
+        UNION ALL
+        ({batch('-', 'old')}
+         EXCEPT ALL
+         {batch('-', 'new')})
+    """
+    return sql, {'old': old_timestamp, 'new': new_timestamp}
+
+
+def to_asyncpg(sql, params):
+    """Переводит запрос с параметрами psycopg2 (%(name)s) в вид asyncpg: ($1, $2, ...) и список значений"""
+    names = []
+
+    def placeholder(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f'${names.index(name) + 1}'
+
+    converted = re.sub(r'%\((\w+)\)s', placeholder, sql).replace('%%', '%')
+    return converted, [params[name] for name in names]
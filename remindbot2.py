@@ -1,611 +1,1771 @@
+import time
+
+# Момент начала импорта модуля — для замера холодного старта
+_IMPORT_STARTED = time.perf_counter()
+
 import platform
 import requests
 import telebot
 from telebot.types import Message
 import psycopg2
+import psycopg2.pool
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-import time
 import threading
-import pandas as pd
-import matplotlib.pyplot as plt
+import signal
+import asyncio
+import functools
 import io
+import itertools
 import configparser
 import logging
 import os
-import inspect
 
-# Настройка логгирования
-LOG_PATH = os.path.join(os.path.dirname(__file__), 'bot.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_PATH, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+from queries import (
+    LATEST_TIMESTAMP_SQL,
+    build_birthdays_query,
+    build_next_birthdays_query,
+    build_snapshot_count_query,
+    build_snapshot_diff_query,
+    build_snapshot_query,
+    build_vacation_window_query,
+    build_vacations_query,
+    to_asyncpg,
+)
+from coalesce import Debouncer, SingleFlight
+from datebatch import BIRTHDAY_BUCKETS, birthday_bucket_bounds
+from groups import DIGEST_PARTS, Group, GroupRegistry
+import log_pipeline
+import metrics
+from metrics import MetricsServer
+from jobs import MISSED_RUN_RULES, Schedule, Scheduler, get_timezone
+from outbox import MESSAGE_LIMIT, AsyncSender, Outbox
+from render import RENDERERS
+from render_pool import RenderPool
+from roster import (
+    BirthdayIndex,
+    RosterSnapshot,
+    SnapshotDiff,
+    VacationIndex,
+    birthdays_by_bucket,
+    next_birthdays,
+    parse_vacation_date,
+    vacations_overlapping,
 )
+from snapshot_store import SnapshotStore
+from sync_watcher import SyncWatcher
 
-def log_info(msg):
-    frame = inspect.currentframe().f_back
-    logging.info(f"[{frame.f_code.co_name}:{frame.f_lineno}] {msg}")
+# pandas (и matplotlib, если выбран этот способ отрисовки) импортируются лениво,
+# только для /birthdays: они заметно замедляют холодный старт, а нужны одной команде.
 
-# Чтение конфига
+# Настройка логгирования
+LOG_PATH = os.path.join(os.path.dirname(__file__), 'bot.log')
+SNAPSHOT_STORE_PATH = os.path.join(os.path.dirname(__file__), 'roster_snapshot.sqlite3')
+
+def setup_logging(settings=None):
+    """Логи через очередь и фоновый поток (см. log_pipeline): файл log_path в формате log_format
+    (text по умолчанию или json) с ротацией по log_max_bytes, log_backups старых файлов, плюс консоль"""
+    if logging.getLogger().handlers:
+        return  # логирование уже настроено снаружи (тесты, бенчмарки)
+    settings = settings if settings is not None else {}
+    log_pipeline.setup_logging(
+        settings.get('log_path', LOG_PATH),
+        level=settings.get('log_level', 'INFO').upper(),
+        log_format=settings.get('log_format', 'text'),
+        max_bytes=int(settings.get('log_max_bytes', 10 * 1024 * 1024)),
+        backups=int(settings.get('log_backups', 5)),
+    )
+
+# Путь к конфигу
 if (platform.system()) == 'Windows':
     CONFIG_PATH = 'C:\\local_config\\my_global_config.cfg'
 else:
     CONFIG_PATH = '/home/semen106/bot/my_global_config.cfg'
 
-config = configparser.ConfigParser()
-config.read(CONFIG_PATH)
-
-db_creds = config['HOSTER_KC_DB'] if platform.system() == 'Windows' else config['HOSTER_KC_DB_LOCAL']
-
-TELEGRAM_TOKEN = config['REMINDBOT2']['remindbot_token']
 BIRTHDAY_CHAT_WITH_NIKA = 'birthday_chat_with_nika'  # Замените на нужный chat_id
 
-ADMIN_CHAT_ID = int(config['REMINDBOT2']['admin_chat_id'])  # id админа из конфига
-CHAT_ID = int(config['REMINDBOT2']['birthday_chat_with_nika'])  # id основного чата из конфига
+# Заполняются в init(): импорт модуля не читает конфиг и не ходит в сеть
+config = None
+db_creds = None
+TELEGRAM_TOKEN = None
+ADMIN_CHAT_ID = None  # id админа из конфига
+CHAT_ID = None  # id основного чата из конфига
 
 progroup_html_icon = f'<tg-emoji emoji-id="5249481442043393850">🦆</tg-emoji>'
 bunker_html_icon = f'<tg-emoji emoji-id="5249462587136966291">🧟‍♂️</tg-emoji>'
 
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
 
-# Приветственное сообщение админу при запуске
-try:
-    bot.send_message(ADMIN_CHAT_ID, 'Бот напоминалка успешно запущен!')
-    logging.info('Приветственное сообщение админу отправлено.')
-except Exception as e:
-    logging.error(f'Ошибка при отправке приветственного сообщения админу: {e}')
+class ConnectionPool:
+    """Потокобезопасный пул соединений с PostgreSQL.
+
+    Соединения переиспользуются между потоком polling и планировщиком.
+    Перед выдачей давно простаивающее соединение проверяется запросом SELECT 1,
+    разорванные соединения отбрасываются и открываются заново.
+    """
+
+    _BROKEN_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+    def __init__(self, creds, minconn=1, maxconn=4, timeout=30, check_interval=60, max_idle=600):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f'Некорректные размеры пула: min={minconn}, max={maxconn}')
+        self._creds = dict(creds)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self._idle = []  # стек (соединение, время возврата в пул по monotonic)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self._cursor_ids = itertools.count(1)
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._creds)
+        # Только чтение: без autocommit соединение висело бы в пуле "idle in transaction"
+        conn.autocommit = True
+        return conn
+
+    def dedicated_connection(self):
+        """Отдельное соединение вне пула (для LISTEN), закрывает его вызывающий"""
+        return self._connect()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            return True
+        except Exception as e:
+            logging.warning('Соединение из пула не прошло проверку: %s', e)
+            return False
+
+    def warmup(self):
+        """Открывает minconn соединений заранее, чтобы первые команды не ждали подключения"""
+        with self._lock:
+            missing = self.minconn - len(self._idle)
+        for _ in range(missing):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(f'Нет свободных соединений в пуле за {self.timeout} с')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    break
+                conn, returned_at = item
+                if self._is_healthy(conn, returned_at):
+                    with self._lock:
+                        self.hits += 1
+                    return conn
+                self._close(conn)
+                with self._lock:
+                    self.reconnects += 1
+            conn = self._connect()
+            with self._lock:
+                self.misses += 1
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken=False):
+        try:
+            if broken or conn.closed:
+                self._close(conn)
+                return
+            now = time.monotonic()
+            with self._lock:
+                self._idle.append((conn, now))
+                # Лишние простаивающие соединения сверх minconn закрываем
+                stale = []
+                while len(self._idle) > self.minconn and now - self._idle[0][1] > self.max_idle:
+                    stale.append(self._idle.pop(0)[0])
+            for old in stale:
+                self._close(old)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except self._BROKEN_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def _execute(self, sql, params, fetch):
+        # Одна повторная попытка на случай разорванного соединения (все запросы только на чтение)
+        for attempt in (1, 2):
+            try:
+                with metrics.registry.timer('db_query_seconds', fetch=fetch):
+                    with self.connection() as conn:
+                        with conn.cursor() as cur:
+                            cur.execute(sql, params)
+                            return cur.fetchall() if fetch == 'all' else cur.fetchone()
+            except self._BROKEN_ERRORS as e:
+                metrics.registry.inc('db_errors_total')
+                if attempt == 2:
+                    raise
+                with self._lock:
+                    self.reconnects += 1
+                logging.warning('Соединение с БД разорвано (%s), переподключение...', e)
+
+    def fetchall(self, sql, params=None):
+        return self._execute(sql, params, 'all')
+
+    def fetchone(self, sql, params=None):
+        return self._execute(sql, params, 'one')
+
+    def iterate(self, sql, params=None, itersize=2000):
+        """Строки запроса по мере чтения: именованный (серверный) курсор отдает их пачками по itersize.
+
+        Соединение занято, пока генератор не дочитан или не закрыт. Повторной попытки
+        при разрыве нет: часть строк уже могла уйти вызывающему.
+        """
+        with metrics.registry.timer('db_query_seconds', fetch='stream'):
+            with self.connection() as conn:
+                # Серверному курсору нужна транзакция, а соединения пула работают в autocommit
+                conn.autocommit = False
+                try:
+                    with conn.cursor(name=f'remindbot_stream_{next(self._cursor_ids)}') as cur:
+                        cur.itersize = itersize
+                        cur.execute(sql, params)
+                        yield from cur
+                finally:
+                    if not conn.closed:
+                        try:
+                            conn.rollback()
+                            conn.autocommit = True
+                        except self._BROKEN_ERRORS:
+                            self._close(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reconnects': self.reconnects,
+                'idle': len(self._idle),
+                'min': self.minconn,
+                'max': self.maxconn,
+            }
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+# Подразделения PROгруппы
+GROUP_DEPARTMENT_PATTERNS = ['%перационная%', '%роект%', '%мультимед%', '%руковод%']
+
+
+def default_groups():
+    """Группы по умолчанию (без секций [GROUP ...] в конфиге): PROгруппа и весь БУНКЕР в основной чат"""
+    return [
+        Group('progroup', GROUP_DEPARTMENT_PATTERNS, icon=progroup_html_icon,
+              title='<b>PRO</b>ГРУППА', vacations_title='<b>ОТПУСКА PRO</b>ГРУППЫ',
+              chats=[CHAT_ID], digest=['next5', 'vacations']),
+        Group('bunker', icon=bunker_html_icon, title='БУНКЕР', vacations_title='ОТПУСКА БУНКЕРА',
+              chats=[CHAT_ID], digest=['next5']),
+    ]
 
+# Режим запросов к выгрузке: 'snapshot' — вся выгрузка в памяти (по умолчанию),
+# 'server' — окна дней рождения и отпусков считаются в SQL, по сети идут только нужные строки,
+# 'stream' — строки читаются серверным курсором пачками по db_itersize и сразу фильтруются
+# в Python: в памяти остаются только попавшие в окно отпуска и ближайшие дни рождения.
+# Переопределяется параметром roster_query_mode в init().
+ROSTER_QUERY_MODE = 'snapshot'
+ROSTER_QUERY_MODES = ('snapshot', 'server', 'stream')
+DB_ITERSIZE = 2000
+
+# Горизонт (в днях) для текущих и предстоящих отпусков
+VACATION_HORIZON_DAYS = 30
+
+# Режим работы бота: 'sync' — telebot.polling в одном потоке (по умолчанию),
+# 'async' — AsyncTeleBot и asyncpg, команды обрабатываются конкурентно.
+# Переопределяется параметрами runtime и async_max_concurrency в init().
+RUNTIME = 'sync'
+ASYNC_MAX_CONCURRENCY = 8
+
+# Откуда брать обновления: 'polling' — long polling (по умолчанию), 'webhook' — встроенный
+# HTTP-сервер (webhook.py), на который Telegram сам присылает обновления.
+# Переопределяется параметрами update_mode и webhook_* в init().
+UPDATE_MODE = 'polling'
+WEBHOOK_SETTINGS = {}
+
+# Метрики (metrics_enabled) и HTTP-эндпоинт для Prometheus (metrics_port, 0 — не открывать)
+METRICS_SETTINGS = {}
+
+# Расписание ночной рассылки: по умолчанию 03:30 по времени сервера во все подписанные чаты.
+# Переопределяется параметрами timezone, digest_schedule, warmup_before, scheduler_workers,
+# missed_runs, missed_grace, prerender_schedule и секцией REMINDBOT2_DIGEST (chat_id = расписание) в init().
+SCHEDULE_SETTINGS = {}
+
+# Сообщать админу о добавленных и отмененных отпусках в новой выгрузке (notify_vacation_changes)
+NOTIFY_VACATION_CHANGES = False
+VACATION_CHANGES_LIMIT = 30
+
+# Чем рисовать таблицу /birthdays: 'pillow' (по умолчанию) или 'matplotlib'.
+# Переопределяется параметром birthday_table_renderer в init().
+BIRTHDAY_TABLE_RENDERER = 'pillow'
+
+# Отрисовка в отдельных процессах (render_pool.py): render_processes (0 — рисовать в процессе бота),
+# render_max_tasks, render_max_rss_mb, render_timeout. Пул запускается вместе с ботом (run_bot*).
+RENDER_POOL_SETTINGS = {}
+
+
+class SnapshotCache:
+    """Кэш последней выгрузки сотрудников в памяти.
+
+    Полная выгрузка читается один раз на каждый новый "current_timestamp";
+    между проверками (не чаще check_interval) команды обслуживаются из памяти.
+    Следующие выгрузки приходят из БД разницей с предыдущей (EXCEPT ALL), и индексы
+    обновляются только по изменившимся строкам.
+    Если задан store, выгрузка сохраняется на диск и читается оттуда при запуске,
+    чтобы команды работали и без БД. Когда новые выгрузки отслеживает SyncWatcher
+    (watched = True), get() вообще не ходит в БД: refresh() из обработчика события
+    подменяет выгрузку целиком.
+    """
+
+    def __init__(self, pool, check_interval=60, store=None):
+        self._pool = pool
+        self.check_interval = check_interval
+        self.store = store
+        self._snapshot = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self.watched = False
+        # Разницу можно считать только от выгрузки, прочитанной из БД (в файле другие типы дат)
+        self._from_db = False
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is not None and (self.watched or time.monotonic() - self._checked_at < self.check_interval):
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._snapshot
+            return self._refresh_or_keep()
+
+    def refresh(self):
+        """Проверяет БД прямо сейчас; при ошибке остается прежняя выгрузка"""
+        with self._lock:
+            return self._refresh_or_keep()
+
+    def _refresh_or_keep(self):
+        try:
+            return self._refresh()
+        except Exception as e:
+            # Следующая попытка — не раньше чем через check_interval, а не на каждой команде
+            self._checked_at = time.monotonic()
+            if self._snapshot is None:
+                raise
+            logging.error(
+                'Не удалось проверить актуальность выгрузки, используем сохраненную '
+                'на %s: %s',
+                self._snapshot.sync_date(), e,
+            )
+            return self._snapshot
+
+    def _refresh(self):
+        latest = self._pool.fetchone(LATEST_TIMESTAMP_SQL)[0]
+        self._checked_at = time.monotonic()
+        previous = self._snapshot
+        if previous is not None and previous.timestamp == latest:
+            return previous
+        snapshot = None
+        if self._from_db and previous.timestamp is not None and latest is not None:
+            snapshot = self._load_diff(previous, latest)
+        if snapshot is None:
+            started = time.perf_counter()
+            rows = self._pool.fetchall(*build_snapshot_query(latest)) if latest is not None else []
+            snapshot = RosterSnapshot(latest, rows)
+            if self._from_db:
+                snapshot.diff = SnapshotDiff.between(previous, snapshot)
+            metrics.registry.observe('snapshot_load_seconds', time.perf_counter() - started, kind='full')
+            logging.info(
+                'Загружена выгрузка сотрудников на %s: '
+                '%d записей за %.2f с.',
+                snapshot.sync_date(), len(snapshot), time.perf_counter() - started,
+            )
+        self._snapshot = snapshot
+        self._from_db = True
+        if self.store is not None:
+            try:
+                self.store.save(snapshot)
+            except Exception as e:
+                logging.error('Не удалось сохранить выгрузку на диск: %s', e)
+        return snapshot
+
+    def _load_diff(self, previous, latest):
+        """Новая выгрузка как previous + разница из БД; None — если разницу взять не от чего"""
+        started = time.perf_counter()
+        # Старую выгрузку могли удалить или перезалить — тогда разница с ней бессмысленна
+        if self._pool.fetchone(*build_snapshot_count_query(previous.timestamp))[0] != len(previous):
+            logging.info('Выгрузки на %s в БД больше нет, читаем новую целиком.', previous.sync_date())
+            return None
+        diff = SnapshotDiff.from_rows(self._pool.fetchall(*build_snapshot_diff_query(previous.timestamp, latest)))
+        try:
+            snapshot = previous.apply(diff, latest)
+        except ValueError as e:
+            logging.error('Разница выгрузок не сходится с выгрузкой в памяти, читаем новую целиком: %s', e)
+            return None
+        metrics.registry.observe('snapshot_load_seconds', time.perf_counter() - started, kind='diff')
+        logging.info(
+            'Загружена выгрузка сотрудников на %s как разница с предыдущей: '
+            '+%d/-%d строк, сотрудников затронуто %d, '
+            'всего %d записей за %.2f с.',
+            snapshot.sync_date(), len(diff.added), len(diff.removed), len(diff.by_name()),
+            len(snapshot), time.perf_counter() - started,
+        )
+        return snapshot
 
-def get_last_sync_date():
+    def load_persisted(self):
+        """Читает сохраненную на диске выгрузку; БД будет проверена при первом обращении"""
+        if self.store is None or self._snapshot is not None:
+            return self._snapshot
+        try:
+            snapshot = self.store.load()
+        except Exception as e:
+            logging.error('Не удалось прочитать сохраненную выгрузку %s: %s', self.store.path, e)
+            return None
+        if snapshot is not None:
+            self._snapshot = snapshot
+            self._checked_at = float('-inf')
+        return snapshot
+
+    def get_loaded(self):
+        """Текущая выгрузка в памяти без обращения к БД (None, если ее еще нет)"""
+        return self._snapshot
+
+    def invalidate(self):
+        """Заставляет следующий get() сразу проверить БД"""
+        with self._lock:
+            self._checked_at = float('-inf')
+
+
+# Создаются в init()
+db_pool = None
+snapshot_cache = None
+bot = None
+outbox = None
+group_registry = None
+sync_watcher = None
+command_flights = None
+command_debouncer = None
+metrics_server = None
+render_pool = None
+
+
+def resolve_group(group=None):
+    """Группа запроса: по умолчанию — группа команды /next5"""
+    return group or group_registry.default
+
+
+def get_roster_view(group=None, snapshot=None):
+    """Представление выгрузки (по умолчанию последней) для группы"""
+    if snapshot is None:
+        snapshot = snapshot_cache.get()
+    return resolve_group(group).view(snapshot)
+
+
+def send_startup_greeting():
+    """Приветственное сообщение админу при запуске"""
     try:
-        conn = psycopg2.connect(**db_creds)
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT "current_timestamp" 
-            FROM nsi_data.dict_portal_ac_employees_tb_form 
-            ORDER BY "current_timestamp" DESC 
-            LIMIT 1
-        """)
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        
-        if result:
-            return result[0].strftime('%d.%m.%Y %H:%M')
-        return "Неизвестно"
+        outbox.send_message(ADMIN_CHAT_ID, 'Бот напоминалка успешно запущен!').result()
+        logging.info('Приветственное сообщение админу отправлено.')
     except Exception as e:
-        logging.error(f'Ошибка при получении даты последней синхронизации: {e}')
-        return "Неизвестно"
+        logging.error('Ошибка при отправке приветственного сообщения админу: %s', e)
 
-def get_next_5_birthdays(all_employees=False):
-    try:
-        logging.info('Подключение к базе данных для получения следующих 5 дней рождений...')
-        conn = psycopg2.connect(**db_creds)
-        cur = conn.cursor()
-        if all_employees:
-            # Получаем всех сотрудников, независимо от подразделения
-            cur.execute("""
-                --Следующие 5 дней рождений всех сотрудников
-                SELECT DISTINCT ON (fullname) 
-                substring(fullname from '^[^ ]+ [^ ]+') as fullname, birthday
-                FROM nsi_data.dict_portal_ac_employees_tb_form
-                where status is true and "current_timestamp" = (select "current_timestamp" cs from nsi_data.dict_portal_ac_employees_tb_form order by cs desc limit 1)
-                ORDER BY fullname
-            """)
-        else:
-            cur.execute("""
-                --Следующие 5 дней рождений сотрудников
-                SELECT DISTINCT ON (fullname) substring(fullname from '^[^ ]+ [^ ]+') as fullname, birthday
-                FROM nsi_data.dict_portal_ac_employees_tb_form
-                where status is true and "current_timestamp" = (select "current_timestamp" cs from nsi_data.dict_portal_ac_employees_tb_form order by cs desc limit 1)
-                and department ilike any(array['%перационная%','%роект%','%мультимед%','%руковод%'])
-                and birthday is not null
-                ORDER BY fullname
-            """)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        if not rows:
-            logging.info('Нет данных о днях рождения.')
-            return []
-
-        today = datetime.now().date()
-        birthday_data = []
 
-        for fullname, birthday in rows:
-            try:
-                day, month = map(int, birthday.split('.'))
-                # Рассчитываем дату в текущем году
-                bday_this_year = datetime(today.year, month, day).date()
-                # Если день рождения уже прошел, берем следующий год
-                if bday_this_year < today:
-                    bday_next_year = datetime(today.year + 1, month, day).date()
-                    days_until = (bday_next_year - today).days
-                else:
-                    days_until = (bday_this_year - today).days
+def get_last_sync_date():
+    try:
+        if ROSTER_QUERY_MODE != 'snapshot':
+            # Метку уже знает наблюдатель за выгрузками — не спрашиваем БД на каждую команду
+            latest = sync_watcher.timestamp if sync_watcher.timestamp is not None else get_latest_sync_timestamp()
+            return latest.strftime('%d.%m.%Y %H:%M') if latest else "Неизвестно"
+        return snapshot_cache.get().sync_date()
+    except Exception as e:
+        logging.error('Ошибка при получении даты последней синхронизации: %s', e)
+        return "Неизвестно"
 
-                birthday_data.append((fullname, birthday, days_until))
-            except Exception as e:
-                log_info(f"Ошибка преобразования даты для {fullname}: {birthday} ({e})")
-                continue
+def get_latest_sync_timestamp():
+    """"current_timestamp" последней выгрузки в БД"""
+    return db_pool.fetchone(LATEST_TIMESTAMP_SQL)[0]
 
-        # Сортируем по количеству дней до дня рождения
-        birthday_data.sort(key=lambda x: x[2])
+def stream_rows(query):
+    """Строки запроса (sql, params) серверным курсором, пачками по DB_ITERSIZE"""
+    return db_pool.iterate(*query, itersize=DB_ITERSIZE)
 
-        # Берем первые 5 уникальных дат
-        result = []
-        unique_days = set()
+def get_birthday_index(group=None):
+    """Индекс дней рождения по последней выгрузке (пустой при ошибке)"""
+    try:
+        if ROSTER_QUERY_MODE == 'server':
+            return BirthdayIndex(db_pool.fetchall(*build_birthdays_query(resolve_group(group).departments)))
+        if ROSTER_QUERY_MODE == 'stream':
+            return BirthdayIndex(stream_rows(build_birthdays_query(resolve_group(group).departments)))
+        return get_roster_view(group).birthday_index
+    except Exception as e:
+        logging.error('Ошибка при получении индекса дней рождения: %s', e)
+        return BirthdayIndex([])
+
+def next_birthdays_from_index(index, today, count=5):
+    """Строки (ФИО, 'DD.MM', дней до) для первых count уникальных дат"""
+    return [
+        (fullname, birthday, days_until)
+        for _, days_until, people in index.next_dates(today, count)
+        for fullname, birthday in people
+    ]
 
-        for fullname, birthday, days_until in birthday_data:
-            if len(unique_days) < 5 or days_until in unique_days:
-                result.append((fullname, birthday, days_until))
-                unique_days.add(days_until)
-            elif len(unique_days) >= 5:
-                break
+def get_next_5_birthdays(group=None):
+    try:
+        if ROSTER_QUERY_MODE == 'server':
+            today = datetime.now().date()
+            result = db_pool.fetchall(*build_next_birthdays_query(resolve_group(group).departments, today, 5))
+            logging.info('Получено %d записей следующих дней рождений.', len(result))
+            return result
+        if ROSTER_QUERY_MODE == 'stream':
+            # Разбор -> ближайшие 5 дат в ограниченной куче: память не зависит от размера выгрузки
+            rows = stream_rows(build_birthdays_query(resolve_group(group).departments))
+            result = next_birthdays(rows, datetime.now().date(), 5)
+            logging.info('Получено %d записей следующих дней рождений.', len(result))
+            return result
+
+        index = get_birthday_index(group)
+        if not len(index):
+            logging.info('Нет данных о днях рождения.')
+            return []
 
-        logging.info(f'Получено {len(result)} записей следующих дней рождений.')
+        result = next_birthdays_from_index(index, datetime.now().date())
+        logging.info('Получено %d записей следующих дней рождений.', len(result))
         return result
 
     except Exception as e:
-        logging.error(f'Ошибка при получении следующих дней рождений: {e}')
+        logging.error('Ошибка при получении следующих дней рождений: %s', e)
         return []
 
-def get_vacations(all_employees=False):
-    """Получение данных об отпусках сотрудников из базы данных"""
+def get_vacations(group=None):
+    """Получение данных об отпусках сотрудников из выгрузки"""
     try:
-        logging.info('Подключение к базе данных для получения данных об отпусках...')
-        conn = psycopg2.connect(**db_creds)
-        cur = conn.cursor()
-        
-        if all_employees:
-            # Получаем отпуска всех сотрудников
-            cur.execute("""
-                SELECT DISTINCT ON (fullname,vac_date_start) substring(fullname from '^[^ ]+ [^ ]+') as fullname, vac_date_start, vac_date_end
-                FROM nsi_data.dict_portal_ac_employees_tb_form
-                WHERE status is true 
-                AND "current_timestamp" = (SELECT "current_timestamp" cs FROM nsi_data.dict_portal_ac_employees_tb_form ORDER BY cs DESC LIMIT 1)
-                AND vac_date_start IS NOT NULL
-                AND vac_date_end IS NOT NULL
-                ORDER BY fullname
-            """)
+        if ROSTER_QUERY_MODE == 'server':
+            rows = db_pool.fetchall(*build_vacations_query(resolve_group(group).departments))
+        elif ROSTER_QUERY_MODE == 'stream':
+            rows = list(stream_rows(build_vacations_query(resolve_group(group).departments)))
         else:
-            # Получаем отпуска сотрудников определенных подразделений
-            cur.execute("""
-                SELECT DISTINCT ON (fullname,vac_date_start) substring(fullname from '^[^ ]+ [^ ]+') as fullname, vac_date_start, vac_date_end
-                FROM nsi_data.dict_portal_ac_employees_tb_form
-                WHERE status is true 
-                AND "current_timestamp" = (SELECT "current_timestamp" cs FROM nsi_data.dict_portal_ac_employees_tb_form ORDER BY cs DESC LIMIT 1)
-                AND department ILIKE ANY(ARRAY['%перационная%','%роект%','%мультимед%','%руковод%'])
-                AND vac_date_start IS NOT NULL
-                AND vac_date_end IS NOT NULL
-                ORDER BY fullname
-            """)
-        
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        logging.info(f'Получено {len(rows)} записей об отпусках.')
+            rows = get_roster_view(group).vacations
+        logging.info('Получено %d записей об отпусках.', len(rows))
         return rows
     except Exception as e:
-        logging.error(f'Ошибка при получении данных об отпусках: {e}')
+        logging.error('Ошибка при получении данных об отпусках: %s', e)
         return []
 
-def get_current_and_upcoming_vacations(all_employees=False):
+def get_vacation_index(group=None):
+    """Индекс отпусков по последней выгрузке (пустой при ошибке).
+
+    В режимах 'server' и 'stream' индекс строится только по отпускам, пересекающимся
+    с ближайшими VACATION_HORIZON_DAYS днями (окно отбирает SQL или поток строк).
+    """
+    try:
+        if ROSTER_QUERY_MODE == 'server':
+            today = datetime.now().date()
+            last = today + timedelta(days=VACATION_HORIZON_DAYS)
+            return VacationIndex(db_pool.fetchall(
+                *build_vacation_window_query(resolve_group(group).departments, today, last)
+            ))
+        if ROSTER_QUERY_MODE == 'stream':
+            today = datetime.now().date()
+            last = today + timedelta(days=VACATION_HORIZON_DAYS)
+            rows = stream_rows(build_vacations_query(resolve_group(group).departments))
+            return VacationIndex(vacations_overlapping(rows, today, last))
+        return get_roster_view(group).vacation_index
+    except Exception as e:
+        logging.error('Ошибка при получении индекса отпусков: %s', e)
+        return VacationIndex([])
+
+def get_current_and_upcoming_vacations(group=None):
     """Получение текущих и предстоящих отпусков"""
     try:
-        vacations = get_vacations(all_employees=all_employees)
-        if not vacations:
-            return []
-        
         today = datetime.now().date()
-        vacation_data = []
-        
-        for fullname, vacation_start, vacation_end in vacations:
-            try:
-                # Преобразуем строки дат в объекты date
-                if isinstance(vacation_start, str):
-                    start_date = datetime.strptime(vacation_start, '%d.%m.%Y').date()
-                else:
-                    start_date = vacation_start
-                    
-                if isinstance(vacation_end, str):
-                    end_date = datetime.strptime(vacation_end, '%d.%m.%Y').date()
-                else:
-                    end_date = vacation_end
-                
-                # Проверяем, актуален ли отпуск (текущий или предстоящий в течение 30 дней)
-                days_until_start = (start_date - today).days
-                days_until_end = (end_date - today).days
-                
-                if days_until_end >= 0 and days_until_start <= 30:  # Отпуск актуален
-                    vacation_data.append((fullname, start_date, end_date, days_until_start))
-                    
-            except Exception as e:
-                log_info(f"Ошибка преобразования дат отпуска для {fullname}: {e}")
-                continue
-        
-        # Сортируем по дате начала отпуска
-        vacation_data.sort(key=lambda x: x[1])
-        
-        logging.info(f'Получено {len(vacation_data)} актуальных отпусков.')
+        # Актуальны текущие отпуска и начинающиеся в течение 30 дней
+        last = today + timedelta(days=VACATION_HORIZON_DAYS)
+        vacation_data = [
+            (fullname, start_date, end_date, (start_date - today).days)
+            for fullname, start_date, end_date in get_vacation_index(group).overlapping(today, last)
+        ]
+        logging.info('Получено %d актуальных отпусков.', len(vacation_data))
         return vacation_data
         
     except Exception as e:
-        logging.error(f'Ошибка при обработке данных об отпусках: {e}')
+        logging.error('Ошибка при обработке данных об отпусках: %s', e)
         return []
 
-def send_vacation_notifications(chat_id, all_employees=False):
-    """Отправка уведомлений об отпусках в чат"""
-    try:
-        vacations = get_current_and_upcoming_vacations(all_employees=all_employees)
-        if not vacations:
-            bot.send_message(chat_id, "Нет данных о текущих и предстоящих отпусках.")
-            return
-
-        if not all_employees:
-            message = f"{progroup_html_icon} <b>ОТПУСКА PRO</b>ГРУППЫ:\n\n"
-        else:
-            message = f"{bunker_html_icon} ОТПУСКА БУНКЕРА:\n\n"
-
-        # Группируем отпуска по категориям
-        current_vacations = []
-        starting_soon = []
-        upcoming_vacations = []
-
-        today = datetime.now().date()
+def format_initials(fullname):
+    """'Фамилия Имя Отчество' -> 'Фамилия И.О.'; ФИО короче трех слов — как есть"""
+    name_parts = fullname.split()
+    if len(name_parts) < 3:
+        return fullname
+    return f"{name_parts[0]} {name_parts[1][0]}.{name_parts[2][0]}."
+
+def format_day_month(day):
+    """date -> 'DD.MM' (то же, что strftime('%d.%m'), но без разбора формата)"""
+    return f"{day.day:02d}.{day.month:02d}"
+
+def format_date_span(start_date, end_date, separator='-'):
+    return f"{format_day_month(start_date)}{separator}{format_day_month(end_date)}"
+
+def format_vacation_message(index, today, last_sync, group=None):
+    """Текст уведомления об отпусках по индексу отпусков; None, если показывать нечего"""
+    # Группируем отпуска по категориям прямо запросами к индексу
+    current_vacations = [
+        (fullname, start_date, end_date, (end_date - today).days + 1)
+        for fullname, start_date, end_date in index.out_on(today)
+    ]
+    # Начинается в ближайшие 3 дня
+    starting_soon = [
+        (fullname, start_date, end_date, (start_date - today).days)
+        for fullname, start_date, end_date in
+        index.starting_between(today + timedelta(days=1), today + timedelta(days=3))
+    ]
+    # Предстоящие отпуска в течение 30 дней
+    upcoming_vacations = [
+        (fullname, start_date, end_date, (start_date - today).days)
+        for fullname, start_date, end_date in
+        index.starting_between(today + timedelta(days=4), today + timedelta(days=VACATION_HORIZON_DAYS))
+    ]
 
-        for fullname, start_date, end_date, days_until_start in vacations:
-            if days_until_start <= 0 and (end_date - today).days >= 0:
-                # Текущий отпуск
-                days_left = (end_date - today).days + 1
-                current_vacations.append((fullname, start_date, end_date, days_left))
-            elif days_until_start <= 3:
-                # Начинается в ближайшие 3 дня
-                starting_soon.append((fullname, start_date, end_date, days_until_start))
+    if not (current_vacations or starting_soon or upcoming_vacations):
+        return None
+
+    parts = [f"{resolve_group(group).vacations_header}\n\n"]
+    if current_vacations:
+        parts.append("🏖️ <b>В отпуске сейчас:</b>\n")
+        # Сортируем по остатку дней от меньшего к большему
+        current_vacations.sort(key=lambda x: x[3])  # x[3] - это days_left
+        for fullname, start_date, end_date, days_left in current_vacations:
+            left = f"{days_left} дн." if days_left > 0 else "последний день"
+            parts.append(f"  {format_date_span(start_date, end_date)}, ост: {left}, {format_initials(fullname)}\n")
+        parts.append("\n")
+
+    if starting_soon:
+        parts.append("🎒 <b>Уходят в отпуск скоро:</b>\n")
+        for fullname, start_date, end_date, days_until_start in starting_soon:
+            if days_until_start == 0:
+                when = "начинается сегодня"
+            elif days_until_start == 1:
+                when = "начинается завтра"
             else:
-                # Предстоящие отпуска
-                upcoming_vacations.append((fullname, start_date, end_date, days_until_start))
-
-        # Формируем сообщение
-        if current_vacations:
-            message += "🏖️ <b>В отпуске сейчас:</b>\n"
-            # Сортируем по остатку дней от меньшего к большему
-            current_vacations.sort(key=lambda x: x[3])  # x[3] - это days_left
-            for fullname, start_date, end_date, days_left in current_vacations:
-                # Извлекаем фамилию и инициалы
-                name_parts = fullname.split()
-                if len(name_parts) >= 3:
-                    surname = name_parts[0]
-                    first_initial = name_parts[1][0] if name_parts[1] else ""
-                    second_initial = name_parts[2][0] if name_parts[2] else ""
-                    formatted_name = f"{surname} {first_initial}.{second_initial}."
-                else:
-                    formatted_name = fullname
-                
-                if days_left > 0:
-                    message += f"  {start_date.strftime('%d.%m')}-{end_date.strftime('%d.%m')}, ост: {days_left} дн., {formatted_name}\n"
-                else:
-                    message += f"  {start_date.strftime('%d.%m')}-{end_date.strftime('%d.%m')}, ост: последний день, {formatted_name}\n"
-            message += "\n"
-
-        if starting_soon:
-            message += "🎒 <b>Уходят в отпуск скоро:</b>\n"
-            for fullname, start_date, end_date, days_until_start in starting_soon:
-                message += f"  {fullname}\n"
-                message += f"     📅 {start_date.strftime('%d.%m')} - {end_date.strftime('%d.%m')}\n"
-                if days_until_start == 0:
-                    message += f"     🚀 начинается сегодня\n"
-                elif days_until_start == 1:
-                    message += f"     🚀 начинается завтра\n"
-                else:
-                    message += f"     🚀 через {days_until_start} дн.\n"
-            message += "\n"
-
-        if upcoming_vacations[:5]:  # Показываем только первые 5
-            message += "📋 <b>Планируемые отпуска:</b>\n"
-            for fullname, start_date, end_date, days_until_start in upcoming_vacations[:5]:
-                # Извлекаем фамилию и инициалы
-                name_parts = fullname.split()
-                if len(name_parts) >= 3:
-                    surname = name_parts[0]
-                    first_initial = name_parts[1][0] if name_parts[1] else ""
-                    second_initial = name_parts[2][0] if name_parts[2] else ""
-                    formatted_name = f"{surname} {first_initial}.{second_initial}."
-                else:
-                    formatted_name = fullname
-        
-                message += f"  {start_date.strftime('%d.%m')}-{end_date.strftime('%d.%m')}, через: {days_until_start} дн., {formatted_name}\n"
-            if len(upcoming_vacations) > 5:
-                message += f"     ... и еще {len(upcoming_vacations) - 5} отпусков\n"
-            message += "\n"
-
-        last_sync = get_last_sync_date()
-        message += f"📊 Данные актуальны на: {last_sync}"
-
-        bot.send_message(chat_id, message, parse_mode='html')
-        logging.info(f'Уведомления об отпусках отправлены в чат {chat_id}.')
-
-    except Exception as e:
-        logging.error(f'Ошибка при отправке уведомлений об отпусках: {e}')
-        bot.send_message(chat_id, "Произошла ошибка при получении данных об отпусках.")
-
-def send_next_5_birthdays(chat_id, all_employees=False):
+                when = f"через {days_until_start} дн."
+            parts.append(f"  {fullname}\n     📅 {format_date_span(start_date, end_date, ' - ')}\n     🚀 {when}\n")
+        parts.append("\n")
+
+    if upcoming_vacations:
+        parts.append("📋 <b>Планируемые отпуска:</b>\n")
+        for fullname, start_date, end_date, days_until_start in upcoming_vacations[:5]:  # Показываем только первые 5
+            parts.append(
+                f"  {format_date_span(start_date, end_date)}, через: {days_until_start} дн., {format_initials(fullname)}\n"
+            )
+        if len(upcoming_vacations) > 5:
+            parts.append(f"     ... и еще {len(upcoming_vacations) - 5} отпусков\n")
+        parts.append("\n")
+
+    parts.append(f"📊 Данные актуальны на: {last_sync}")
+    return ''.join(parts)
+
+def _format_vacation_date(value):
     try:
-        birthdays = get_next_5_birthdays(all_employees=all_employees)
-        if not birthdays:
-            bot.send_message(chat_id, "Нет данных о ближайших днях рождения.")
-            return
-
-        if not all_employees:
-            message = f"{progroup_html_icon} <b>PRO</b>ГРУППА:\n\n"
+        return parse_vacation_date(value).strftime('%d.%m.%Y')
+    except (ValueError, TypeError, AttributeError):
+        return str(value)
+
+def format_vacation_changes_message(changes, last_sync, group=None):
+    """Текст уведомления админу об изменениях плана отпусков: changes — из SnapshotDiff.vacation_changes"""
+    parts = [f"✏️ <b>Изменения в плане отпусков ({resolve_group(group).title}):</b>\n\n"]
+    for fullname, sign, start, end in changes[:VACATION_CHANGES_LIMIT]:
+        mark = '➕' if sign == '+' else '➖'
+        parts.append(f"{mark} {fullname}: {_format_vacation_date(start)} - {_format_vacation_date(end)}\n")
+    if len(changes) > VACATION_CHANGES_LIMIT:
+        parts.append(f"     ... и еще {len(changes) - VACATION_CHANGES_LIMIT} изменений\n")
+    parts.append(f"\n📊 Данные актуальны на: {last_sync}")
+    return ''.join(parts)
+
+def notify_vacation_changes(snapshot):
+    """Уведомление админу, если новая выгрузка поменяла чьи-то отпуска"""
+    group = group_registry.everyone
+    changes = snapshot.diff.vacation_changes(group.matcher)
+    if not changes:
+        return
+    outbox.send_message(ADMIN_CHAT_ID, format_vacation_changes_message(changes, snapshot.sync_date(), group),
+                        parse_mode='html')
+    logging.info('Админу отправлено уведомление об изменениях в отпусках: %d.', len(changes))
+
+def current_vacations_reply(group=None):
+    """Ответ (текст, parse_mode) на /vacations по последней выгрузке"""
+    today = datetime.now().date()
+    if ROSTER_QUERY_MODE == 'snapshot':
+        return get_reply('vacations', snapshot_cache.get(), today, group)
+    message = format_vacation_message(get_vacation_index(group), today, get_last_sync_date(), group)
+    if message is None:
+        return "Нет данных о текущих и предстоящих отпусках.", None
+    return message, 'html'
+
+@metrics.registry.timed('command_seconds', command='vacations')
+def send_vacation_notifications(chat_id, group=None, coalesce=True):
+    """Отправка уведомлений об отпусках в чат; coalesce=False — отдельным сообщением (см. Outbox)"""
+    try:
+        # Одновременные одинаковые запросы ждут одного вычисления
+        key = ('vacations', resolve_group(group).name, datetime.now().date())
+        message, parse_mode = command_flights.do(key, functools.partial(current_vacations_reply, group))
+    except Exception as e:
+        # Сообщение об ошибке — только если не удалось собрать данные; сбои отправки повторяет outbox
+        logging.error('Ошибка при получении данных об отпусках: %s', e)
+        outbox.send_message(chat_id, "Произошла ошибка при получении данных об отпусках.", coalesce=coalesce)
+        return
+
+    outbox.send_message(chat_id, message, parse_mode=parse_mode, coalesce=coalesce)
+    logging.info('Уведомления об отпусках поставлены в очередь для чата %s.', chat_id)
+
+def format_next_5_birthdays_message(birthdays, last_sync, group=None):
+    """Текст со списком ближайших дней рождения: birthdays — строки (ФИО, 'DD.MM', дней до)"""
+    today_lines, tomorrow_lines, later_lines = [], [], []
+    for fullname, birthday, days_until in birthdays:
+        if days_until == 0:
+            today_lines.append(f" {fullname} ({birthday})\n")
+        elif days_until == 1:
+            tomorrow_lines.append(f" {fullname} ({birthday})\n")
         else:
-            message = f"{bunker_html_icon} БУНКЕР:\n\n"
-        current_days = None
-
-        # Группируем дни рождения по категориям
-        today_birthdays = []
-        tomorrow_birthdays = []
-        later_birthdays = []
-        
-        for fullname, birthday, days_until in birthdays:
-            if days_until == 0:
-                today_birthdays.append((fullname, birthday))
-            elif days_until == 1:
-                tomorrow_birthdays.append((fullname, birthday))
-            else:
-                later_birthdays.append((fullname, birthday, days_until))
-        
-        # Формируем сообщение по блокам
-        if today_birthdays:
-
-            message += "🎉 Сегодня:\n"
-            for fullname, birthday in today_birthdays:
-                message += f" {fullname} ({birthday})\n"
-            message += "\n"
-        
-        if tomorrow_birthdays:
-            message += "🎈 Завтра:\n"
-            for fullname, birthday in tomorrow_birthdays:
-                message += f" {fullname} ({birthday})\n"
-            message += "\n"
-        
-        if later_birthdays:
-            message += "📅 Уже скоро:\n"
-            for fullname, birthday, days_until in later_birthdays:
-                message += f"  {fullname} ({birthday})  через {days_until} дней\n"
-            message += "\n"
-
-        last_sync = get_last_sync_date()
-        message += f"📊 Данные актуальны на: {last_sync}"
-        bot.send_message(chat_id, message, parse_mode='html')
-        logging.info(f'Список следующих 5 дней рождений отправлен в чат {chat_id}.')
+            later_lines.append(f"  {fullname} ({birthday})  через {days_until} дней\n")
+
+    parts = [f"{resolve_group(group).header}\n\n"]
+    for title, lines in (("🎉 Сегодня:\n", today_lines), ("🎈 Завтра:\n", tomorrow_lines),
+                         ("📅 Уже скоро:\n", later_lines)):
+        if lines:
+            parts.append(title)
+            parts.extend(lines)
+            parts.append("\n")
+    parts.append(f"📊 Данные актуальны на: {last_sync}")
+    return ''.join(parts)
+
+def current_next_5_birthdays_reply(group=None):
+    """Ответ (текст, parse_mode) на /next5 по последней выгрузке"""
+    if ROSTER_QUERY_MODE == 'snapshot':
+        return get_reply('next5', snapshot_cache.get(), datetime.now().date(), group)
+    birthdays = get_next_5_birthdays(group=group)
+    if not birthdays:
+        return "Нет данных о ближайших днях рождения.", None
+    return format_next_5_birthdays_message(birthdays, get_last_sync_date(), group), 'html'
+
+@metrics.registry.timed('command_seconds', command='next5')
+def send_next_5_birthdays(chat_id, group=None, coalesce=True):
+    try:
+        key = ('next5', resolve_group(group).name, datetime.now().date())
+        message, parse_mode = command_flights.do(key, functools.partial(current_next_5_birthdays_reply, group))
+    except Exception:
+        logging.exception('Ошибка при получении списка следующих дней рождений')
+        outbox.send_message(chat_id, "Произошла ошибка при получении данных о днях рождения.", coalesce=coalesce)
+        return
 
-    except Exception as e:
-        logging.error(f'Ошибка при отправке списка следующих дней рождений: {e}')
-        print(e)
-        bot.send_message(chat_id, "Произошла ошибка при получении данных о днях рождения.")
+    outbox.send_message(chat_id, message, parse_mode=parse_mode, coalesce=coalesce)
+    logging.info('Список следующих 5 дней рождений поставлен в очередь для чата %s.', chat_id)
 
 
-def get_birthdays(all_employees=False):
+def get_birthdays(group=None):
     try:
-        logging.info('Подключение к базе данных...')
-        conn = psycopg2.connect(
-            **db_creds
-            # host=DB_HOST,
-            # port=DB_PORT,
-            # dbname=DB_NAME,
-            # user=DB_USER,
-            # password=DB_PASSWORD,
-            # connect_timeout=CONNECT_TIMEOUT
-        )
-        cur = conn.cursor()
-        if all_employees:
-            # Получаем всех сотрудников, независимо от статуса
-            cur.execute("""
-                --Дни рождения всех сотрудников
-                SELECT DISTINCT ON (fullname) substring(fullname from '^[^ ]+ [^ ]+') as fullname, birthday
-                FROM nsi_data.dict_portal_ac_employees_tb_form
-                where status is true and "current_timestamp" = (select "current_timestamp" cs from nsi_data.dict_portal_ac_employees_tb_form order by cs desc limit 1)
-                ORDER BY fullname
-            """)
+        if ROSTER_QUERY_MODE == 'server':
+            rows = db_pool.fetchall(*build_birthdays_query(resolve_group(group).departments))
+        elif ROSTER_QUERY_MODE == 'stream':
+            rows = list(stream_rows(build_birthdays_query(resolve_group(group).departments)))
         else:
-            cur.execute("""
-                --Дни рождения сотрудников
-                SELECT DISTINCT ON (fullname) substring(fullname from '^[^ ]+ [^ ]+') as fullname, birthday
-                FROM nsi_data.dict_portal_ac_employees_tb_form
-                where status is true and "current_timestamp" = (select "current_timestamp" cs from nsi_data.dict_portal_ac_employees_tb_form order by cs desc limit 1)
-                and department ilike any(array['%перационная%','%роект%','%мультимед%','%руковод%'])
-                ORDER BY fullname
-            """)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        logging.info(f'Получено {len(rows)} записей из базы.')
+            rows = get_roster_view(group).birthdays
+        logging.info('Получено %d записей из выгрузки.', len(rows))
         return rows
     except Exception as e:
-        logging.error(f'Ошибка при работе с базой данных: {e}')
+        logging.error('Ошибка при работе с базой данных: %s', e)
         return []
 
 def wrap_text(text, width=20):
     # Перенос строки каждые width символов
     return '\n'.join([text[i:i+width] for i in range(0, len(text), width)])
 
-def format_birthday_dataframe():
+def get_birthdays_by_bucket(today, group=None):
+    """Строки таблицы /birthdays в режиме 'stream': (категория, ФИО, 'DD.MM') без сборки индекса"""
+    try:
+        return birthdays_by_bucket(stream_rows(build_birthdays_query(resolve_group(group).departments)), today)
+    except Exception as e:
+        logging.error('Ошибка при получении дней рождения по категориям: %s', e)
+        return []
+
+def format_birthday_dataframe(index=None):
     today = datetime.now().date()
-    tomorrow = today + timedelta(days=1)
-    # Границы следующей недели
-    # Пример работы этих строк:
-    # today = datetime(2024, 6, 7).date()  # допустим, сегодня пятница (weekday() == 4)
-    # days_until_next_monday = (7 - today.weekday()) % 7 or 7
-    # days_until_next_monday = (7 - 4) % 7 or 7 = 3
-    # next_monday = today + timedelta(days=3)  # будет понедельник, 10 июня 2024
-    # next_sunday = next_monday + timedelta(days=6)  # будет воскресенье, 16 июня 2024
-
-    days_until_next_monday = (7 - today.weekday()) % 7 or 7
-    next_monday = today + timedelta(days=days_until_next_monday)
-    next_sunday = next_monday + timedelta(days=6)
-    next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
-
-    birthdays = get_birthdays()
+    # Категории: сегодня, завтра, следующая неделя (пн-вс) и следующий календарный месяц
+    if index is None and ROSTER_QUERY_MODE == 'stream':
+        found = get_birthdays_by_bucket(today)
+    else:
+        if index is None:
+            index = get_birthday_index()
+        found = [
+            (sort, fullname, birthday)
+            for sort, (start, end) in enumerate(birthday_bucket_bounds(today))
+            for _, fullname, birthday in index.between(start, end)
+        ]
     data = []
-
-
-    # logging.info(f"Сегодня: {today}")
-    # logging.info(f"Завтра: {tomorrow}")
-    # logging.info(f"След. неделя: {next_sunday}")
-    # logging.info(f"След. месяц: {next_month}")
-
-    for fullname, birthday in birthdays:
-        # logging.info(f"Обработка: {fullname} {birthday}")
-        if not birthday:
-            continue
-        # birthday: строка 'DD.MM'
-        try:
-            day, month = map(int, birthday.split('.'))
-            bday = datetime(today.year, month, day).date()
-        except Exception as e:
-            log_info(f"Ошибка преобразования даты для {fullname}: {birthday} ({e})")
+    seen = set()
+    for sort, fullname, birthday in found:
+        # Каждый сотрудник попадает только в самую раннюю категорию
+        if fullname in seen:
             continue
-
-        # logging.info(f"Дата рождения: {bday}")   
-        wrapped_fullname = wrap_text(fullname, width=50)
-        if bday == today:
-            # logging.info(f"Сегодня: {fullname} {birthday}")
-            data.append([0, "Сегодня", wrapped_fullname, f"{birthday}"])
-        elif bday == tomorrow:
-            # logging.info(f"Завтра: {fullname} {birthday}")
-            data.append([1, "Завтра", wrapped_fullname, f"{birthday}"])
-        elif next_monday <= bday <= next_sunday:
-            data.append([2, "На след. неделе", wrapped_fullname, f"{birthday}"])
-        elif bday.month == next_month.month:
-            # logging.info(f"В след. месяце: {fullname} {birthday}")
-            data.append([3, "В след. месяце", wrapped_fullname, f"{birthday}"])
+        seen.add(fullname)
+        data.append([sort, BIRTHDAY_BUCKETS[sort], wrap_text(fullname, width=50), f"{birthday}"])
 
     if not data:
         data.append([4, "-", "Нет ближайших дней рождений", "-"])
 
+    import pandas as pd
+
     df = pd.DataFrame(data, columns=["sort", "Категория", "ФИО", "Дата рождения"])
-    df = df.sort_values(by="sort").drop(columns=["sort"])
-    logging.info(f"Данные для отправки: {df}")
+    df = df.sort_values(by="sort", kind="stable").drop(columns=["sort"])
+    # Таблица целиком — только на уровне DEBUG; на INFO она даже не превращается в строку
+    logging.debug('Данные для отправки:\n%s', df)
+    logging.info('Таблица дней рождения: %d строк.', len(df))
     return df
 
-def send_birthday_reminder(chat_id=CHAT_ID):
+def render_birthday_table(columns, rows):
+    """PNG таблицы: в пуле процессов отрисовки, если он запущен, иначе в процессе бота"""
+    if render_pool is not None:
+        return render_pool.render(columns, rows)
+    return RENDERERS[BIRTHDAY_TABLE_RENDERER](columns, rows)
+
+# Готовые картинки /birthdays: ключ (метка выгрузки, день, группа) -> PNG и file_id после первой отправки
+BIRTHDAY_IMAGE_CACHE_SIZE = 8
+birthday_image_cache = OrderedDict()
+birthday_image_cache_lock = threading.Lock()
+
+def birthday_image_key(timestamp, today=None):
+    """Ключ кэша картинок: "current_timestamp" выгрузки (а не строка для показа), день и группа"""
+    return timestamp, today or datetime.now().date(), group_registry.default.name
+
+def get_birthday_table_image(key, index=None):
+    """Запись кэша {'png': bytes, 'file_id': str | None} для ключа; при промахе таблица рисуется заново"""
+    with birthday_image_cache_lock:
+        entry = birthday_image_cache.get(key)
+        if entry is not None:
+            birthday_image_cache.move_to_end(key)
+            return entry
+
+    started = time.perf_counter()
+    df = format_birthday_dataframe(index)
+    with metrics.registry.timer('render_seconds', renderer=BIRTHDAY_TABLE_RENDERER):
+        png = render_birthday_table(list(df.columns), df.values.tolist())
+    logging.info(
+        'Таблица дней рождения отрисована (%s): '
+        '%.0f КБ за %.2f с.',
+        BIRTHDAY_TABLE_RENDERER, len(png) / 1024, time.perf_counter() - started,
+    )
+    entry = {'png': png, 'file_id': None}
+    with birthday_image_cache_lock:
+        birthday_image_cache[key] = entry
+        while len(birthday_image_cache) > BIRTHDAY_IMAGE_CACHE_SIZE:
+            birthday_image_cache.popitem(last=False)
+    return entry
+
+def send_birthday_photo(chat_id, entry):
+    """Ставит картинку из кэша в очередь: по file_id, если она уже есть на серверах Telegram, иначе файлом"""
+    file_id = entry['file_id']
+
+    def on_sent(future):
+        try:
+            sent = future.result()
+        except telebot.apihelper.ApiTelegramException as e:
+            if file_id:
+                logging.error('Не удалось отправить картинку по file_id, отправляем заново: %s', e)
+                entry['file_id'] = None
+                send_birthday_photo(chat_id, entry)
+            return
+        except Exception:
+            return  # outbox уже записал ошибку в лог
+        if not file_id and sent is not None and sent.photo:
+            entry['file_id'] = sent.photo[-1].file_id
+
+    outbox.send_photo(chat_id, file_id or entry['png']).add_done_callback(on_sent)
+
+def birthday_table_source(snapshot=None):
+    """(ключ кэша, build) картинки /birthdays: build() отдает запись кэша get_birthday_table_image.
+    С snapshot таблица строится по его индексу, иначе — запросом к БД (roster_query_mode server и stream)"""
+    if snapshot is not None:
+        key = birthday_image_key(snapshot.timestamp)
+        return key, functools.partial(get_birthday_table_image, key, get_roster_view(snapshot=snapshot).birthday_index)
+    # Метку выгрузки знает наблюдатель, при ее отсутствии — спрашиваем БД
+    timestamp = sync_watcher.timestamp
+    key = birthday_image_key(timestamp if timestamp is not None else get_latest_sync_timestamp())
+    return key, functools.partial(get_birthday_table_image, key)
+
+@metrics.registry.timed('command_seconds', command='birthdays')
+def send_birthday_reminder(chat_id=None):
+    if chat_id is None:
+        chat_id = CHAT_ID
     try:
-        df = format_birthday_dataframe()
-        # Увеличиваем ширину фигуры, чтобы ФИО не переносилось и не вылетало за пределы ячейки
-        fig_width = 14  # увеличено с 10 до 14
-        fig_height = 0.5 + 0.7 * len(df)
-        fig, ax = plt.subplots(figsize=(fig_width, fig_height))
-        ax.axis('off')
-        tbl = ax.table(cellText=df.values, colLabels=df.columns, loc='center', cellLoc='center')
-        tbl.auto_set_font_size(False)
-        tbl.set_fontsize(16)
-        tbl.scale(2.5, 2)  # увеличиваем ширину ячеек
-        # Дополнительно увеличим ширину столбца "ФИО"
-        for (row, col), cell in tbl.get_celld().items():
-            if col == 1:  # "ФИО" обычно второй столбец (0 - Категория, 1 - ФИО, 2 - Дата рождения)
-                cell.set_width(0.45)
-            else:
-                cell.set_width(0.25)
-            cell.set_height(0.15)
-            cell.set_fontsize(16)
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', dpi=300)
-        buf.seek(0)
-        plt.close(fig)
-        bot.send_photo(chat_id, buf)
-        logging.info(f'Напоминание успешно отправлено в чат {chat_id}.')
+        key, build = birthday_table_source(snapshot_cache.get() if ROSTER_QUERY_MODE == 'snapshot' else None)
+        # Несколько /birthdays одновременно — одна отрисовка на всех
+        entry = command_flights.do(('birthdays', *key), build)
+        send_birthday_photo(chat_id, entry)
+        logging.info('Напоминание поставлено в очередь для чата %s.', chat_id)
     except Exception as e:
-        logging.error(f'Ошибка при отправке напоминания: {e}')
+        logging.error('Ошибка при отправке напоминания: %s', e)
+
+def accept_command(message, command):
+    """False — та же команда из того же чата уже была меньше command_debounce секунд назад"""
+    if command_debouncer.allow((message.chat.id, command)):
+        metrics.registry.inc('commands_total', command=command, result='accepted')
+        return True
+    metrics.registry.inc('commands_total', command=command, result='debounced')
+    logging.info(
+        'Команда /%s из чата %s отброшена: повтор в пределах %g с (всего отброшено %d).',
+        command, message.chat.id, command_debouncer.window, command_debouncer.debounced,
+    )
+    return False
 
-# Обработка команды /birthdays и любого текстового сообщения
 # Обработка команды /birthdays и /next5
-@bot.message_handler(commands=['birthdays'])
 def handle_birthdays_command(message):
-    send_birthday_reminder(chat_id=message.chat.id) 
+    if accept_command(message, 'birthdays'):
+        send_birthday_reminder(chat_id=message.chat.id)
 
 
-@bot.message_handler(commands=['next5'])
 def handle_next5_command(message: Message):
+    if not accept_command(message, 'next5'):
+        return
     if message.from_user.id == ADMIN_CHAT_ID:
         send_next_5_birthdays(chat_id=message.chat.id)
     else:
-        bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+        outbox.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
 
-@bot.message_handler(commands=['next5all'])
 def handle_next5all_command(message: Message):
+    if not accept_command(message, 'next5all'):
+        return
     if message.from_user.id == ADMIN_CHAT_ID:
-        send_next_5_birthdays(chat_id=message.chat.id, all_employees=True)
+        send_next_5_birthdays(chat_id=message.chat.id, group=group_registry.everyone)
     else:
-        bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+        outbox.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
         
-@bot.message_handler(commands=['vacations'])
 def handle_vacations_command(message: Message):
+    if not accept_command(message, 'vacations'):
+        return
     if message.from_user.id == ADMIN_CHAT_ID:
         send_vacation_notifications(chat_id=message.chat.id)
     else:
-        bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+        outbox.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
 
-@bot.message_handler(commands=['vacationsall'])
 def handle_vacationsall_command(message: Message):
+    if not accept_command(message, 'vacationsall'):
+        return
     if message.from_user.id == ADMIN_CHAT_ID:
-        send_vacation_notifications(chat_id=message.chat.id, all_employees=True)
+        send_vacation_notifications(chat_id=message.chat.id, group=group_registry.everyone)
     else:
-        bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+        outbox.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+
+def format_stats_message():
+    """Текст /stats: времена и счетчики из metrics.registry и статистика компонентов"""
+    text = metrics.registry.summary()
+    if len(text) > MESSAGE_LIMIT:
+        text = text[:MESSAGE_LIMIT - 1] + '…'
+    return text
+
+def handle_stats_command(message: Message):
+    if not accept_command(message, 'stats'):
+        return
+    if message.from_user.id == ADMIN_CHAT_ID:
+        outbox.send_message(message.chat.id, format_stats_message(), coalesce=False)
+    else:
+        outbox.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+
+def build_next_5_birthdays_reply(snapshot, today, group=None):
+    """Ответ (текст, parse_mode) на /next5 или /next5all по выгрузке snapshot"""
+    index = get_roster_view(group, snapshot=snapshot).birthday_index
+    birthdays = next_birthdays_from_index(index, today)
+    if not birthdays:
+        return "Нет данных о ближайших днях рождения.", None
+    return format_next_5_birthdays_message(birthdays, snapshot.sync_date(), group), 'html'
+
+def build_vacations_reply(snapshot, today, group=None):
+    """Ответ (текст, parse_mode) на /vacations или /vacationsall по выгрузке snapshot"""
+    index = get_roster_view(group, snapshot=snapshot).vacation_index
+    message = format_vacation_message(index, today, snapshot.sync_date(), group)
+    if message is None:
+        return "Нет данных о текущих и предстоящих отпусках.", None
+    return message, 'html'
+
+# Разделы ответов и ночной рассылки: как собрать сообщение по выгрузке, как запросить его из БД
+# (roster_query_mode server и stream) и как отправить его без выгрузки
+REPLY_BUILDERS = {
+    'next5': build_next_5_birthdays_reply,
+    'vacations': build_vacations_reply,
+}
+QUERY_REPLIES = {
+    'next5': current_next_5_birthdays_reply,
+    'vacations': current_vacations_reply,
+}
+DIGEST_FALLBACK_SENDERS = {
+    'next5': send_next_5_birthdays,
+    'vacations': send_vacation_notifications,
+}
+
+# Готовые ответы: ключ (раздел, группа, день, "current_timestamp" выгрузки) -> (текст, parse_mode).
+# Ответ меняется только с датой или выгрузкой, поэтому команды и рассылка берут его отсюда
+REPLY_CACHE_SIZE = 256
+reply_cache = OrderedDict()
+reply_cache_lock = threading.Lock()
+
+def get_reply(part, snapshot, today, group=None):
+    """Ответ (текст, parse_mode) раздела part ('next5' или 'vacations') из кэша; при промахе строится заново"""
+    group = resolve_group(group)
+    key = (part, group.name, today, snapshot.timestamp)
+    with reply_cache_lock:
+        reply = reply_cache.get(key)
+        if reply is not None:
+            reply_cache.move_to_end(key)
+            metrics.registry.inc('reply_cache_total', result='hit')
+            return reply
+    metrics.registry.inc('reply_cache_total', result='miss')
+    with metrics.registry.timer('reply_build_seconds', part=part):
+        reply = REPLY_BUILDERS[part](snapshot, today, group=group)
+    with reply_cache_lock:
+        reply_cache[key] = reply
+        while len(reply_cache) > REPLY_CACHE_SIZE:
+            reply_cache.popitem(last=False)
+    return reply
+
+def build_nightly_digest(snapshot, today, subscriptions):
+    """Сообщения ночной рассылки по одной выгрузке: {chat_id: [(текст, parse_mode), ...]}.
+
+    Каждое сообщение (группа, раздел) строится один раз (см. get_reply), сколько бы чатов на него ни было подписано.
+    """
+    return {
+        chat_id: [get_reply(part, snapshot, today, group) for group, part in parts]
+        for chat_id, parts in subscriptions.items()
+    }
+
+def query_nightly_digest(subscriptions):
+    """Сообщения ночной рассылки без выгрузки в памяти: каждое сообщение (группа, раздел)
+    запрашивается из БД один раз в текущем roster_query_mode"""
+    replies = {}
+    digest = {}
+    for chat_id, parts in subscriptions.items():
+        messages = digest[chat_id] = []
+        for group, part in parts:
+            key = (part, group.name)
+            if key not in replies:
+                replies[key] = QUERY_REPLIES[part](group)
+            messages.append(replies[key])
+    return digest
+
+def send_nightly_digest(chat_ids=None):
+    """Ночная рассылка: выгрузка читается один раз, сообщения всех групп строятся из нее в памяти
+    (в режимах server и stream — запросами, см. query_nightly_digest) и расходятся по подписанным
+    чатам (по умолчанию — по всем)"""
+    subscriptions = group_registry.subscriptions()
+    if chat_ids is not None:
+        subscriptions = {chat_id: subscriptions[chat_id] for chat_id in chat_ids if chat_id in subscriptions}
+    timings = []
+    stage_started = time.perf_counter()
+    try:
+        if ROSTER_QUERY_MODE == 'snapshot':
+            snapshot = snapshot_cache.get()
+            timings.append(('выгрузка', time.perf_counter() - stage_started))
 
-def scheduler():
-    times = ["03:30"]
-    while True:
-        logging.info('Запуск планировщика...')
-        # Получаем текущее время и определяем ближайший target
-        now = datetime.now()
-        logging.info(f"Текущее время: {now}")
-        # Список будущих target на сегодня
-        future_targets = [
-            # Создаем datetime объект для каждого target времени
-            # например, если сейчас 14:00, то target будет 15:30
-            now.replace(hour=int(t[:2]), minute=int(t[3:]), second=0, microsecond=0)
-            for t in times
-            if now.replace(hour=int(t[:2]), minute=int(t[3:]), second=0, microsecond=0) > now
-        ]
-        if future_targets:
-            target = min(future_targets)
+            stage_started = time.perf_counter()
+            digest = build_nightly_digest(snapshot, datetime.now().date(), subscriptions)
         else:
-            # Все target на сегодня прошли, берем самое раннее на завтра
-            t_earliest = times[0]
-            target = (now + timedelta(days=1)).replace(hour=int(t_earliest[:2]), minute=int(t_earliest[3:]), second=0, microsecond=0)
-        wait_seconds = (target - now).total_seconds()
-        logging.info(f'Ожидание до следующей отправки: {wait_seconds/60:.1f} минут.')
-        time.sleep(wait_seconds)
-        # send_birthday_reminder()
-        send_next_5_birthdays(CHAT_ID)
-        send_next_5_birthdays(CHAT_ID, all_employees=True)
-        send_vacation_notifications(CHAT_ID)
+            digest = query_nightly_digest(subscriptions)
+        timings.append(('подготовка', time.perf_counter() - stage_started))
+    except Exception as e:
+        # Без выгрузки возвращаемся к отдельным командам, у каждой своя обработка ошибок
+        logging.error('Ошибка при подготовке ночной рассылки: %s. Отправляем сообщения по отдельности.', e)
+        for chat_id, parts in subscriptions.items():
+            for group, part in parts:
+                DIGEST_FALLBACK_SENDERS[part](chat_id, group=group, coalesce=False)
+        return
+
+    stage_started = time.perf_counter()
+    for chat_id, messages in digest.items():
+        for text, parse_mode in messages:
+            # Каждый раздел рассылки — отдельное сообщение, как до очереди отправки
+            outbox.send_message(chat_id, text, parse_mode=parse_mode, coalesce=False)
+    timings.append(('постановка в очередь', time.perf_counter() - stage_started))
+
+    stages = ', '.join(f'{name} {seconds:.3f} с' for name, seconds in timings)
+    count = sum(len(messages) for messages in digest.values())
+    logging.info('Ночная рассылка (%s сообщ.) поставлена в очередь для %d чатов: %s.', count, len(digest), stages)
+
+def register_handlers(bot):
+    """Регистрация обработчиков команд бота"""
+    bot.register_message_handler(handle_birthdays_command, commands=['birthdays'])
+    bot.register_message_handler(handle_next5_command, commands=['next5'])
+    bot.register_message_handler(handle_next5all_command, commands=['next5all'])
+    bot.register_message_handler(handle_vacations_command, commands=['vacations'])
+    bot.register_message_handler(handle_vacationsall_command, commands=['vacationsall'])
+    bot.register_message_handler(handle_stats_command, commands=['stats'])
+
+def prepare_snapshot(snapshot):
+    """Индексы и готовые ответы всех групп и картинка /birthdays на сегодня — до того, как их попросит команда"""
+    started = time.perf_counter()
+    today = datetime.now().date()
+    for group in group_registry:
+        view = group.view(snapshot)
+        view.birthday_index
+        view.vacation_index
+        for part in DIGEST_PARTS:
+            get_reply(part, snapshot, today, group)
+    key = birthday_image_key(snapshot.timestamp, today)
+    get_birthday_table_image(key, get_roster_view(snapshot=snapshot).birthday_index)
+    logging.info('Выгрузка на %s подготовлена за %.2f с.', snapshot.sync_date(), time.perf_counter() - started)
+
+def warm_caches():
+    """Прогрев перед рассылкой: соединения с БД, свежая выгрузка, индексы и картинка /birthdays"""
+    db_pool.warmup()
+    if ROSTER_QUERY_MODE != 'snapshot':
+        return
+    prepare_snapshot(snapshot_cache.refresh())
+
+def prepare_today():
+    """Сразу после полуночи: ответы и картинка /birthdays на наступивший день"""
+    prepare_snapshot(snapshot_cache.get())
+
+def on_new_sync(timestamp):
+    """Событие SyncWatcher: в БД появилась новая выгрузка"""
+    if ROSTER_QUERY_MODE == 'snapshot':
+        previous = snapshot_cache.get_loaded()
+        snapshot = snapshot_cache.refresh()
+        if snapshot.timestamp != timestamp:
+            # refresh() при ошибке оставляет прежнюю выгрузку; ошибка заставит наблюдателя повторить
+            raise RuntimeError(f'выгрузка на {timestamp} не загружена, в памяти — на {snapshot.sync_date()}')
+        if async_snapshot_cache is not None:
+            # Асинхронные команды работают с той же выгрузкой, второй загрузки через asyncpg нет
+            async_snapshot_cache.adopt(snapshot)
+        prepare_snapshot(snapshot)
+        if NOTIFY_VACATION_CHANGES and snapshot is not previous and snapshot.diff is not None:
+            notify_vacation_changes(snapshot)
+    elif async_snapshot_cache is not None:
+        # Синхронный кэш выгрузку не держит — асинхронный перечитает ее сам
+        async_snapshot_cache.invalidate()
+
+def run_nightly_digest(chat_ids):
+    send_nightly_digest(chat_ids)
+    logging.info('Статистика пула соединений: %s', db_pool.stats())
+    logging.info('Статистика очереди отправки: %s', outbox.stats())
+    logging.info(
+        'Статистика команд: объединение %s, защита от повторов %s',
+        command_flights.stats(), command_debouncer.stats(),
+    )
+
+def start_scheduler():
+    """Планировщик: одна ночная рассылка на каждое расписание (по всем его чатам) и прогрев кэшей перед ней"""
+    settings = SCHEDULE_SETTINGS
+    job_scheduler = Scheduler(workers=settings['workers']).start()
+    for schedule, chat_ids in settings['digests']:
+        job_scheduler.add(
+            f'рассылка ({schedule}, чатов: {len(chat_ids)})', functools.partial(run_nightly_digest, chat_ids),
+            schedule, missed=settings['missed'], grace=settings['grace'],
+        )
+        if settings['warmup_before']:
+            job_scheduler.add(
+                f'прогрев кэшей перед {schedule}', warm_caches, schedule.shifted(-settings['warmup_before']),
+                missed='skip', grace=settings['warmup_before'],
+            )
+    if ROSTER_QUERY_MODE == 'snapshot' and settings['prerender']:
+        # Даты в ответах считаются по часам сервера (datetime.now()), поэтому и полночь берем серверную
+        job_scheduler.add(
+            'подготовка ответов на новый день', prepare_today, Schedule.parse(settings['prerender']),
+            missed='skip', grace=3600,
+        )
+    return job_scheduler
+
+
+def start_roster_refresh():
+    """Соединения с БД и отслеживание выгрузок — в фоне, чтобы недоступная БД не задерживала запуск:
+    до ее появления команды отвечают по сохраненной на диске выгрузке"""
+    def warmup():
+        try:
+            db_pool.warmup()
+        except Exception as e:
+            logging.error('Не удалось заранее открыть соединения с БД: %s', e)
+
+    threading.Thread(target=warmup, name='db-warmup', daemon=True).start()
+    # Первая проверка наблюдателя загрузит выгрузку; дальше ее обновляет только он
+    snapshot_cache.watched = ROSTER_QUERY_MODE == 'snapshot'
+    if async_snapshot_cache is not None:
+        async_snapshot_cache.watched = snapshot_cache.watched
+    sync_watcher.start()
+
+
+def start_metrics_server():
+    """HTTP-эндпоинт для Prometheus, если задан metrics_port; ошибка запуска не мешает работе бота"""
+    global metrics_server
+    settings = METRICS_SETTINGS
+    if not settings.get('port') or metrics_server is not None:
+        return
+    try:
+        metrics_server = MetricsServer(metrics.registry, host=settings['host'], port=settings['port']).start()
+    except OSError as e:
+        logging.error('Не удалось открыть эндпоинт метрик на %s:%s: %s', settings['host'], settings['port'], e)
+
+
+def start_render_pool():
+    """Прогретые процессы отрисовки, если render_processes > 0; при ошибке запуска рисуем в процессе бота"""
+    global render_pool
+    settings = RENDER_POOL_SETTINGS
+    if not settings.get('processes') or render_pool is not None:
+        return
+    try:
+        render_pool = RenderPool(BIRTHDAY_TABLE_RENDERER, **settings).start()
+    except Exception as e:
+        logging.error('Не удалось запустить пул отрисовки, рисуем в процессе бота: %s', e)
+        return
+    metrics.registry.add_collector('render_pool', render_pool.stats)
+
+
+def stop_render_pool():
+    global render_pool
+    if render_pool is not None:
+        render_pool.stop()
+        render_pool = None
 
 
 # Основной цикл запуска бота
 def run_bot():
-    # Запускаем scheduler только один раз
-    thread = threading.Thread(target=scheduler, daemon=True)
-    thread.start()
+    start_metrics_server()
+    start_render_pool()
+    start_roster_refresh()
+    start_scheduler()
     while True:
         try:
             logging.info('Бот запущен.')
             bot.polling(none_stop=True, interval=0)
         except requests.exceptions.RequestException as e:
-            logging.error(f"Ошибка сети: {e}. Перезапуск через 15 секунд.")
+            logging.error('Ошибка сети: %s. Перезапуск через 15 секунд.', e)
             print(f"Ошибка сети: {e}. Перезапуск через 15 секунд.")
             time.sleep(15)
         except Exception as e:
-            logging.error(f"Произошла непредвиденная ошибка: {e}. Перезапуск через 30 секунд.")
+            logging.error('Произошла непредвиденная ошибка: %s. Перезапуск через 30 секунд.', e)
             print(f"Произошла непредвиденная ошибка: {e}. Перезапуск через 30 секунд.")
             time.sleep(30)
 
 
+def dispatch_updates(updates):
+    """Передает обновления из webhook (dict в формате Bot API) обработчикам бота"""
+    bot.process_new_updates([telebot.types.Update.de_json(update) for update in updates])
+
+def run_bot_webhook():
+    from webhook import WebhookServer
+
+    start_metrics_server()
+    start_render_pool()
+    start_roster_refresh()
+    job_scheduler = start_scheduler()
+
+    settings = dict(WEBHOOK_SETTINGS)
+    url = settings.pop('url')
+    drain_timeout = settings.pop('drain_timeout')
+    server = WebhookServer(dispatch_updates, **settings).start()
+    metrics.registry.add_collector('webhook', server.stats)
+    if url:
+        # Без url считаем, что webhook уже настроен снаружи (например, за reverse proxy)
+        bot.set_webhook(url=url, secret_token=settings['secret'])
+        logging.info('Webhook зарегистрирован в Telegram: %s', url)
+
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        logging.info('Получен сигнал %s, останавливаем webhook...', signum)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    logging.info('Бот запущен в режиме webhook.')
+    stopping.wait()
+    server.stop(timeout=drain_timeout)
+    job_scheduler.stop(wait=False)
+    sync_watcher.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    stop_render_pool()
+    outbox.stop(timeout=drain_timeout)
+
+
+# ---------- Асинхронный режим (runtime = async) ----------
+
+def asyncpg_creds(creds):
+    """Параметры подключения из конфига (в терминах psycopg2) в виде, понятном asyncpg"""
+    renamed = {'dbname': 'database', 'connect_timeout': 'timeout', 'sslmode': 'ssl'}
+    result = {}
+    for key, value in dict(creds).items():
+        key = renamed.get(key, key)
+        if key == 'port':
+            value = int(value)
+        elif key == 'timeout':
+            value = float(value)
+        result[key] = value
+    return result
+
+
+class AsyncSnapshotCache:
+    """Асинхронный вариант SnapshotCache поверх пула соединений asyncpg.
+
+    snapshot — уже загруженная (например, с диска) выгрузка, с которой можно начать.
+    В режиме 'snapshot' новые выгрузки загружает синхронный SnapshotCache по событию
+    SyncWatcher, а этот кэш получает тот же объект через adopt() (watched = True):
+    выгрузка в памяти одна и читается из БД один раз.
+    """
+
+    def __init__(self, creds, check_interval=60, min_size=1, max_size=4, store=None, snapshot=None):
+        self._creds = asyncpg_creds(creds)
+        self.check_interval = check_interval
+        self.min_size = min_size
+        self.max_size = max_size
+        self.store = store
+        self._pool = None
+        self._snapshot = snapshot
+        self._from_db = False
+        self._checked_at = float('-inf')
+        self._lock = asyncio.Lock()
+        self.watched = False
+
+    async def _get_pool(self):
+        if self._pool is None:
+            import asyncpg
+
+            self._pool = await asyncpg.create_pool(min_size=self.min_size, max_size=self.max_size, **self._creds)
+        return self._pool
+
+    def _is_fresh(self):
+        return self._snapshot is not None and (
+            self.watched or time.monotonic() - self._checked_at < self.check_interval
+        )
+
+    def invalidate(self):
+        """Заставляет следующий get() сразу проверить БД (можно вызывать из любого потока)"""
+        self._checked_at = float('-inf')
+
+    def adopt(self, snapshot):
+        """Подменяет выгрузку уже загруженной синхронным кэшем (можно вызывать из любого потока)"""
+        self._snapshot = snapshot
+        self._from_db = True
+        self._checked_at = time.monotonic()
+
+    async def get(self):
+        if self._is_fresh():
+            return self._snapshot
+        async with self._lock:
+            if self._is_fresh():
+                return self._snapshot
+            try:
+                return await self._refresh()
+            except Exception as e:
+                self._checked_at = time.monotonic()
+                if self._snapshot is None:
+                    raise
+                logging.error(
+                    'Не удалось проверить актуальность выгрузки, используем сохраненную '
+                    'на %s: %s',
+                    self._snapshot.sync_date(), e,
+                )
+                return self._snapshot
+
+    async def _refresh(self):
+        pool = await self._get_pool()
+        latest = await pool.fetchval(LATEST_TIMESTAMP_SQL)
+        self._checked_at = time.monotonic()
+        previous = self._snapshot
+        if previous is not None and previous.timestamp == latest:
+            return previous
+        started = time.perf_counter()
+        snapshot = None
+        if self._from_db and previous.timestamp is not None and latest is not None:
+            sql, args = to_asyncpg(*build_snapshot_count_query(previous.timestamp))
+            count = await pool.fetchval(sql, *args)
+            if count == len(previous):
+                sql, args = to_asyncpg(*build_snapshot_diff_query(previous.timestamp, latest))
+                diff = SnapshotDiff.from_rows(await pool.fetch(sql, *args))
+                try:
+                    snapshot = previous.apply(diff, latest)
+                except ValueError as e:
+                    logging.error('Разница выгрузок не сходится с выгрузкой в памяти, читаем новую целиком: %s', e)
+        if snapshot is None:
+            rows = []
+            if latest is not None:
+                sql, args = to_asyncpg(*build_snapshot_query(latest))
+                rows = await pool.fetch(sql, *args)
+            snapshot = RosterSnapshot(latest, rows)
+        self._snapshot = snapshot
+        self._from_db = True
+        metrics.registry.observe(
+            'snapshot_load_seconds', time.perf_counter() - started,
+            kind='full' if snapshot.diff is None else 'diff',
+        )
+        logging.info(
+            'Загружена выгрузка сотрудников на %s%s: %d записей за %.2f с.',
+            snapshot.sync_date(), ' как разница с предыдущей' if snapshot.diff is not None else '',
+            len(snapshot), time.perf_counter() - started,
+        )
+        if self.store is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.store.save, self._snapshot)
+            except Exception as e:
+                logging.error('Не удалось сохранить выгрузку на диск: %s', e)
+        return self._snapshot
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+# Создаются в init() при runtime = async. Ответы асинхронных команд идут через async_sender:
+# очередь Outbox работает на потоках вокруг синхронного бота, а AsyncSender соблюдает ее лимиты
+# и retry_after прямо в цикле событий
+async_bot = None
+async_sender = None
+async_snapshot_cache = None
+async_command_slots = None
+render_executor = None
+
+async def _reply_async(message, command, part, group, error_text):
+    """Общий путь асинхронных команд: защита от повторов, проверка прав, текст ответа, отправка.
+    В режиме snapshot ответ строится по выгрузке из asyncpg, в режимах server и stream — теми же
+    запросами, что у синхронных команд (QUERY_REPLIES), в пуле потоков"""
+    if not accept_command(message, command):
+        return
+    if message.from_user.id != ADMIN_CHAT_ID:
+        await async_sender.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+        return
+    async with async_command_slots:
+        try:
+            with metrics.registry.timer('command_seconds', command=command):
+                if ROSTER_QUERY_MODE == 'snapshot':
+                    snapshot = await async_snapshot_cache.get()
+                    text, parse_mode = get_reply(part, snapshot, datetime.now().date(), group)
+                else:
+                    text, parse_mode = await asyncio.get_running_loop().run_in_executor(
+                        None, QUERY_REPLIES[part], group,
+                    )
+            await async_sender.send_message(message.chat.id, text, parse_mode=parse_mode)
+        except Exception as e:
+            logging.error('Ошибка при обработке команды %r: %s', message.text, e)
+            try:
+                await async_sender.send_message(message.chat.id, error_text)
+            except Exception as e:
+                logging.error('Не удалось отправить сообщение об ошибке в чат %s: %s', message.chat.id, e)
+
+async def handle_stats_command_async(message: Message):
+    if not accept_command(message, 'stats'):
+        return
+    if message.from_user.id != ADMIN_CHAT_ID:
+        await async_sender.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+        return
+    await async_sender.send_message(message.chat.id, format_stats_message())
+
+async def handle_birthdays_command_async(message):
+    chat_id = message.chat.id
+    if not accept_command(message, 'birthdays'):
+        return
+    async with async_command_slots:
+        try:
+            loop = asyncio.get_running_loop()
+            if ROSTER_QUERY_MODE == 'snapshot':
+                key, build = birthday_table_source(await async_snapshot_cache.get())
+            else:
+                # Метка выгрузки может потребовать запроса через psycopg2 — не в цикле событий
+                key, build = await loop.run_in_executor(None, birthday_table_source)
+            # Отрисовка (и в режиме stream — запрос к БД) уходит из цикла событий в пул потоков
+            entry = await command_flights.do_async(
+                ('birthdays', *key), lambda: loop.run_in_executor(render_executor, build),
+            )
+            sent = None
+            if entry['file_id']:
+                try:
+                    sent = await async_sender.send_photo(chat_id, entry['file_id'])
+                except telebot.asyncio_helper.ApiTelegramException as e:
+                    logging.error('Не удалось отправить картинку по file_id, отправляем заново: %s', e)
+                    entry['file_id'] = None
+            if sent is None:
+                sent = await async_sender.send_photo(chat_id, io.BytesIO(entry['png']))
+                if sent is not None and sent.photo:
+                    entry['file_id'] = sent.photo[-1].file_id
+            logging.info('Напоминание успешно отправлено в чат %s.', chat_id)
+        except Exception as e:
+            logging.error('Ошибка при отправке напоминания: %s', e)
+
+async def handle_next5_command_async(message: Message):
+    await _reply_async(
+        message, 'next5', 'next5', None,
+        "Произошла ошибка при получении данных о днях рождения.",
+    )
+
+async def handle_next5all_command_async(message: Message):
+    await _reply_async(
+        message, 'next5all', 'next5', group_registry.everyone,
+        "Произошла ошибка при получении данных о днях рождения.",
+    )
+
+async def handle_vacations_command_async(message: Message):
+    await _reply_async(
+        message, 'vacations', 'vacations', None,
+        "Произошла ошибка при получении данных об отпусках.",
+    )
+
+async def handle_vacationsall_command_async(message: Message):
+    await _reply_async(
+        message, 'vacationsall', 'vacations', group_registry.everyone,
+        "Произошла ошибка при получении данных об отпусках.",
+    )
+
+def create_async_bot():
+    """AsyncTeleBot с зарегистрированными асинхронными обработчиками команд"""
+    from telebot.async_telebot import AsyncTeleBot
+
+    async_bot = AsyncTeleBot(TELEGRAM_TOKEN)
+    async_bot.register_message_handler(handle_birthdays_command_async, commands=['birthdays'])
+    async_bot.register_message_handler(handle_next5_command_async, commands=['next5'])
+    async_bot.register_message_handler(handle_next5all_command_async, commands=['next5all'])
+    async_bot.register_message_handler(handle_vacations_command_async, commands=['vacations'])
+    async_bot.register_message_handler(handle_vacationsall_command_async, commands=['vacationsall'])
+    async_bot.register_message_handler(handle_stats_command_async, commands=['stats'])
+    return async_bot
+
+async def _run_async_polling():
+    try:
+        logging.info('Бот запущен в асинхронном режиме (до %s команд одновременно).', ASYNC_MAX_CONCURRENCY)
+        await async_bot.infinity_polling(timeout=20)
+    finally:
+        await async_snapshot_cache.close()
+        await async_bot.close_session()
+
+def run_bot_async():
+    # Ночная рассылка по-прежнему идет из планировщика через синхронного бота
+    start_metrics_server()
+    start_render_pool()
+    start_roster_refresh()
+    start_scheduler()
+    try:
+        asyncio.run(_run_async_polling())
+    finally:
+        render_executor.shutdown(wait=False)
+        stop_render_pool()
+
+
+def init(config_path=None, greet=True):
+    """Чтение конфига, создание пула соединений, кэша выгрузки и бота.
+
+    Вызывается один раз перед run_bot(); приветствие админу уходит в фоне,
+    чтобы недоступный Telegram не задерживал запуск.
+    """
+    global config, db_creds, TELEGRAM_TOKEN, ADMIN_CHAT_ID, CHAT_ID
+    global ROSTER_QUERY_MODE, DB_ITERSIZE, BIRTHDAY_TABLE_RENDERER, RUNTIME, ASYNC_MAX_CONCURRENCY
+    global UPDATE_MODE, WEBHOOK_SETTINGS, METRICS_SETTINGS, SCHEDULE_SETTINGS, NOTIFY_VACATION_CHANGES, REPLY_CACHE_SIZE
+    global RENDER_POOL_SETTINGS
+    global db_pool, snapshot_cache, bot, outbox, group_registry, sync_watcher, command_flights, command_debouncer
+    global async_bot, async_sender, async_snapshot_cache, async_command_slots, render_executor
+    init_started = time.perf_counter()
+
+    config = configparser.ConfigParser()
+    config.read(config_path or CONFIG_PATH)
+    setup_logging(config['REMINDBOT2'] if config.has_section('REMINDBOT2') else None)
+
+    db_creds = config['HOSTER_KC_DB'] if platform.system() == 'Windows' else config['HOSTER_KC_DB_LOCAL']
+    bot_config = config['REMINDBOT2']
+    TELEGRAM_TOKEN = bot_config['remindbot_token']
+    ADMIN_CHAT_ID = int(bot_config['admin_chat_id'])
+    CHAT_ID = int(bot_config['birthday_chat_with_nika'])
+
+    ROSTER_QUERY_MODE = bot_config.get('roster_query_mode', fallback='snapshot')
+    if ROSTER_QUERY_MODE not in ROSTER_QUERY_MODES:
+        raise ValueError(f'Неизвестный roster_query_mode: {ROSTER_QUERY_MODE}')
+    DB_ITERSIZE = bot_config.getint('db_itersize', fallback=2000)
+    RUNTIME = bot_config.get('runtime', fallback='sync')
+    if RUNTIME not in ('sync', 'async'):
+        raise ValueError(f'Неизвестный runtime: {RUNTIME}')
+    ASYNC_MAX_CONCURRENCY = bot_config.getint('async_max_concurrency', fallback=8)
+    UPDATE_MODE = bot_config.get('update_mode', fallback='polling')
+    if UPDATE_MODE not in ('polling', 'webhook'):
+        raise ValueError(f'Неизвестный update_mode: {UPDATE_MODE}')
+    if UPDATE_MODE == 'webhook' and RUNTIME != 'sync':
+        raise ValueError('update_mode = webhook поддерживается только с runtime = sync')
+    WEBHOOK_SETTINGS = {
+        'url': bot_config.get('webhook_url', fallback=None),
+        'host': bot_config.get('webhook_listen', fallback='127.0.0.1'),
+        'port': bot_config.getint('webhook_port', fallback=8443),
+        'path': bot_config.get('webhook_path', fallback='/telegram'),
+        'secret': bot_config.get('webhook_secret', fallback=None),
+        'queue_size': bot_config.getint('webhook_queue_size', fallback=100),
+        'workers': bot_config.getint('webhook_workers', fallback=4),
+        'drain_timeout': bot_config.getfloat('webhook_drain_timeout', fallback=30),
+    }
+    METRICS_SETTINGS = {
+        'host': bot_config.get('metrics_listen', fallback='127.0.0.1'),
+        'port': bot_config.getint('metrics_port', fallback=0),
+    }
+    # Выключенные метрики стоят одну проверку флага на вызов; /stats и так покажет stats() компонентов
+    metrics.registry.reset()
+    metrics.registry.enabled = bot_config.getboolean('metrics_enabled', fallback=False)
+    # Группы и подписки чатов: секции [GROUP <имя>], без них — PROгруппа и БУНКЕР в основной чат
+    group_registry = GroupRegistry.from_config(
+        config, default_groups(),
+        default=bot_config.get('default_group', fallback=None),
+        everyone=bot_config.get('all_group', fallback=None),
+    )
+
+    # Время рассылки: digest_schedule для всех чатов, отдельное — в секции REMINDBOT2_DIGEST (chat_id = расписание)
+    timezone = get_timezone(bot_config.get('timezone', fallback=None))
+    digest_schedule = bot_config.get('digest_schedule', fallback='03:30')
+    chat_schedules = {}
+    if config.has_section('REMINDBOT2_DIGEST'):
+        chat_schedules = {int(chat_id): text for chat_id, text in config['REMINDBOT2_DIGEST'].items()}
+    subscribed = group_registry.subscriptions()
+    for chat_id in set(chat_schedules) - set(subscribed):
+        logging.warning('Чат %s из REMINDBOT2_DIGEST не подписан ни на одну группу.', chat_id)
+    chats_by_schedule = {}
+    for chat_id in subscribed:
+        chats_by_schedule.setdefault(chat_schedules.get(chat_id, digest_schedule), []).append(chat_id)
+    SCHEDULE_SETTINGS = {
+        'digests': [(Schedule.parse(text, timezone), chat_ids) for text, chat_ids in chats_by_schedule.items()],
+        'warmup_before': bot_config.getfloat('warmup_before', fallback=600),
+        'workers': bot_config.getint('scheduler_workers', fallback=4),
+        'missed': bot_config.get('missed_runs', fallback='catch_up'),
+        'grace': bot_config.getfloat('missed_grace', fallback=300),
+        # Пустой prerender_schedule — не готовить ответы заранее после полуночи
+        'prerender': bot_config.get('prerender_schedule', fallback='00:00'),
+    }
+    if SCHEDULE_SETTINGS['missed'] not in MISSED_RUN_RULES:
+        raise ValueError(f"Неизвестный missed_runs: {SCHEDULE_SETTINGS['missed']}")
+    NOTIFY_VACATION_CHANGES = bot_config.getboolean('notify_vacation_changes', fallback=False)
+    REPLY_CACHE_SIZE = bot_config.getint('reply_cache_size', fallback=256)
+    BIRTHDAY_TABLE_RENDERER = bot_config.get('birthday_table_renderer', fallback='pillow')
+    if BIRTHDAY_TABLE_RENDERER not in RENDERERS:
+        raise ValueError(f'Неизвестный birthday_table_renderer: {BIRTHDAY_TABLE_RENDERER}')
+    RENDER_POOL_SETTINGS = {
+        'processes': bot_config.getint('render_processes', fallback=1),
+        'max_tasks': bot_config.getint('render_max_tasks', fallback=50),
+        'max_rss_mb': bot_config.getint('render_max_rss_mb', fallback=300),
+        'timeout': bot_config.getfloat('render_timeout', fallback=30),
+    }
+    # Повторный init(): процессы со старыми настройками больше не нужны
+    stop_render_pool()
+
+    # Параметры пула соединений с БД (можно переопределить в секции REMINDBOT2)
+    db_pool = ConnectionPool(
+        db_creds,
+        minconn=bot_config.getint('db_pool_min', fallback=1),
+        maxconn=bot_config.getint('db_pool_max', fallback=4),
+        timeout=bot_config.getfloat('db_pool_timeout', fallback=30),
+        check_interval=bot_config.getfloat('db_pool_check_interval', fallback=60),
+        max_idle=bot_config.getfloat('db_pool_max_idle', fallback=600),
+    )
+    # Как часто (в секундах) проверять, не появилась ли в БД новая выгрузка
+    # Локальная копия выгрузки (пустой snapshot_store_path — не сохранять); в режимах server и stream
+    # выгрузка целиком не читается и не сохраняется
+    store_path = bot_config.get('snapshot_store_path', fallback=SNAPSHOT_STORE_PATH)
+    snapshot_cache = SnapshotCache(
+        db_pool,
+        check_interval=bot_config.getfloat('snapshot_check_interval', fallback=60),
+        store=SnapshotStore(store_path) if store_path and ROSTER_QUERY_MODE == 'snapshot' else None,
+    )
+    if ROSTER_QUERY_MODE == 'snapshot':
+        snapshot_cache.load_persisted()
+    # Новые выгрузки: NOTIFY в канал sync_notify_channel (если задан) и опрос max("current_timestamp")
+    sync_watcher = SyncWatcher(
+        get_latest_sync_timestamp,
+        connect=db_pool.dedicated_connection,
+        channel=bot_config.get('sync_notify_channel', fallback=None) or None,
+        poll_interval=bot_config.getfloat('sync_poll_interval', fallback=snapshot_cache.check_interval),
+    )
+    sync_watcher.subscribe(on_new_sync)
+    # Одинаковые одновременные команды считаются один раз; повтор команды из чата
+    # раньше чем через command_debounce секунд игнорируется (0 — не игнорировать)
+    command_flights = SingleFlight()
+    command_debouncer = Debouncer(bot_config.getfloat('command_debounce', fallback=3))
+
+    # В режиме webhook обработчики выполняются в рабочих потоках WebhookServer,
+    # поэтому собственный пул потоков telebot не нужен
+    bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=UPDATE_MODE == 'polling')
+    register_handlers(bot)
+    # Все исходящие сообщения синхронного бота идут через очередь с лимитами Bot API
+    outbox = Outbox(
+        bot,
+        global_rate=bot_config.getfloat('outbox_global_rate', fallback=30),
+        chat_rate=bot_config.getfloat('outbox_chat_rate', fallback=1),
+        chat_burst=bot_config.getint('outbox_chat_burst', fallback=3),
+        max_attempts=bot_config.getint('outbox_max_attempts', fallback=5),
+        senders=bot_config.getint('outbox_senders', fallback=4),
+    ).start()
+
+    metrics.registry.add_collector('db_pool', db_pool.stats)
+    metrics.registry.add_collector('outbox', outbox.stats)
+    metrics.registry.add_collector('sync_watcher', sync_watcher.stats)
+    metrics.registry.add_collector('command_flights', command_flights.stats)
+    metrics.registry.add_collector('command_debouncer', command_debouncer.stats)
+    metrics.registry.add_collector('reply_cache', lambda: {'size': len(reply_cache)})
+
+    if RUNTIME == 'async':
+        async_snapshot_cache = AsyncSnapshotCache(
+            db_creds,
+            check_interval=snapshot_cache.check_interval,
+            min_size=db_pool.minconn,
+            max_size=db_pool.maxconn,
+            store=snapshot_cache.store,
+            snapshot=snapshot_cache.get_loaded(),
+        )
+        async_command_slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+        render_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='render')
+        async_bot = create_async_bot()
+        async_sender = AsyncSender(
+            async_bot,
+            global_rate=bot_config.getfloat('outbox_global_rate', fallback=30),
+            chat_rate=outbox.chat_rate,
+            chat_burst=outbox.chat_burst,
+            max_attempts=outbox.max_attempts,
+        )
+        metrics.registry.add_collector('async_sender', async_sender.stats)
+
+    if greet:
+        threading.Thread(target=send_startup_greeting, name='startup-greeting', daemon=True).start()
+
+    logging.info(
+        'Холодный старт: импорт модуля %.3f с, '
+        'инициализация %.3f с.',
+        _IMPORT_FINISHED - _IMPORT_STARTED, time.perf_counter() - init_started,
+    )
+
+
+_IMPORT_FINISHED = time.perf_counter()
+
 if __name__ == '__main__':
-    run_bot()
\ No newline at end of file
+    init()
+    if RUNTIME == 'async':
+        run_bot_async()
+    elif UPDATE_MODE == 'webhook':
+        run_bot_webhook()
+    else:
+        run_bot()
\ No newline at end of file
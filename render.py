@@ -0,0 +1,143 @@
+"""Отрисовка таблицы дней рождения в PNG для /birthdays.
+
+Основной путь — Pillow: таблица рисуется напрямую в небольшое изображение без
+matplotlib-фигуры. Путь через matplotlib оставлен для сравнения и как запасной.
+"""
+import importlib.util
+import io
+import os
+
+# Шрифты с кириллицей: DejaVu поставляется вместе с matplotlib, поэтому ищем его там
+# (не импортируя сам matplotlib), затем в системных каталогах.
+FONT_FILES = {
+    'regular': 'DejaVuSans.ttf',
+    'bold': 'DejaVuSans-Bold.ttf',
+}
+SYSTEM_FONT_DIRS = [
+    '/usr/share/fonts/truetype/dejavu',
+    '/usr/share/fonts/dejavu',
+    'C:\\Windows\\Fonts',
+]
+
+HEADER_BACKGROUND = (66, 114, 176)
+HEADER_FOREGROUND = (255, 255, 255)
+ROW_BACKGROUNDS = [(255, 255, 255), (240, 244, 250)]
+GRID_COLOR = (190, 198, 210)
+TEXT_COLOR = (20, 20, 20)
+
+_fonts = {}
+
+
+def _font_dirs():
+    dirs = []
+    spec = importlib.util.find_spec('matplotlib')
+    if spec is not None and spec.submodule_search_locations:
+        dirs.append(os.path.join(spec.submodule_search_locations[0], 'mpl-data', 'fonts', 'ttf'))
+    return dirs + SYSTEM_FONT_DIRS
+
+
+def find_font(style='regular'):
+    """Путь к файлу шрифта или None, если DejaVu не найден"""
+    for directory in _font_dirs():
+        path = os.path.join(directory, FONT_FILES[style])
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _load_font(style, size):
+    from PIL import ImageFont
+
+    key = (style, size)
+    font = _fonts.get(key)
+    if font is None:
+        path = find_font(style)
+        font = ImageFont.truetype(path, size) if path else ImageFont.load_default(size)
+        _fonts[key] = font
+    return font
+
+
+def render_table_pillow(columns, rows, font_size=20, padding=12):
+    """PNG-таблица (bytes): columns — заголовки, rows — строки ячеек; '\n' в ячейке — перенос строки"""
+    from PIL import Image, ImageDraw
+
+    font = _load_font('regular', font_size)
+    header_font = _load_font('bold', font_size)
+    line_height = int(font_size * 1.3)
+
+    cells = [[str(value).split('\n') for value in row] for row in rows]
+    header = [str(title).split('\n') for title in columns]
+
+    widths = []
+    for col in range(len(columns)):
+        width = max(header_font.getlength(line) for line in header[col])
+        for row in cells:
+            width = max(width, max(font.getlength(line) for line in row[col]))
+        widths.append(int(width) + 2 * padding)
+
+    def row_height(row):
+        return max(len(lines) for lines in row) * line_height + 2 * padding
+
+    heights = [row_height(header)] + [row_height(row) for row in cells]
+    image = Image.new('RGB', (sum(widths) + 1, sum(heights) + 1), ROW_BACKGROUNDS[0])
+    draw = ImageDraw.Draw(image)
+
+    y = 0
+    for index, (row, height) in enumerate(zip([header] + cells, heights)):
+        is_header = index == 0
+        background = HEADER_BACKGROUND if is_header else ROW_BACKGROUNDS[(index - 1) % 2]
+        draw.rectangle([0, y, sum(widths), y + height], fill=background, outline=GRID_COLOR)
+        x = 0
+        for col, lines in enumerate(row):
+            text_font = header_font if is_header else font
+            color = HEADER_FOREGROUND if is_header else TEXT_COLOR
+            text_y = y + (height - len(lines) * line_height) // 2
+            for line in lines:
+                # Текст по центру ячейки, как cellLoc='center' в matplotlib
+                text_x = x + (widths[col] - text_font.getlength(line)) / 2
+                draw.text((text_x, text_y), line, font=text_font, fill=color)
+                text_y += line_height
+            x += widths[col]
+            draw.line([x, y, x, y + height], fill=GRID_COLOR)
+        y += height
+
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def render_table_matplotlib(columns, rows):
+    """Прежняя отрисовка через ax.table и savefig(dpi=300)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # Увеличиваем ширину фигуры, чтобы ФИО не переносилось и не вылетало за пределы ячейки
+    fig_width = 14  # увеличено с 10 до 14
+    fig_height = 0.5 + 0.7 * len(rows)
+    fig, ax = plt.subplots(figsize=(fig_width, fig_height))
+    try:
+        ax.axis('off')
+        tbl = ax.table(cellText=rows, colLabels=columns, loc='center', cellLoc='center')
+        tbl.auto_set_font_size(False)
+        tbl.set_fontsize(16)
+        tbl.scale(2.5, 2)  # увеличиваем ширину ячеек
+        # Дополнительно увеличим ширину столбца "ФИО"
+        for (row, col), cell in tbl.get_celld().items():
+            if col == 1:  # "ФИО" обычно второй столбец (0 - Категория, 1 - ФИО, 2 - Дата рождения)
+                cell.set_width(0.45)
+            else:
+                cell.set_width(0.25)
+            cell.set_height(0.15)
+            cell.set_fontsize(16)
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', bbox_inches='tight', dpi=300)
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+RENDERERS = {
+    'pillow': render_table_pillow,
+    'matplotlib': render_table_matplotlib,
+}
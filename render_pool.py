@@ -0,0 +1,145 @@
+"""Отрисовка картинок в отдельных процессах.
+
+Таблица /birthdays рисуется в небольшом пуле процессов (multiprocessing.Pool), а бот
+получает готовый PNG байтами. Каждый процесс при запуске один раз загружает модули
+отрисовки, шрифты и бэкенд (пробная отрисовка), поэтому первая настоящая отрисовка не
+платит за прогрев. Процесс заменяется новым после max_tasks отрисовок; весь пул
+пересоздается, если процесс после отрисовки занимает больше max_rss_mb или отрисовка
+не уложилась в timeout (зависшие процессы завершаются принудительно). Кэши шрифтов
+и фигур matplotlib растут в процессах пула, а не в процессе бота, и отрисовка не
+отнимает GIL у потоков, принимающих обновления.
+
+На Linux процессы создаются через forkserver: форк многопоточного процесса бота небезопасен.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from render import RENDERERS
+
+
+def _context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # Сервер форков импортирует только модули отрисовки, а не модуль бота (__main__)
+        context.set_forkserver_preload(['render', 'render_pool', 'PIL.Image', 'PIL.ImageDraw', 'PIL.ImageFont'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _rss():
+    """Текущий RSS процесса в байтах или None, если узнать нельзя (не Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _warm_up(renderer):
+    """Инициализатор процесса пула: пробная отрисовка загружает модули, шрифты и бэкенд"""
+    RENDERERS[renderer](['-'], [['-']])
+
+
+def _render(renderer, columns, rows):
+    """Задача процесса пула: (PNG, RSS процесса после отрисовки)"""
+    png = RENDERERS[renderer](columns, rows)
+    return png, _rss()
+
+
+class RenderPool:
+    """Пул процессов отрисовки: render(columns, rows) -> PNG (bytes)"""
+
+    def __init__(self, renderer='pillow', processes=1, max_tasks=50, max_rss_mb=300, timeout=30):
+        if renderer not in RENDERERS:
+            raise ValueError(f'Неизвестный способ отрисовки: {renderer}')
+        self.renderer = renderer
+        self.processes = processes
+        self.max_tasks = max_tasks or None
+        self.max_rss = max_rss_mb * 1024 * 1024 if max_rss_mb else None
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.last_rss = None
+
+    def _new_pool(self):
+        return _context().Pool(
+            self.processes,
+            initializer=_warm_up,
+            initargs=(self.renderer,),
+            maxtasksperchild=self.max_tasks,
+        )
+
+    def start(self):
+        started = time.perf_counter()
+        self._pool = self._new_pool()
+        logging.info(
+            'Пул отрисовки запущен (%s, процессов: %s) '
+            'за %.2f с.',
+            self.renderer, self.processes, time.perf_counter() - started,
+        )
+        return self
+
+    def render(self, columns, rows):
+        """PNG таблицы; TimeoutError — процесс не ответил за timeout секунд (пул пересоздается)"""
+        with self._lock:
+            pool = self._pool
+        if pool is None:
+            raise RuntimeError('Пул отрисовки не запущен')
+        result = pool.apply_async(_render, (self.renderer, columns, rows))
+        try:
+            png, rss = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            self._recycle(pool, f'отрисовка не уложилась в {self.timeout} с', terminate=True)
+            raise TimeoutError(f'Отрисовка не уложилась в {self.timeout} с') from None
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        with self._lock:
+            self.renders += 1
+            self.last_rss = rss
+        if self.max_rss and rss is not None and rss > self.max_rss:
+            self._recycle(pool, f'процесс занял {rss / 1024 / 1024:.0f} МБ')
+        return png
+
+    def _recycle(self, pool, reason, terminate=False):
+        """Заменяет pool новым, если это еще не сделал другой поток"""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = self._new_pool()
+            self.recycled += 1
+        logging.info('Пул отрисовки пересоздан: %s.', reason)
+        if terminate:
+            pool.terminate()
+        else:
+            # Начатые отрисовки других потоков доделываются в старом пуле
+            pool.close()
+        threading.Thread(target=pool.join, name='render-pool-join', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'renders': self.renders,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'recycled': self.recycled,
+                'rss_mb': round(self.last_rss / 1024 / 1024, 1) if self.last_rss is not None else None,
+            }
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,779 @@
+"""Снимок выгрузки сотрудников с портала и производные представления над ним.
+
+Модуль не обращается ни к БД, ни к Telegram: он только хранит уже загруженные
+строки и отвечает на вопросы о них из памяти.
+"""
+import calendar
+import heapq
+import itertools
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+from datetime import date, datetime
+from functools import cached_property
+
+import datebatch
+
+# Компактная запись о сотруднике из nsi_data.dict_portal_ac_employees_tb_form
+Employee = namedtuple('Employee', 'fullname birthday department status vac_start vac_end')
+
+# Изменение по одному сотруднику между двумя выгрузками: kind — added, removed или changed
+Change = namedtuple('Change', 'fullname kind fields before after')
+
+# Даты разбираются пачками по столько строк через datebatch; списки короче — построчно
+BATCH_ROWS = 2048
+
+
+def compile_ilike(patterns):
+    """Компилирует список шаблонов ILIKE (как в department ILIKE ANY(...)) в функцию-предикат"""
+    parts = []
+    for pattern in patterns:
+        parts.append(''.join(
+            '.*' if ch == '%' else '.' if ch == '_' else re.escape(ch)
+            for ch in pattern
+        ))
+    regex = re.compile('|'.join(f'(?:{part})' for part in parts), re.IGNORECASE | re.DOTALL)
+
+    def match(value):
+        return value is not None and regex.fullmatch(value) is not None
+
+    return match
+
+
+def parse_birthday(value):
+    """Строка 'DD.MM' -> ключ (месяц, день); 29.02 считается корректной датой"""
+    day, month = map(int, value.split('.'))
+    date(2000, month, day)  # проверка по високосному году
+    return month, day
+
+
+def birthday_in_year(month, day, year):
+    """Дата дня рождения в заданном году; 29.02 в невисокосный год отмечаем 28.02"""
+    if month == 2 and day == 29 and not calendar.isleap(year):
+        return date(year, 2, 28)
+    return date(year, month, day)
+
+
+def _chunks(rows, size=BATCH_ROWS):
+    """Поток строк -> списки не длиннее size"""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_birthdays(rows, malformed=None):
+    """Поток (ФИО, 'DD.MM') -> поток (ключ (месяц, день), ФИО, 'DD.MM').
+
+    Пустые даты пропускаются молча, битые — одной сводкой в лог в конце потока
+    (и в список malformed, если он передан).
+    """
+    errors = []
+    for fullname, birthday in rows:
+        if not birthday:
+            continue
+        try:
+            key = parse_birthday(birthday)
+        except (ValueError, AttributeError) as e:
+            if malformed is not None:
+                malformed.append((fullname, birthday))
+            errors.append((fullname, birthday, e))
+            continue
+        yield key, fullname, birthday
+    datebatch.report_malformed('дат дней рождения', errors)
+
+
+def _birthday_columns(rows, errors, malformed=None):
+    """Пачка (ФИО, 'DD.MM') -> массивы (месяц, день) через datebatch.
+
+    Строки не в виде 'DD.MM' разбираются parse_birthday; у пустых и битых месяц остается 0.
+    """
+    import numpy as np
+
+    months, days = datebatch.parse_day_month([birthday for _, birthday in rows])
+    for i in np.flatnonzero(months == 0).tolist():
+        fullname, birthday = rows[i]
+        if not birthday:
+            continue
+        try:
+            months[i], days[i] = parse_birthday(birthday)
+        except (ValueError, AttributeError) as e:
+            if malformed is not None:
+                malformed.append((fullname, birthday))
+            errors.append((fullname, birthday, e))
+    return months, days
+
+
+def next_birthdays(rows, today, count=5):
+    """Ближайшие count различных дат дней рождения по потоку строк (ФИО, 'DD.MM').
+
+    Строки не накапливаются: поток разбирается пачками по BATCH_ROWS, в памяти только
+    сотрудники с count лучшими на данный момент датами, самая дальняя из них — на вершине
+    кучи. Результат тот же, что у BirthdayIndex.next_dates: строки (ФИО, 'DD.MM', дней до)
+    по возрастанию дней.
+    """
+    import numpy as np
+
+    dates = {}      # дней до даты -> [(ключ, ФИО, 'DD.MM')]
+    farthest = []   # куча из -дней: на вершине самая дальняя из отобранных дат
+    errors = []
+    for chunk in _chunks(rows):
+        months, days = _birthday_columns(chunk, errors)
+        until = datebatch.days_until(months, days, today)
+        candidates = months > 0
+        if count and len(dates) == count:
+            # Дальше самой дальней из отобранных дат ничего уже не попадет
+            candidates &= until <= -farthest[0]
+        for i in np.flatnonzero(candidates).tolist():
+            days_until = int(until[i])
+            people = dates.get(days_until)
+            if people is None:
+                if len(dates) < count:
+                    heapq.heappush(farthest, -days_until)
+                elif count and days_until < -farthest[0]:
+                    del dates[-heapq.heappushpop(farthest, -days_until)]
+                else:
+                    continue
+                people = dates[days_until] = []
+            fullname, birthday = chunk[i]
+            people.append(((int(months[i]), int(days[i])), fullname, birthday))
+    datebatch.report_malformed('дат дней рождения', errors)
+    # 28.02 и 29.02 в невисокосный год — одна дата; внутри нее порядок как в индексе
+    return [
+        (fullname, birthday, days)
+        for days in sorted(dates)
+        for _, fullname, birthday in sorted(dates[days])
+    ]
+
+
+def birthdays_by_bucket(rows, today):
+    """Поток (ФИО, 'DD.MM') -> строки таблицы /birthdays: (номер категории datebatch.BIRTHDAY_BUCKETS, ФИО, 'DD.MM').
+
+    Порядок и состав те же, что при обходе BirthdayIndex.between по категориям: каждый
+    сотрудник в самой ранней категории, внутри нее — по дате и ФИО. Категории считаются
+    пачками, в памяти остаются только попавшие в них строки.
+    """
+    import numpy as np
+
+    found = []
+    errors = []
+    for chunk in _chunks(rows):
+        months, days = _birthday_columns(chunk, errors)
+        until = datebatch.days_until(months, days, today)
+        buckets = datebatch.birthday_buckets(until, today)
+        for i in np.flatnonzero((months > 0) & (buckets >= 0)).tolist():
+            fullname, birthday = chunk[i]
+            found.append((int(buckets[i]), int(until[i]), int(months[i]), int(days[i]), fullname, birthday))
+    datebatch.report_malformed('дат дней рождения', errors)
+    found.sort()
+    result = []
+    seen = set()
+    for bucket, _, _, _, fullname, birthday in found:
+        if fullname not in seen:
+            seen.add(fullname)
+            result.append((bucket, fullname, birthday))
+    return result
+
+
+class BirthdayIndex:
+    """Отсортированный по (месяц, день) кольцевой индекс дней рождения.
+
+    Поиск ближайших дат — бинарный поиск по ключу сегодняшнего дня и обход по кругу
+    с переходом через конец года, без пересчета и сортировки всего списка на каждый запрос.
+    """
+
+    def __init__(self, rows):
+        rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+        self.malformed = []
+        if len(rows) >= BATCH_ROWS:
+            self._build_batch(rows)
+            return
+        groups = {}
+        for key, fullname, birthday in parse_birthdays(rows, self.malformed):
+            groups.setdefault(key, []).append((fullname, birthday))
+        self._keys = sorted(groups)
+        self._people = [tuple(sorted(groups[key])) for key in self._keys]
+
+    def _build_batch(self, rows):
+        """Та же сборка для большой выгрузки: даты через datebatch, группировка сортировкой массивов"""
+        import numpy as np
+
+        errors = []
+        months, days = _birthday_columns(rows, errors, self.malformed)
+        datebatch.report_malformed('дат дней рождения', errors)
+        keys = months * 32 + days
+        people = [row if type(row) is tuple else tuple(row) for row in rows]
+        # Сначала по (ФИО, дата), затем устойчиво по дню — как sorted() внутри каждого дня
+        by_name = np.array(sorted(np.flatnonzero(keys).tolist(), key=people.__getitem__), dtype=np.int64)
+        order = by_name[np.argsort(keys[by_name], kind='stable')]
+        if not order.size:
+            self._keys, self._people = [], []
+            return
+        ordered = keys[order]
+        bounds = (np.flatnonzero(np.diff(ordered)) + 1).tolist()
+        firsts = [0] + bounds
+        ordered_people = [people[i] for i in order.tolist()]
+        self._keys = [divmod(key, 32) for key in ordered[firsts].tolist()]
+        self._people = [tuple(ordered_people[a:b]) for a, b in zip(firsts, bounds + [len(ordered_people)])]
+
+    def __len__(self):
+        return sum(len(people) for people in self._people)
+
+    def updated(self, removed, added):
+        """Копия индекса без записей removed и с записями added (ФИО, 'DD.MM').
+
+        Каждая запись — бинарный поиск по ключу дня; остальные дни не трогаются.
+        """
+        index = BirthdayIndex.__new__(BirthdayIndex)
+        index._keys = list(self._keys)
+        index._people = list(self._people)
+        index.malformed = list(self.malformed)
+        errors = []
+        for entry in removed:
+            if not entry[1]:
+                continue
+            try:
+                key = parse_birthday(entry[1])
+            except (ValueError, AttributeError):
+                index.malformed.remove(entry)
+                continue
+            i = bisect_left(index._keys, key)
+            if i == len(index._keys) or index._keys[i] != key:
+                raise ValueError(f'В индексе дней рождения нет записи {entry}')
+            people = list(index._people[i])
+            people.remove(entry)
+            if people:
+                index._people[i] = tuple(people)
+            else:
+                del index._keys[i]
+                del index._people[i]
+        for entry in added:
+            if not entry[1]:
+                continue
+            try:
+                key = parse_birthday(entry[1])
+            except (ValueError, AttributeError) as e:
+                index.malformed.append(entry)
+                errors.append((entry[0], entry[1], e))
+                continue
+            i = bisect_left(index._keys, key)
+            if i < len(index._keys) and index._keys[i] == key:
+                index._people[i] = tuple(sorted(index._people[i] + (entry,)))
+            else:
+                index._keys.insert(i, key)
+                index._people.insert(i, (entry,))
+        datebatch.report_malformed('дат дней рождения', errors)
+        return index
+
+    def _walk(self, start):
+        """Даты дней рождения начиная со start (включительно) в хронологическом порядке, не дальше года"""
+        n = len(self._keys)
+        if not n:
+            return
+        first = bisect_left(self._keys, (start.month, start.day))
+        for step in range(n):
+            i = (first + step) % n
+            month, day = self._keys[i]
+            when = birthday_in_year(month, day, start.year)
+            if when < start:
+                when = birthday_in_year(month, day, start.year + 1)
+            yield when, self._people[i]
+
+    def next_dates(self, today, count):
+        """Ближайшие count различных дат: список (дата, дней до нее, [(ФИО, 'DD.MM'), ...])"""
+        result = []
+        for when, people in self._walk(today):
+            if result and result[-1][0] == when:
+                # 28.02 и 29.02 в невисокосный год попадают на одну дату
+                result[-1][2].extend(people)
+                continue
+            if len(result) == count:
+                break
+            result.append((when, (when - today).days, list(people)))
+        return result
+
+    def between(self, start, end):
+        """Дни рождения, выпадающие на [start, end]: список (дата, ФИО, 'DD.MM')"""
+        result = []
+        for when, people in self._walk(start):
+            if when > end:
+                break
+            result.extend((when, fullname, birthday) for fullname, birthday in people)
+        return result
+
+
+def parse_vacation_date(value):
+    """Дата отпуска из выгрузки: строка 'DD.MM.YYYY' или уже date/datetime"""
+    if isinstance(value, str):
+        day, month, year = value.split('.')
+        return date(int(year), int(month), int(day))
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    raise TypeError(f'неожиданный тип даты: {type(value).__name__}')
+
+
+def _vacation_columns(rows, errors, malformed=None):
+    """Пачка (ФИО, начало, конец) -> порядковые номера начала и конца через datebatch.
+
+    Строки не в виде 'DD.MM.YYYY' (в том числе date из БД) разбираются parse_vacation_date,
+    у битых оба номера 0.
+    """
+    import numpy as np
+
+    starts = datebatch.parse_dates([row[1] for row in rows])
+    ends = datebatch.parse_dates([row[2] for row in rows])
+    for i in np.flatnonzero((starts == 0) | (ends == 0)).tolist():
+        row = rows[i]
+        try:
+            starts[i] = parse_vacation_date(row[1]).toordinal()
+            ends[i] = parse_vacation_date(row[2]).toordinal()
+        except (ValueError, TypeError, AttributeError) as e:
+            if malformed is not None:
+                malformed.append(tuple(row))
+            errors.append((row[0], f'{row[1]} - {row[2]}', e))
+            starts[i] = ends[i] = 0
+    return starts, ends
+
+
+def _date_cache():
+    """date.fromordinal с памятью: у отпусков выгрузки немного различных дат"""
+    cache = {}
+
+    def get(ordinal):
+        value = cache.get(ordinal)
+        if value is None:
+            value = cache[ordinal] = date.fromordinal(ordinal)
+        return value
+
+    return get
+
+
+def vacations_overlapping(rows, first, last):
+    """Поток (ФИО, начало, конец) -> только отпуска, пересекающиеся с [first, last], с датами типа date.
+
+    Нужен, чтобы строить VacationIndex по окну, не держа в памяти все отпуска выгрузки:
+    поток разбирается пачками по BATCH_ROWS, порядок строк сохраняется.
+    """
+    import numpy as np
+
+    a, b = first.toordinal(), last.toordinal()
+    to_date = _date_cache()
+    errors = []
+    for chunk in _chunks(rows):
+        starts, ends = _vacation_columns(chunk, errors)
+        for i in np.flatnonzero((starts > 0) & (ends >= a) & (starts <= b)).tolist():
+            yield chunk[i][0], to_date(int(starts[i])), to_date(int(ends[i]))
+    datebatch.report_malformed('дат отпуска', errors)
+
+
+class VacationIndex:
+    """Отпуска как интервалы порядковых дней, отсортированные по дате начала и ФИО.
+
+    Запросы "кто в отпуске в день D", "кто уходит в отпуск в [a, b]" и "чей отпуск
+    пересекается с [a, b]" решаются бинарным поиском: пересечение ищется среди отпусков,
+    начавшихся не раньше a - (максимальная длительность). Аномально длинные интервалы
+    хранятся отдельно, чтобы не раздувать это окно.
+    """
+
+    LONG_VACATION_DAYS = 120
+
+    def __init__(self, rows):
+        rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+        self.malformed = []
+        errors = []
+        if len(rows) >= BATCH_ROWS:
+            entries = self._entries_batch(rows, errors)
+        else:
+            entries = []
+            for row in rows:
+                try:
+                    entries.append(self._entry(*row))
+                except (ValueError, TypeError, AttributeError) as e:
+                    self.malformed.append(tuple(row))
+                    errors.append((row[0], f'{row[1]} - {row[2]}', e))
+            entries.sort(key=self._sort_key)
+        datebatch.report_malformed('дат отпуска', errors)
+
+        self._long = [x for x in entries if x[1] - x[0] > self.LONG_VACATION_DAYS]
+        self._entries = [x for x in entries if x[1] - x[0] <= self.LONG_VACATION_DAYS]
+        self._starts = [x[0] for x in self._entries]
+        self._max_span = max((x[1] - x[0] for x in self._entries), default=0)
+
+    def _entries_batch(self, rows, errors):
+        """Записи индекса для большой выгрузки, уже в порядке (начало, ФИО): даты через datebatch"""
+        import numpy as np
+
+        starts, ends = _vacation_columns(rows, errors, self.malformed)
+        valid = sorted(np.flatnonzero(starts).tolist(), key=lambda i: _name_key(rows[i][0]))
+        # Сортировка устойчива: при равных дате начала и ФИО порядок строк как у list.sort
+        order = np.asarray(valid, dtype=np.int64)
+        order = order[np.argsort(starts[order], kind='stable')]
+        to_date = _date_cache()
+        return [
+            (start, end, rows[i][0], to_date(start), to_date(end))
+            for i, start, end in zip(order.tolist(), starts[order].tolist(), ends[order].tolist())
+        ]
+
+    def __len__(self):
+        return len(self._entries) + len(self._long)
+
+    @staticmethod
+    def _entry(fullname, vacation_start, vacation_end):
+        start_date = parse_vacation_date(vacation_start)
+        end_date = parse_vacation_date(vacation_end)
+        return start_date.toordinal(), end_date.toordinal(), fullname, start_date, end_date
+
+    @staticmethod
+    def _sort_key(entry):
+        """Порядок отпусков: по дате начала, при равной дате — по ФИО, как в отчете до индекса"""
+        return entry[0], _name_key(entry[2])
+
+    @staticmethod
+    def _position(entries, entry, lo, hi):
+        """Место entry среди entries[lo:hi] с той же датой начала: порядок как у полной сборки индекса"""
+        key = _name_key(entry[2])
+        while lo < hi and _name_key(entries[lo][2]) <= key:
+            lo += 1
+        return lo
+
+    def updated(self, removed, added):
+        """Копия индекса без отпусков removed и с отпусками added (ФИО, начало, конец).
+
+        Место каждого отпуска находится бинарным поиском по дате начала. После удаления
+        самого длинного отпуска окно поиска не сужается — запросы от этого лишь чуть медленнее.
+        """
+        index = VacationIndex.__new__(VacationIndex)
+        index._entries = list(self._entries)
+        index._starts = list(self._starts)
+        index._long = list(self._long)
+        index._max_span = self._max_span
+        index.malformed = list(self.malformed)
+        errors = []
+        for row in removed:
+            try:
+                entry = self._entry(*row)
+            except (ValueError, TypeError, AttributeError):
+                index.malformed.remove(tuple(row))
+                continue
+            if entry[1] - entry[0] > self.LONG_VACATION_DAYS:
+                index._long.remove(entry)
+                continue
+            lo = bisect_left(index._starts, entry[0])
+            i = index._entries.index(entry, lo, bisect_right(index._starts, entry[0]))
+            del index._entries[i]
+            del index._starts[i]
+        for row in added:
+            try:
+                entry = self._entry(*row)
+            except (ValueError, TypeError, AttributeError) as e:
+                index.malformed.append(tuple(row))
+                errors.append((row[0], f'{row[1]} - {row[2]}', e))
+                continue
+            if entry[1] - entry[0] > self.LONG_VACATION_DAYS:
+                lo = next((i for i, x in enumerate(index._long) if x[0] >= entry[0]), len(index._long))
+                hi = next((i for i, x in enumerate(index._long) if x[0] > entry[0]), len(index._long))
+                index._long.insert(self._position(index._long, entry, lo, hi), entry)
+                continue
+            i = self._position(index._entries, entry, bisect_left(index._starts, entry[0]),
+                               bisect_right(index._starts, entry[0]))
+            index._entries.insert(i, entry)
+            index._starts.insert(i, entry[0])
+            index._max_span = max(index._max_span, entry[1] - entry[0])
+        datebatch.report_malformed('дат отпуска', errors)
+        return index
+
+    @staticmethod
+    def _result(found):
+        found.sort(key=VacationIndex._sort_key)
+        return [(fullname, start_date, end_date) for _, _, fullname, start_date, end_date in found]
+
+    def overlapping(self, first, last):
+        """Отпуска, пересекающиеся с [first, last]: список (ФИО, начало, конец) по дате начала"""
+        a, b = first.toordinal(), last.toordinal()
+        lo = bisect_left(self._starts, a - self._max_span)
+        hi = bisect_right(self._starts, b)
+        found = [x for x in self._entries[lo:hi] if x[1] >= a]
+        found.extend(x for x in self._long if x[0] <= b and x[1] >= a)
+        return self._result(found)
+
+    def out_on(self, day):
+        """Кто в отпуске в день day"""
+        return self.overlapping(day, day)
+
+    def starting_between(self, first, last):
+        """Отпуска, начинающиеся в [first, last]"""
+        a, b = first.toordinal(), last.toordinal()
+        found = self._entries[bisect_left(self._starts, a):bisect_right(self._starts, b)]
+        found.extend(x for x in self._long if a <= x[0] <= b)
+        return self._result(found)
+
+
+def _birthday_entry(fullname, rows):
+    """DISTINCT ON (fullname): день рождения берется из первой строки сотрудника"""
+    return fullname, rows[0].birthday
+
+
+def _vacation_entries(fullname, rows):
+    """DISTINCT ON (fullname, vac_date_start): по одному отпуску на дату начала"""
+    seen = set()
+    result = []
+    for e in rows:
+        if e.vac_start is None or e.vac_end is None or e.vac_start in seen:
+            continue
+        seen.add(e.vac_start)
+        result.append((fullname, e.vac_start, e.vac_end))
+    return result
+
+
+def _name_key(fullname):
+    return fullname or ''
+
+
+class RosterView:
+    """Активные сотрудники снимка, отфильтрованные по подразделению.
+
+    Повторяет семантику прежних SQL-запросов: status is true, DISTINCT ON (fullname)
+    для дней рождения и DISTINCT ON (fullname, vac_date_start) для отпусков, ORDER BY fullname.
+    Строки хранятся по ФИО, поэтому apply() пересчитывает только затронутых сотрудников.
+    """
+
+    def __init__(self, employees, matcher=None):
+        self.matcher = matcher
+        active = [e for e in employees if self._accepts(e)]
+        active.sort(key=lambda e: _name_key(e.fullname))
+        rows = {}
+        for e in active:
+            rows.setdefault(e.fullname, []).append(e)
+        self._rows = {fullname: tuple(person_rows) for fullname, person_rows in rows.items()}
+
+    def _accepts(self, e):
+        return e.status and (self.matcher is None or self.matcher(e.department))
+
+    def _names(self):
+        return sorted(self._rows, key=_name_key)
+
+    @cached_property
+    def employees(self):
+        return [e for fullname in self._names() for e in self._rows[fullname]]
+
+    @cached_property
+    def birthdays(self):
+        return [_birthday_entry(fullname, self._rows[fullname]) for fullname in self._names()]
+
+    @cached_property
+    def vacations(self):
+        return [entry for fullname in self._names() for entry in _vacation_entries(fullname, self._rows[fullname])]
+
+    @cached_property
+    def birthday_index(self):
+        return BirthdayIndex(self.birthdays)
+
+    @cached_property
+    def vacation_index(self):
+        return VacationIndex(self.vacations)
+
+    def apply(self, diff):
+        """Представление после diff: строки и уже построенные индексы меняются
+        только для сотрудников из diff. ValueError — diff не сходится с этим представлением."""
+        touched = {}
+        for e in diff.removed:
+            if self._accepts(e):
+                touched.setdefault(e.fullname, ([], []))[0].append(e)
+        for e in diff.added:
+            if self._accepts(e):
+                touched.setdefault(e.fullname, ([], []))[1].append(e)
+
+        view = RosterView.__new__(RosterView)
+        view.matcher = self.matcher
+        view._rows = dict(self._rows)
+        old_birthdays, new_birthdays, old_vacations, new_vacations = [], [], [], []
+        for fullname, (removed, added) in touched.items():
+            before = self._rows.get(fullname, ())
+            rows = list(before)
+            for e in removed:
+                rows.remove(e)
+            # Новые строки в выгрузке-наследнике идут после старых (см. RosterSnapshot.apply)
+            rows.extend(added)
+            if rows:
+                view._rows[fullname] = tuple(rows)
+            else:
+                del view._rows[fullname]
+            if before:
+                old_birthdays.append(_birthday_entry(fullname, before))
+                old_vacations.extend(_vacation_entries(fullname, before))
+            if rows:
+                new_birthdays.append(_birthday_entry(fullname, rows))
+                new_vacations.extend(_vacation_entries(fullname, rows))
+
+        if 'birthday_index' in self.__dict__:
+            view.birthday_index = self.birthday_index.updated(old_birthdays, new_birthdays)
+        if 'vacation_index' in self.__dict__:
+            view.vacation_index = self.vacation_index.updated(old_vacations, new_vacations)
+        return view
+
+
+def _field_values(rows, field):
+    if field == 'vacations':
+        return {(e.vac_start, e.vac_end) for e in rows if e.vac_start is not None and e.vac_end is not None}
+    return {getattr(e, field) for e in rows}
+
+
+class SnapshotDiff:
+    """Построчная разница двух выгрузок (как EXCEPT ALL): появившиеся и исчезнувшие строки"""
+
+    FIELDS = ('birthday', 'department', 'status', 'vacations')
+
+    def __init__(self, added, removed):
+        self.added = tuple(Employee(*row) for row in added)
+        self.removed = tuple(Employee(*row) for row in removed)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Из строк build_snapshot_diff_query: ('+' или '-', затем колонки выгрузки)"""
+        added, removed = [], []
+        for change, *row in rows:
+            (added if change == '+' else removed).append(row)
+        return cls(added, removed)
+
+    @classmethod
+    def between(cls, old, new):
+        """Разница двух выгрузок, уже загруженных в память (время линейно по их размеру)"""
+        old_rows = Counter(old.employees)
+        new_rows = Counter(new.employees)
+        return cls((new_rows - old_rows).elements(), (old_rows - new_rows).elements())
+
+    def applied_to(self, employees):
+        """Строки выгрузки после применения разницы: исчезнувшие убраны, появившиеся — в конце"""
+        removed = Counter(self.removed)
+        kept = []
+        for e in employees:
+            if removed[e]:
+                removed[e] -= 1
+            else:
+                kept.append(e)
+        kept.extend(self.added)
+        return kept
+
+    def by_name(self):
+        """{ФИО: (исчезнувшие строки, появившиеся строки)}"""
+        result = {}
+        for e in self.removed:
+            result.setdefault(e.fullname, ([], []))[0].append(e)
+        for e in self.added:
+            result.setdefault(e.fullname, ([], []))[1].append(e)
+        return result
+
+    def changes(self):
+        """Изменения по сотрудникам в порядке ФИО: Change(ФИО, вид, поля, строки до, строки после).
+
+        added/removed — у сотрудника строки только появились/исчезли (новый сотрудник
+        или новая строка отпуска), changed — поменялись поля из FIELDS.
+        """
+        result = []
+        for fullname, (before, after) in sorted(self.by_name().items(), key=lambda item: _name_key(item[0])):
+            if not before:
+                kind, fields = 'added', self.FIELDS
+            elif not after:
+                kind, fields = 'removed', self.FIELDS
+            else:
+                kind = 'changed'
+                fields = tuple(f for f in self.FIELDS if _field_values(before, f) != _field_values(after, f))
+            result.append(Change(fullname, kind, fields, tuple(before), tuple(after)))
+        return result
+
+    def vacation_changes(self, matcher=None):
+        """Добавленные ('+') и отмененные ('-') отпуска активных сотрудников: (ФИО, знак, начало, конец)"""
+        result = []
+        for fullname, (before, after) in self.by_name().items():
+            old = _field_values([e for e in before if e.status and (matcher is None or matcher(e.department))],
+                                'vacations')
+            new = _field_values([e for e in after if e.status and (matcher is None or matcher(e.department))],
+                                'vacations')
+            result.extend((fullname, '-', start, end) for start, end in old - new)
+            result.extend((fullname, '+', start, end) for start, end in new - old)
+        result.sort(key=lambda x: (_name_key(x[0]), x[1], str(x[2])))
+        return result
+
+
+class RosterSnapshot:
+    """Неизменяемый снимок выгрузки за один "current_timestamp".
+
+    diff — разница с предыдущей выгрузкой, если снимок получен через apply().
+    """
+
+    # При большей доле изменившихся строк представления проще построить заново
+    INCREMENTAL_SHARE = 0.2
+
+    def __init__(self, timestamp, rows):
+        self.timestamp = timestamp
+        self.employees = tuple(Employee(*row) for row in rows)
+        self.diff = None
+        self._count = len(self.employees)
+        self._base = None
+        self._pending = None
+        self._views = {}
+        self._lock = threading.Lock()
+        self._rows_lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @cached_property
+    def employees(self):
+        """Строки снимка, полученного через apply(): собираются при первом обращении"""
+        with self._rows_lock:
+            if self._base is None:
+                return self.__dict__['employees']  # уже собраны в другом потоке
+            employees = self._base.employees
+            for diff in self._pending:
+                employees = diff.applied_to(employees)
+            employees = self.__dict__['employees'] = tuple(employees)
+            self._base = self._pending = None
+        return employees
+
+    def apply(self, diff, timestamp):
+        """Снимок за timestamp, равный этому плюс diff.
+
+        Уже построенные представления и индексы обновляются по строкам diff, а не
+        строятся заново; сами строки нового снимка собираются лениво.
+        """
+        snapshot = RosterSnapshot.__new__(RosterSnapshot)
+        snapshot.timestamp = timestamp
+        snapshot.diff = diff
+        snapshot._count = len(self) + len(diff.added) - len(diff.removed)
+        with self._rows_lock:
+            # Без цепочек снимков: наследник ссылается на последний снимок с собранными строками
+            snapshot._base = self._base or self
+            snapshot._pending = (*self._pending, diff) if self._base else (diff,)
+        snapshot._lock = threading.Lock()
+        snapshot._rows_lock = threading.Lock()
+        with self._lock:
+            views = dict(self._views)
+        if len(diff) > len(self) * self.INCREMENTAL_SHARE:
+            views = {}
+        snapshot._views = {key: view.apply(diff) for key, view in views.items()}
+        return snapshot
+
+    def view(self, key, matcher=None):
+        """Возвращает (и запоминает) представление снимка для группы key"""
+        view = self._views.get(key)
+        if view is None:
+            with self._lock:
+                view = self._views.get(key)
+                if view is None:
+                    view = RosterView(self.employees, matcher)
+                    self._views[key] = view
+        return view
+
+    def sync_date(self):
+        if self.timestamp is None:
+            return "Неизвестно"
+        return self.timestamp.strftime('%d.%m.%Y %H:%M')
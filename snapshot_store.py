@@ -0,0 +1,112 @@
+"""Локальная копия последней выгрузки сотрудников в SQLite.
+
+Файл хранит строки одной выгрузки и ее "current_timestamp". При запуске бот читает
+его и может отвечать на команды, даже если PostgreSQL недоступен; после каждой новой
+выгрузки файл перезаписывается целиком через временный файл и os.replace, поэтому
+читатель никогда не увидит его наполовину записанным.
+"""
+import logging
+import os
+import sqlite3
+import time
+from datetime import date, datetime
+
+from roster import RosterSnapshot
+
+SCHEMA = """
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE employees (
+        fullname TEXT, birthday TEXT, department TEXT, status INTEGER, vac_start TEXT, vac_end TEXT
+    );
+"""
+
+
+def _vacation_text(value):
+    """Даты отпусков храним строками 'DD.MM.YYYY', как они приходят из выгрузки"""
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.strftime('%d.%m.%Y')
+    return value
+
+
+class SnapshotStore:
+    """Файл SQLite с одной выгрузкой, ключ — "current_timestamp" источника"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _unreadable(self, error):
+        logging.warning('Файл %s не читается как сохраненная выгрузка (%s), считаем, что ее нет.', self.path, error)
+
+    def timestamp(self):
+        """"current_timestamp" сохраненной выгрузки или None, если файла нет или он испорчен"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'timestamp'").fetchone()
+            finally:
+                conn.close()
+            return datetime.fromisoformat(row[0]) if row and row[0] else None
+        except (sqlite3.DatabaseError, ValueError) as e:
+            self._unreadable(e)
+            return None
+
+    def load(self):
+        """Сохраненная выгрузка (RosterSnapshot) или None, если файла нет или он испорчен
+        (обрезан, не SQLite, старая схема) — следующий save() его перезапишет"""
+        if not os.path.exists(self.path):
+            return None
+        started = time.perf_counter()
+        try:
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            try:
+                meta = dict(conn.execute('SELECT key, value FROM meta'))
+                rows = [
+                    (fullname, birthday, department, None if status is None else bool(status), vac_start, vac_end)
+                    for fullname, birthday, department, status, vac_start, vac_end
+                    in conn.execute('SELECT fullname, birthday, department, status, vac_start, vac_end FROM employees')
+                ]
+            finally:
+                conn.close()
+            timestamp = datetime.fromisoformat(meta['timestamp']) if meta.get('timestamp') else None
+        except (sqlite3.DatabaseError, ValueError) as e:
+            self._unreadable(e)
+            return None
+        snapshot = RosterSnapshot(timestamp, rows)
+        logging.info(
+            'Загружена сохраненная выгрузка на %s: %d записей из %s за %.2f с.',
+            snapshot.sync_date(), len(snapshot), self.path, time.perf_counter() - started,
+        )
+        return snapshot
+
+    def save(self, snapshot):
+        """Записывает выгрузку, если в файле лежит другая (испорченный файл считается пустым); замена файла атомарна"""
+        if snapshot.timestamp is not None and self.timestamp() == snapshot.timestamp:
+            return False
+        started = time.perf_counter()
+        tmp_path = f'{self.path}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('timestamp', snapshot.timestamp.isoformat() if snapshot.timestamp else None),
+                ('saved_at', datetime.now().isoformat()),
+            ])
+            conn.executemany('INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?)', (
+                (e.fullname, e.birthday, e.department, e.status, _vacation_text(e.vac_start), _vacation_text(e.vac_end))
+                for e in snapshot.employees
+            ))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, self.path)
+        logging.info(
+            'Выгрузка на %s сохранена в %s за %.2f с.',
+            snapshot.sync_date(), self.path, time.perf_counter() - started,
+        )
+        return True
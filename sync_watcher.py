@@ -0,0 +1,153 @@
+"""Отслеживание новых выгрузок сотрудников в БД.
+
+Если задан канал, наблюдатель держит отдельное соединение с LISTEN <канал> и реагирует
+на NOTIFY сразу; кроме того (и вместо этого, пока соединение недоступно) раз в
+poll_interval проверяет max("current_timestamp"). При изменении временной метки
+подписчики получают событие "новая выгрузка".
+
+Чтобы БД сама сообщала о новых выгрузках, достаточно триггера на уровне оператора:
+
+    CREATE FUNCTION nsi_data.notify_employees_sync() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('remindbot_sync', '');
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER employees_sync_notify
+    AFTER INSERT ON nsi_data.dict_portal_ac_employees_tb_form
+    FOR EACH STATEMENT EXECUTE FUNCTION nsi_data.notify_employees_sync();
+
+А чтобы опрос max("current_timestamp") был дешевым — индекса по этой колонке.
+"""
+import logging
+import select
+import threading
+import time
+
+
+class SyncWatcher:
+    """latest() — текущая метка выгрузки в БД; connect() — новое соединение psycopg2 для LISTEN"""
+
+    def __init__(self, latest, connect=None, channel=None, poll_interval=60, listen_retry=60):
+        self.latest = latest
+        self.connect = connect
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.listen_retry = listen_retry
+        self.timestamp = None
+        self.notifications = 0
+        self.polls = 0
+        self.events = 0
+        self._subscribers = []
+        self._conn = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """callback(timestamp) вызывается из потока наблюдателя при каждой новой выгрузке"""
+        self._subscribers.append(callback)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sync-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._close()
+
+    def stats(self):
+        return {
+            'timestamp': self.timestamp,
+            'listening': self._conn is not None,
+            'notifications': self.notifications,
+            'polls': self.polls,
+            'events': self.events,
+        }
+
+    def check(self, reason='опрос'):
+        """Сверяет метку выгрузки с БД; при изменении оповещает подписчиков. True — выгрузка новая.
+
+        Если обработчик завершился ошибкой, метка не запоминается: следующая проверка
+        снова сообщит о той же выгрузке, и загрузка будет повторена.
+        """
+        try:
+            latest = self.latest()
+        except Exception as e:
+            logging.error('Не удалось проверить наличие новой выгрузки (%s): %s', reason, e)
+            return False
+        if latest is None or latest == self.timestamp:
+            return False
+        previous = self.timestamp
+        self.timestamp = latest
+        self.events += 1
+        logging.info('Новая выгрузка сотрудников на %s (%s).', latest, reason)
+        failed = False
+        for callback in self._subscribers:
+            try:
+                callback(latest)
+            except Exception as e:
+                failed = True
+                logging.error('Ошибка в обработчике новой выгрузки %s: %s', getattr(callback, '__name__', callback), e)
+        if failed:
+            self.timestamp = previous
+            logging.info('Выгрузка на %s будет обработана повторно при следующей проверке.', latest)
+        return True
+
+    def _listen(self):
+        try:
+            conn = self.connect()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN "{self.channel}"')
+        except Exception as e:
+            logging.error('Не удалось подписаться на канал %s, остаемся на опросе: %s', self.channel, e)
+            return None
+        logging.info('Подписка на уведомления о выгрузках: канал %s.', self.channel)
+        return conn
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _wait_notify(self, timeout):
+        """Ждет NOTIFY не дольше timeout; True — пришло уведомление"""
+        try:
+            readable, _, _ = select.select([self._conn], [], [], timeout)
+            if not readable:
+                return False
+            self._conn.poll()
+            received = len(self._conn.notifies)
+            self._conn.notifies.clear()
+        except Exception as e:
+            logging.error('Соединение для уведомлений о выгрузках разорвано: %s', e)
+            self._close()
+            return False
+        self.notifications += received
+        return received > 0
+
+    def _run(self):
+        next_poll = time.monotonic()
+        next_listen = time.monotonic()
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            if self.channel and self.connect and self._conn is None and now >= next_listen:
+                self._conn = self._listen()
+                next_listen = now + self.listen_retry
+            if now >= next_poll:
+                self.polls += 1
+                self.check('опрос')
+                next_poll = time.monotonic() + self.poll_interval
+            # Короткие ожидания, чтобы stop() не ждал весь интервал опроса
+            timeout = max(0, min(next_poll - time.monotonic(), 1.0))
+            if self._conn is not None:
+                if self._wait_notify(timeout):
+                    self.check('NOTIFY')
+            else:
+                self._stopping.wait(timeout)
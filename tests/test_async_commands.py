@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import remindbot2
+from coalesce import Debouncer
+from groups import GroupRegistry
+from outbox import AsyncSender
+
+ADMIN = 1
+
+
+class FakeAsyncBot:
+    def __init__(self, failing=0):
+        self.sent = []
+        self.failing = failing
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.failing:
+            self.failing -= 1
+            raise ConnectionError('Telegram недоступен')
+        self.sent.append((chat_id, text))
+
+
+class NoAsyncSnapshot:
+    async def get(self):
+        raise AssertionError('в режиме stream выгрузка целиком не читается')
+
+
+def command(text):
+    return SimpleNamespace(text=text, chat=SimpleNamespace(id=10), from_user=SimpleNamespace(id=ADMIN))
+
+
+@pytest.fixture
+def async_bot(monkeypatch):
+    bot = FakeAsyncBot()
+    monkeypatch.setattr(remindbot2, 'async_bot', bot)
+    monkeypatch.setattr(remindbot2, 'async_sender', AsyncSender(bot, max_attempts=1))
+    monkeypatch.setattr(remindbot2, 'ADMIN_CHAT_ID', ADMIN)
+    monkeypatch.setattr(remindbot2, 'command_debouncer', Debouncer(0))
+    monkeypatch.setattr(remindbot2, 'async_command_slots', asyncio.Semaphore(1))
+    monkeypatch.setattr(remindbot2, 'group_registry', GroupRegistry(remindbot2.default_groups()))
+    return bot
+
+
+def test_stream_mode_async_command_uses_queries(async_bot, monkeypatch):
+    monkeypatch.setattr(remindbot2, 'ROSTER_QUERY_MODE', 'stream')
+    monkeypatch.setattr(remindbot2, 'async_snapshot_cache', NoAsyncSnapshot())
+    monkeypatch.setitem(remindbot2.QUERY_REPLIES, 'next5', lambda group=None: (f'next5 {group}', None))
+
+    asyncio.run(remindbot2.handle_next5_command_async(command('/next5')))
+    assert async_bot.sent == [(10, 'next5 None')]
+
+
+def test_failed_error_reply_does_not_escape_handler(async_bot, monkeypatch):
+    monkeypatch.setattr(remindbot2, 'ROSTER_QUERY_MODE', 'stream')
+    monkeypatch.setitem(remindbot2.QUERY_REPLIES, 'next5', lambda group=None: ('next5', None))
+    async_bot.failing = 2  # ни ответ, ни сообщение об ошибке не уходят
+
+    asyncio.run(remindbot2.handle_next5_command_async(command('/next5')))
+    assert async_bot.sent == []
@@ -0,0 +1,44 @@
+from datetime import date, datetime
+
+import remindbot2
+from coalesce import SingleFlight
+from groups import GroupRegistry
+from roster import RosterSnapshot
+
+
+class FakeSnapshotCache:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get(self):
+        return self.snapshot
+
+
+def test_image_cache_is_keyed_by_snapshot_timestamp(monkeypatch):
+    today = date.today()
+    birthday = today.strftime('%d.%m')
+    # Две выгрузки в одну минуту: строка "актуально на" у них одинаковая
+    first = RosterSnapshot(datetime(2026, 1, 2, 3, 0, 5), [('Иванов Иван', birthday, 'Руководство', True, None, None)])
+    second = RosterSnapshot(datetime(2026, 1, 2, 3, 0, 40), [('Петров Петр', birthday, 'Руководство', True, None, None)])
+    assert first.sync_date() == second.sync_date()
+
+    cache = FakeSnapshotCache(first)
+    sent = []
+    monkeypatch.setattr(remindbot2, 'ROSTER_QUERY_MODE', 'snapshot')
+    monkeypatch.setattr(remindbot2, 'snapshot_cache', cache)
+    monkeypatch.setattr(remindbot2, 'group_registry', GroupRegistry(remindbot2.default_groups()))
+    monkeypatch.setattr(remindbot2, 'command_flights', SingleFlight())
+    monkeypatch.setattr(remindbot2, 'render_pool', None)
+    monkeypatch.setattr(remindbot2, 'birthday_image_cache', type(remindbot2.birthday_image_cache)())
+    monkeypatch.setattr(remindbot2, 'send_birthday_photo', lambda chat_id, entry: sent.append(entry))
+
+    remindbot2.send_birthday_reminder(1)
+    cache.snapshot = second
+    remindbot2.send_birthday_reminder(1)
+
+    assert len(sent) == 2
+    assert sent[0] is not sent[1]
+    assert list(remindbot2.birthday_image_cache) == [
+        (first.timestamp, today, 'progroup'),
+        (second.timestamp, today, 'progroup'),
+    ]
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from datetime import datetime
+
+import remindbot2
+from groups import GroupRegistry
+from outbox import Outbox
+
+SYNC = datetime(2026, 1, 1, 3, 0)
+
+
+class FakePool:
+    def fetchone(self, sql, params=None):
+        return (SYNC,)
+
+    def fetchall(self, sql, params=None):
+        return [
+            ('Иванов Иван', '01.02', 'Проектный офис', True, '01.03.2026', '14.03.2026'),
+            ('Петров Петр', '02.02', 'Склад', True, None, None),
+        ]
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return len(self.sent)
+
+
+def test_nightly_digest_sends_each_part_separately(monkeypatch):
+    bot = FakeBot()
+    outbox = Outbox(bot, chat_burst=5)
+    cache = remindbot2.SnapshotCache(FakePool())
+    monkeypatch.setattr(remindbot2, 'CHAT_ID', 10)
+    monkeypatch.setattr(remindbot2, 'group_registry', GroupRegistry(remindbot2.default_groups()))
+    monkeypatch.setattr(remindbot2, 'snapshot_cache', cache)
+    monkeypatch.setattr(remindbot2, 'outbox', outbox)
+    monkeypatch.setattr(remindbot2, 'reply_cache', OrderedDict())
+
+    # Все сообщения уже в очереди, когда диспетчер их забирает: склеить их ничто не мешает, кроме coalesce=False
+    remindbot2.send_nightly_digest()
+    outbox.start()
+    outbox.stop()
+
+    assert [chat_id for chat_id, _ in bot.sent] == [10, 10, 10]
+    assert outbox.stats()['coalesced'] == 0
+
+
+class NoSnapshot:
+    def get(self):
+        raise AssertionError('в режиме stream выгрузка целиком не читается')
+
+
+def test_stream_mode_digest_queries_each_part_once(monkeypatch):
+    queried = []
+
+    def query(part):
+        def reply(group=None):
+            queried.append((part, group.name))
+            return f'{part} {group.name}', 'html'
+        return reply
+
+    bot = FakeBot()
+    outbox = Outbox(bot, chat_burst=5)
+    monkeypatch.setattr(remindbot2, 'ROSTER_QUERY_MODE', 'stream')
+    monkeypatch.setattr(remindbot2, 'CHAT_ID', 10)
+    monkeypatch.setattr(remindbot2, 'group_registry', GroupRegistry(remindbot2.default_groups()))
+    monkeypatch.setattr(remindbot2, 'snapshot_cache', NoSnapshot())
+    monkeypatch.setattr(remindbot2, 'outbox', outbox)
+    monkeypatch.setitem(remindbot2.QUERY_REPLIES, 'next5', query('next5'))
+    monkeypatch.setitem(remindbot2.QUERY_REPLIES, 'vacations', query('vacations'))
+
+    remindbot2.send_nightly_digest()
+    outbox.start()
+    outbox.stop()
+
+    assert queried == [('next5', 'progroup'), ('next5', 'bunker'), ('vacations', 'progroup')]
+    assert [text for _, text in bot.sent] == ['next5 progroup', 'next5 bunker', 'vacations progroup']
@@ -0,0 +1,21 @@
+import configparser
+
+from groups import GroupRegistry
+
+
+def test_group_section_with_literal_ilike_patterns():
+    config = configparser.ConfigParser()
+    config.read_string(
+        '[GROUP pro]\n'
+        'departments = %роект%, %руковод%\n'
+        'title = PRO 100%\n'
+        'chats = 10, 20\n'
+    )
+    registry = GroupRegistry.from_config(config, defaults=[])
+    group = registry['pro']
+    assert group.departments == ['%роект%', '%руковод%']
+    assert group.title == 'PRO 100%'
+    assert group.chats == (10, 20)
+    assert group.matcher('Проектный офис')
+    assert group.matcher('Руководство')
+    assert not group.matcher('Склад')
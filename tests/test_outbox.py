@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from telebot import asyncio_helper
+
+from outbox import AsyncSender
+
+
+def too_many_requests(retry_after):
+    return asyncio_helper.ApiTelegramException('sendMessage', None, {
+        'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+        'parameters': {'retry_after': retry_after},
+    })
+
+
+class FlakyBot:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return text
+
+
+def test_async_sender_waits_retry_after(monkeypatch):
+    slept = []
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        slept.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, 'sleep', fake_sleep)
+    bot = FlakyBot([too_many_requests(7)])
+    sender = AsyncSender(bot)
+
+    assert asyncio.run(sender.send_message(10, 'текст')) == 'текст'
+    assert bot.calls == 2
+    assert 7.0 in slept
+    assert sender.stats() == {'sent': 1, 'retries': 1, 'failed': 0}
+
+
+def test_async_sender_gives_up_on_client_errors():
+    error = asyncio_helper.ApiTelegramException('sendMessage', None, {
+        'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user',
+    })
+    bot = FlakyBot([error])
+    sender = AsyncSender(bot)
+
+    with pytest.raises(asyncio_helper.ApiTelegramException):
+        asyncio.run(sender.send_message(10, 'текст'))
+    assert bot.calls == 1
+    assert sender.stats()['failed'] == 1
@@ -0,0 +1,42 @@
+from datetime import date
+
+import pytest
+
+import roster
+from roster import VacationIndex
+
+# Одна дата начала; порядок по ФИО не совпадает с порядком по дате окончания
+ROWS = [
+    ('Борисов Борис', '02.03.2026', '05.03.2026'),
+    ('Антонов Антон', '02.03.2026', '20.03.2026'),
+    ('Васильев Василий', '01.03.2026', '10.03.2026'),
+    ('Абрамов Петр', '02.03.2026', '01.09.2026'),
+]
+
+EXPECTED = [
+    'Васильев Василий',
+    'Абрамов Петр',
+    'Антонов Антон',
+    'Борисов Борис',
+]
+
+
+@pytest.fixture(params=['rows', 'batch'])
+def build(request, monkeypatch):
+    if request.param == 'batch':
+        monkeypatch.setattr(roster, 'BATCH_ROWS', 1)
+    return VacationIndex
+
+
+def test_vacations_with_same_start_are_ordered_by_name(build):
+    index = build(ROWS)
+    first, last = date(2026, 3, 1), date(2026, 3, 31)
+    assert [x[0] for x in index.starting_between(first, last)] == EXPECTED
+    assert [x[0] for x in index.overlapping(first, last)] == EXPECTED
+
+
+def test_updated_index_keeps_name_order(build):
+    index = build(ROWS[:1]).updated([], ROWS[1:])
+    first, last = date(2026, 3, 1), date(2026, 3, 31)
+    assert [x[0] for x in index.starting_between(first, last)] == EXPECTED
+    assert index.updated([ROWS[1]], [])._entries == build(ROWS[:1] + ROWS[2:])._entries
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from roster import RosterSnapshot
+from snapshot_store import SnapshotStore
+
+ROWS = [
+    ('Иванов Иван', '01.02', 'Склад', True, '01.03.2026', '14.03.2026'),
+    ('Петров Петр', '02.02', 'Проектный офис', False, None, None),
+]
+
+
+def test_save_replaces_unreadable_file(tmp_path):
+    path = tmp_path / 'roster_snapshot.sqlite3'
+    path.write_bytes(b'not a sqlite database' * 100)
+    store = SnapshotStore(str(path))
+    assert store.timestamp() is None
+    assert store.load() is None
+
+    snapshot = RosterSnapshot(datetime(2026, 1, 1, 3, 0), ROWS)
+    assert store.save(snapshot)
+
+    loaded = store.load()
+    assert loaded.timestamp == snapshot.timestamp
+    assert loaded.employees == snapshot.employees
+    assert not store.save(snapshot)
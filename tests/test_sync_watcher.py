@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime
+
+import psycopg2
+import pytest
+
+import remindbot2
+from queries import LATEST_TIMESTAMP_SQL
+from sync_watcher import SyncWatcher
+
+FIRST = datetime(2026, 1, 1, 3, 0)
+SECOND = datetime(2026, 1, 2, 3, 0)
+
+
+class FakePool:
+    """Пул соединений, у которого можно сломать чтение выгрузки"""
+
+    def __init__(self, latest):
+        self.latest = latest
+        self.failing_loads = 0
+
+    def fetchone(self, sql, params=None):
+        if sql == LATEST_TIMESTAMP_SQL:
+            return (self.latest,)
+        return (-1,)  # проверка старой выгрузки для разницы: "ее нет", читаем новую целиком
+
+    def fetchall(self, sql, params=None):
+        if self.failing_loads:
+            self.failing_loads -= 1
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        return [('Иванов Иван', '01.02', 'Склад', True, None, None)]
+
+
+def test_failed_callback_keeps_event_pending():
+    calls = []
+
+    def callback(timestamp):
+        calls.append(timestamp)
+        if len(calls) == 1:
+            raise RuntimeError('не загрузилось')
+
+    watcher = SyncWatcher(lambda: FIRST)
+    watcher.subscribe(callback)
+    assert watcher.check()
+    assert watcher.timestamp is None
+    assert watcher.check()
+    assert watcher.timestamp == FIRST
+    assert not watcher.check()
+    assert calls == [FIRST, FIRST]
+
+
+@pytest.fixture
+def bot_state(monkeypatch):
+    pool = FakePool(FIRST)
+    cache = remindbot2.SnapshotCache(pool)
+    cache.refresh()
+    cache.watched = True
+    monkeypatch.setattr(remindbot2, 'snapshot_cache', cache)
+    monkeypatch.setattr(remindbot2, 'ROSTER_QUERY_MODE', 'snapshot')
+    monkeypatch.setattr(remindbot2, 'NOTIFY_VACATION_CHANGES', False)
+    monkeypatch.setattr(remindbot2, 'async_snapshot_cache', None)
+    monkeypatch.setattr(remindbot2, 'prepare_snapshot', lambda snapshot: None)
+    watcher = SyncWatcher(lambda: pool.latest)
+    watcher.subscribe(remindbot2.on_new_sync)
+    watcher.check()
+    return pool, cache, watcher
+
+
+def test_failed_load_after_new_sync_is_retried(bot_state):
+    pool, cache, watcher = bot_state
+    pool.latest = SECOND
+    pool.failing_loads = 1
+
+    watcher.check()
+    assert cache.get().timestamp == FIRST
+    assert watcher.timestamp == FIRST
+
+    watcher.check()
+    assert cache.get().timestamp == SECOND
+    assert watcher.timestamp == SECOND
+
+
+def test_async_cache_adopts_snapshot_loaded_by_watcher(bot_state, monkeypatch):
+    pool, cache, watcher = bot_state
+    async_cache = remindbot2.AsyncSnapshotCache({}, snapshot=cache.get_loaded())
+    async_cache.watched = True
+    monkeypatch.setattr(remindbot2, 'async_snapshot_cache', async_cache)
+
+    async def no_pool():
+        raise AssertionError('асинхронный кэш не должен сам читать выгрузку')
+
+    monkeypatch.setattr(async_cache, '_get_pool', no_pool)
+    pool.latest = SECOND
+    watcher.check()
+
+    snapshot = asyncio.run(async_cache.get())
+    assert snapshot is cache.get_loaded()
+    assert snapshot.timestamp == SECOND
@@ -0,0 +1,153 @@
+"""Прием обновлений Telegram через webhook вместо long polling.
+
+Небольшой встроенный HTTP-сервер принимает POST от Telegram (одно обновление или
+список), кладет их в ограниченную очередь и сразу отвечает 200. Обработчики
+берут обновления из очереди в нескольких рабочих потоках. Если очередь заполнена,
+сервер отвечает 503 с Retry-After, и Telegram повторит доставку позже. При остановке
+новые запросы не принимаются, а уже принятые обновления дообрабатываются.
+"""
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # Telegram держит до 40 одновременных соединений (max_connections в setWebhook),
+    # стандартной очереди listen() из 5 соединений для этого мало
+    request_queue_size = 128
+    # При закрытии сервер дожидается потоков, которые еще принимают запросы
+    daemon_threads = False
+    block_on_close = True
+
+
+class WebhookServer:
+    """Встроенный HTTP-сервер webhook с ограниченной очередью и рабочими потоками.
+
+    dispatch — функция, получающая список обновлений (dict в формате Bot API).
+    """
+
+    def __init__(self, dispatch, host='127.0.0.1', port=8443, path='/telegram', secret=None,
+                 queue_size=100, workers=4, retry_after=5):
+        self.dispatch = dispatch
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.retry_after = retry_after
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._accepting = False
+        self._server = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    @property
+    def address(self):
+        """(host, port), на которых реально слушает сервер (port=0 — выбранный системой)"""
+        return self._server.server_address
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'failed': self.failed,
+                'queued': self._queue.qsize(),
+            }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _make_handler(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                status = webhook._accept(self)
+                self.send_response(status)
+                if status == 503:
+                    self.send_header('Retry-After', str(webhook.retry_after))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug('webhook: ' + format, *args)
+
+        return Handler
+
+    def _accept(self, request):
+        if request.path.split('?', 1)[0] != self.path:
+            return 404
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            return 403
+        try:
+            body = request.rfile.read(int(request.headers.get('Content-Length') or 0))
+            payload = json.loads(body)
+        except (ValueError, UnicodeDecodeError):
+            return 400
+        updates = payload if isinstance(payload, list) else [payload]
+        if not self._accepting:
+            return 503
+        try:
+            self._queue.put_nowait(updates)
+        except queue.Full:
+            self._count('rejected')
+            logging.warning('Очередь webhook заполнена (%s), обновление отклонено.', self._queue.maxsize)
+            return 503
+        self._count('accepted')
+        return 200
+
+    def _work(self):
+        while True:
+            updates = self._queue.get()
+            try:
+                if updates is None:
+                    return
+                self.dispatch(updates)
+                self._count('processed')
+            except Exception as e:
+                self._count('failed')
+                logging.error('Ошибка при обработке обновления из webhook: %s', e)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        self._server = _HTTPServer((self.host, self.port), self._make_handler())
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'webhook-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._server.serve_forever, name='webhook-http', daemon=True)
+        thread.start()
+        self._accepting = True
+        logging.info('Webhook слушает http://%s:%s%s', self.address[0], self.address[1], self.path)
+        return self
+
+    def stop(self, timeout=30):
+        """Плавная остановка: прекращаем прием и дообрабатываем уже принятые обновления"""
+        started = time.monotonic()
+        self._accepting = False
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        # Маркеры остановки встают в очередь после всех принятых обновлений
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(max(0, timeout - (time.monotonic() - started)))
+        alive = sum(thread.is_alive() for thread in self._threads)
+        self._threads = []
+        logging.info('Webhook остановлен за %.1f с: %s%s', time.monotonic() - started, self.stats(),
+                     f', не завершено потоков: {alive}' if alive else '')